@@ -1,16 +1,32 @@
-from flask import Flask, request, jsonify, send_from_directory, redirect, send_file, Response
+from flask import Flask, request, jsonify, send_from_directory, redirect, send_file, Response, g
 from flask_cors import CORS
+from werkzeug.wsgi import wrap_file
 import uuid
 import subprocess
 import os
 import json
 from datetime import datetime
 import glob
+import hashlib
 import base64
 import io
 import zipfile
+import tarfile
+import tempfile
+import stat
 import mimetypes
 import re
+import shutil
+from collections import deque, OrderedDict
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import socket
+import sqlite3
+import fcntl
+import sys
+import time
+import errno
 
 
 app = Flask(__name__)
@@ -18,26 +34,23 @@ app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB
 CORS(app)
 
-# 存储不同模块的上传图片信息
-uploaded_data = {
-    'infrared': {'images': []},     # 红外模块
-    'image': {'images': []},        # 图像模块  
-    'lidar': {'images': []},        # 雷达模块
-    'video': {'images': []}         # 视频模块
-}
-
 # 模块配置
 MODULE_CONFIG = {
     'infrared': {
         'name': '红外数据合成模块',
         'input_dir': '/home/vipuser/Downloads/RGB2TIR/input',
+        'workspace_dir': '/home/vipuser/Downloads/RGB2TIR/workspaces',
         'output_dir': '/home/vipuser/Downloads/RGB2TIR/output',
         'script_path': '/home/vipuser/Downloads/RGB2TIR/run_inference.sh',
+        'worker_handler': '/home/vipuser/Downloads/RGB2TIR/worker_handler.py',  # 常驻模型进程的处理模块，不存在时执行脚本
+        'batch_window': 0.05,  # 合并其他用户推理请求的等待时间（秒），只在使用常驻模型进程时生效
+        'batch_max_inputs': 32,  # 一个批次最多包含的输入文件数
         'supported_formats': ['.jpg', '.jpeg', '.png', '.bmp']
     },
     'image': {
         'name': '图像数据合成模块',
         'input_dir': '/home/vipuser/Downloads/ImageSynthesis/input',
+        'workspace_dir': '/home/vipuser/Downloads/ImageSynthesis/workspaces',
         'output_dir': '/home/vipuser/Downloads/ImageSynthesis/output', 
         'script_path': '/home/vipuser/Downloads/ImageSynthesis/run_inference.sh',
         'supported_formats': ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif', '.webp', 
@@ -47,6 +60,7 @@ MODULE_CONFIG = {
     'lidar': {
         'name': '雷达数据合成模块',
         'input_dir': '/home/vipuser/Downloads/LidarSynthesis/input',
+        'workspace_dir': '/home/vipuser/Downloads/LidarSynthesis/workspaces',
         'output_dir': '/home/vipuser/Downloads/LidarSynthesis/output',
         'script_path': '/home/vipuser/Downloads/LidarSynthesis/run_inference.sh', 
         'supported_formats': ['.pcd', '.las', '.xyz', '.ply']
@@ -54,12 +68,285 @@ MODULE_CONFIG = {
     'video': {
         'name': '视频数据合成模块',
         'input_dir': '/home/vipuser/Downloads/MAP-Net/input',
+        'workspace_dir': '/home/vipuser/Downloads/MAP-Net/workspaces',
         'output_dir': '/home/vipuser/Downloads/MAP-Net/result',
         'script_path': '/home/vipuser/Downloads/MAP-Net/run_mapnet.sh',
+        'worker_handler': '/home/vipuser/Downloads/MAP-Net/worker_handler.py',
         'supported_formats': ['.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv']
     }
 }
 
+# 共享状态存储 - 上传索引、任务记录和日志偏移等跨请求共享的状态都经由状态存储读写。默认保存在进程内存中，
+# 只适用于单进程运行；设置 STATE_STORE_URL=sqlite:///路径 后使用SQLite（WAL模式），同一台机器上的多个工作进程共享状态：
+#   STATE_STORE_URL=sqlite:////home/vipuser/Downloads/app_state/state.db gunicorn -w 4 --threads 8 -b 0.0.0.0:8800 backendServer:app
+# 子进程、GPU显存准入和常驻模型进程仍属于启动它们的进程；推理任务只由持有执行锁的一个进程执行
+STATE_STORE_URL = os.environ.get('STATE_STORE_URL', '')
+STATE_POLL_INTERVAL = 0.5  # 共享存储模式下等待其他进程更新状态的轮询间隔（秒）
+
+class _MemoryStateStore:
+    """进程内状态存储：值以JSON保存，读取得到的都是副本，与SQLite存储的行为一致"""
+    
+    shared = False
+    
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+    
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            value = self._data.get(namespace, {}).get(key)
+        return default if value is None else json.loads(value)
+    
+    def put(self, namespace, key, value):
+        with self._lock:
+            self._data.setdefault(namespace, {})[key] = json.dumps(value)
+    
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+    
+    def items(self, namespace):
+        """命名空间中的全部 {键: 值}"""
+        with self._lock:
+            return {key: json.loads(value) for key, value in self._data.get(namespace, {}).items()}
+    
+    def clear(self, namespace):
+        """删除命名空间中的全部键"""
+        with self._lock:
+            self._data.pop(namespace, None)
+    
+    def update(self, namespace, key, fn):
+        """原子地读取-修改-写回：fn 接收当前值（不存在时为 None）并返回要写入的值，返回 None 时不修改；返回 fn 的结果"""
+        with self._lock:
+            value = fn(self.get(namespace, key))
+            if value is not None:
+                self.put(namespace, key, value)
+            return value
+    
+    def acquire_executor(self):
+        """单进程运行时本进程总是执行进程"""
+        return True
+
+class _SQLiteStateStore:
+    """SQLite状态存储：WAL模式下读取不阻塞写入，写入由 BEGIN IMMEDIATE 串行化；每个线程使用独立的连接"""
+    
+    shared = True
+    
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._executor_lock = None  # (进程ID, 已加锁的文件)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS state (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+            'updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))')
+    
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():  # fork 之后不能继续使用父进程的连接
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def _read(self, conn, namespace, key):
+        row = conn.execute('SELECT value FROM state WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def _write(self, conn, namespace, key, value):
+        conn.execute('INSERT OR REPLACE INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)',
+                     (namespace, key, json.dumps(value), time.time()))
+    
+    def get(self, namespace, key, default=None):
+        value = self._read(self._connection(), namespace, key)
+        return default if value is None else value
+    
+    def put(self, namespace, key, value):
+        self._write(self._connection(), namespace, key, value)
+    
+    def delete(self, namespace, key):
+        self._connection().execute('DELETE FROM state WHERE namespace = ? AND key = ?', (namespace, key))
+    
+    def items(self, namespace):
+        rows = self._connection().execute('SELECT key, value FROM state WHERE namespace = ?', (namespace,))
+        return {key: json.loads(value) for key, value in rows}
+    
+    def clear(self, namespace):
+        self._connection().execute('DELETE FROM state WHERE namespace = ?', (namespace,))
+    
+    def update(self, namespace, key, fn):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            value = fn(self._read(conn, namespace, key))
+            if value is not None:
+                self._write(conn, namespace, key, value)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return value
+    
+    def acquire_executor(self):
+        """尝试成为执行推理任务的进程：对数据库旁的锁文件加 flock，进程退出时自动释放"""
+        if self._executor_lock and self._executor_lock[0] == os.getpid():
+            return True
+        lock_file = open(self.path + '.executor.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._executor_lock = (os.getpid(), lock_file)
+        return True
+
+def _open_state_store(url):
+    """按 STATE_STORE_URL 创建状态存储"""
+    if url.startswith('sqlite:///'):
+        store = _SQLiteStateStore(url[len('sqlite:///'):])
+        print(f"使用SQLite共享状态存储: {store.path}")
+        return store
+    if url not in ('', 'memory'):
+        print(f"不支持的状态存储: {url}，改为使用进程内存储")
+    return _MemoryStateStore()
+
+state_store = _open_state_store(STATE_STORE_URL)
+
+def _process_alive(pid):
+    """进程是否存在（用于判断其他工作进程是否已退出）"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# 用户工作区 - 每个浏览器（cookie）或调用方（X-Workspace-Id 请求头）拥有独立的输入/输出目录和上传索引
+WORKSPACE_COOKIE = 'workspace_id'
+WORKSPACE_HEADER = 'X-Workspace-Id'
+WORKSPACE_TTL_DAYS = 7  # 超过该天数未访问的工作区会被清理
+WORKSPACE_TOUCH_INTERVAL = 60  # 同一工作区两次写入最近访问时间的最小间隔（秒）
+WORKSPACE_EXPIRE_INTERVAL = 600  # 两次清理过期工作区的最小间隔（秒）
+WORKSPACE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+workspace_last_seen = {}  # workspace_id -> 本进程最近一次写入访问时间的时间戳
+workspace_lock = threading.Lock()
+workspace_expire_at = 0  # 本进程下一次清理过期工作区的时间
+
+def _current_workspace_id():
+    """获取当前请求所属的工作区ID，没有时创建新的工作区（通过响应设置cookie）"""
+    if 'workspace_id' in g:
+        return g.workspace_id
+    
+    workspace_id = request.headers.get(WORKSPACE_HEADER) or request.cookies.get(WORKSPACE_COOKIE) or ''
+    workspace_id = workspace_id.strip().lower()
+    if not WORKSPACE_ID_PATTERN.match(workspace_id):
+        workspace_id = uuid.uuid4().hex
+        g.new_workspace_id = workspace_id
+    
+    g.workspace_id = workspace_id
+    now = time.time()
+    _schedule_workspace_expiry(now)
+    with workspace_lock:
+        touch = now - workspace_last_seen.get(workspace_id, 0) >= WORKSPACE_TOUCH_INTERVAL
+        if touch:
+            workspace_last_seen[workspace_id] = now
+    if touch:
+        state_store.put('workspaces', workspace_id, now)
+    return workspace_id
+
+@app.after_request
+def _set_workspace_cookie(response):
+    """为新建的工作区下发cookie"""
+    new_workspace_id = g.get('new_workspace_id')
+    if new_workspace_id:
+        response.set_cookie(WORKSPACE_COOKIE, new_workspace_id, max_age=WORKSPACE_TTL_DAYS * 24 * 3600,
+                            httponly=True, samesite='Lax')
+        response.headers[WORKSPACE_HEADER] = new_workspace_id
+    return response
+
+def _workspace_uploads(module_name, workspace_id=None):
+    """获取工作区中指定模块的上传文件列表（副本，修改需通过 _update_workspace_uploads）"""
+    workspace_id = workspace_id or _current_workspace_id()
+    return state_store.get('uploads', f'{workspace_id}/{module_name}', [])
+
+def _update_workspace_uploads(module_name, workspace_id, fn):
+    """原子地修改工作区的上传文件列表：fn 原地修改列表，返回修改后的列表"""
+    workspace_id = workspace_id or _current_workspace_id()
+    def apply(uploads):
+        uploads = uploads or []
+        fn(uploads)
+        return uploads
+    return state_store.update('uploads', f'{workspace_id}/{module_name}', apply)
+
+def _workspace_root(module_name, workspace_id=None):
+    """获取工作区在指定模块下的根目录"""
+    workspace_id = workspace_id or _current_workspace_id()
+    return os.path.join(MODULE_CONFIG[module_name]['workspace_dir'], workspace_id)
+
+def _workspace_dirs(module_name, workspace_id=None):
+    """获取工作区在指定模块下的 (输入目录, 输出目录)"""
+    root = _workspace_root(module_name, workspace_id)
+    return os.path.join(root, 'input'), os.path.join(root, 'output')
+
+def _clear_directory(path):
+    """递归清空目录中的所有文件和子目录，保留目录本身"""
+    if not os.path.exists(path):
+        return
+    for item in os.listdir(path):
+        item_path = os.path.join(path, item)
+        if os.path.isdir(item_path) and not os.path.islink(item_path):
+            shutil.rmtree(item_path)
+        else:
+            os.remove(item_path)
+
+def _schedule_workspace_expiry(now):
+    """每隔 WORKSPACE_EXPIRE_INTERVAL 在后台线程中清理一次过期工作区，请求线程不等待清理和内容存储的遍历"""
+    global workspace_expire_at
+    with workspace_lock:
+        if now < workspace_expire_at:
+            return
+        workspace_expire_at = now + WORKSPACE_EXPIRE_INTERVAL
+    
+    def expire():
+        try:
+            _expire_workspaces()
+        except Exception as e:
+            print(f"清理过期工作区失败: {str(e)}")
+    threading.Thread(target=expire, name='workspace-expiry', daemon=True).start()
+
+def _expire_workspaces():
+    """清理长时间未访问的工作区（上传索引和磁盘目录）"""
+    cutoff = time.time() - WORKSPACE_TTL_DAYS * 24 * 3600
+    expired = [workspace_id for workspace_id, last_seen in state_store.items('workspaces').items() if last_seen < cutoff]
+    for workspace_id in expired:
+        state_store.delete('workspaces', workspace_id)
+        for module_name in MODULE_CONFIG:
+            state_store.delete('uploads', f'{workspace_id}/{module_name}')
+        state_store.clear(f'inference_workspace/{workspace_id}')
+        with workspace_lock:
+            workspace_last_seen.pop(workspace_id, None)
+    if expired:
+        # 数据集文件夹保留给训练使用，只解除登记（之后其他工作区也不能覆盖）
+        for folder_name, owner in state_store.items('upload_folders').items():
+            if owner['workspace_id'] in expired:
+                state_store.delete('upload_folders', folder_name)
+    for workspace_id in expired:
+        for module_name in MODULE_CONFIG:
+            workspace_root = _workspace_root(module_name, workspace_id)
+            shutil.rmtree(workspace_root, ignore_errors=True)
+            _dir_index_forget(workspace_root)
+        print(f"已清理过期工作区: {workspace_id}")
+    if expired:
+        with output_manifest_lock:
+            for key in [key for key in output_manifests if key[1] in expired]:
+                output_manifests.pop(key, None)
+        _prune_blob_store()
+
 @app.route('/')
 def home():
     """重定向到主页面"""
@@ -80,19 +367,16 @@ def static_files(filename):
 
 @app.route('/result/videos/<filename>')
 def serve_video_results(filename):
-    """提供视频结果文件服务"""
-    video_output_dir = '/home/vipuser/Downloads/MAP-Net/result/videos'
-    # 也检查主结果目录
-    main_output_dir = '/home/vipuser/Downloads/MAP-Net/result'
-    
-    # 首先检查 videos 子目录
-    if os.path.exists(os.path.join(video_output_dir, filename)):
-        return send_from_directory(video_output_dir, filename)
-    # 然后检查主目录
-    elif os.path.exists(os.path.join(main_output_dir, filename)):
-        return send_from_directory(main_output_dir, filename)
-    else:
-        return "Video file not found", 404
+    """提供当前工作区的视频结果文件服务"""
+    _, main_output_dir = _workspace_dirs('video')
+    video_output_dir = os.path.join(main_output_dir, 'videos')
+    
+    # 首先检查 videos 子目录，然后检查主目录
+    for directory in (video_output_dir, main_output_dir):
+        file_path = _safe_join(directory, filename)
+        if file_path and os.path.isfile(file_path):
+            return _serve_media_file(file_path)
+    return "Video file not found", 404
 
 @app.route('/api/')
 def api_info():
@@ -113,7 +397,8 @@ def api_info():
         'api_endpoints': {
             'upload': 'POST /upload - 上传图片（红外生成服务）',
             'upload_status': 'GET /upload_status - 检查上传状态', 
-            'run_inference': 'POST /run_inference - 运行红外生成推理',
+            'run_inference': 'POST /run_inference - 提交红外生成推理任务，返回任务ID',
+            'jobs': 'GET /jobs/<job_id> - 查询推理任务状态、队列位置和结果',
             'clear_cache': 'POST /clear_cache - 清除缓存',
             'clear_cuda': 'POST /clear_cuda - 清理CUDA显存'
         }
@@ -159,6 +444,151 @@ def platform_status():
         }
     })
 
+# 上传内容存储 - 上传文件边接收边计算SHA-256，相同内容在磁盘上只保存一份；
+# 工作区中的文件是指向内容文件的硬链接，硬链接数即引用计数，只剩存储本身引用的内容文件会被清理。
+# 共享 inode 的文件不能原地改写：交给可能写文件的脚本前用 _copy_on_write 复制，训练脚本读写的数据集文件夹不做去重
+BLOB_STORE_DIR = '/home/vipuser/Downloads/upload_blobs'
+BLOB_COPY_CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409  # ioctl：在支持的文件系统（btrfs/xfs）上创建共享数据块的写时复制副本
+
+blob_store_lock = threading.Lock()
+
+def _blob_path(digest):
+    """内容文件路径（按哈希前两位分目录）"""
+    return os.path.join(BLOB_STORE_DIR, digest[:2], digest)
+
+def _link_blob(digest, tmp_path, dest_path):
+    """将临时文件收入内容存储（已有相同内容时丢弃），并在目标位置创建硬链接；返回是否命中已有内容
+    
+    无法硬链接（如跨文件系统）时目标位置是独立的副本：新内容不收入存储，避免存储中留下没有引用计数的内容文件。
+    """
+    blob_path = _blob_path(digest)
+    tmp_dest = f'{dest_path}.{uuid.uuid4().hex}.tmp'
+    with blob_store_lock:
+        deduplicated = os.path.exists(blob_path)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            os.link(blob_path if deduplicated else tmp_path, tmp_dest)
+        except OSError:
+            if deduplicated:
+                shutil.copyfile(blob_path, tmp_dest)
+                os.remove(tmp_path)
+            else:
+                shutil.move(tmp_path, tmp_dest)
+            os.replace(tmp_dest, dest_path)
+            return False
+        if deduplicated:
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, blob_path)
+        os.replace(tmp_dest, dest_path)
+    return deduplicated
+
+def _copy_on_write(src, dst):
+    """复制文件：文件系统支持时使用 reflink（写时复制，不占用额外空间），否则完整复制"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        shutil.copyfileobj(fsrc, fdst, BLOB_COPY_CHUNK_SIZE)
+
+def _save_upload(stream, dest_path, deduplicate=True):
+    """边读取数据流边计算哈希写入内容存储，并链接到 dest_path；返回 (sha256, 是否命中已有内容)
+    
+    deduplicate 为 False 时 dest_path 是独立的文件（不与其他引用共享 inode），用于会被原地改写的文件。
+    """
+    tmp_dir = BLOB_STORE_DIR if deduplicate else os.path.dirname(dest_path)
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix='.incoming-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                block = stream.read(BLOB_COPY_CHUNK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+        if not deduplicate:
+            os.chmod(tmp_path, 0o644)  # mkstemp 创建的文件只有所有者可读
+            os.replace(tmp_path, dest_path)
+            return digest.hexdigest(), False
+        return digest.hexdigest(), _link_blob(digest.hexdigest(), tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _save_upload_file(path, dest_path):
+    """将已在磁盘上的完整文件（如分片上传结果）收入内容存储并链接到 dest_path；失败时尽量把文件放回 path"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOB_COPY_CHUNK_SIZE), b''):
+            digest.update(block)
+    # 存储目录与工作区可能不在同一文件系统，先移动到存储目录再收入
+    os.makedirs(BLOB_STORE_DIR, exist_ok=True)
+    tmp_path = os.path.join(BLOB_STORE_DIR, f'.incoming-{uuid.uuid4().hex}')
+    shutil.move(path, tmp_path)
+    try:
+        return digest.hexdigest(), _link_blob(digest.hexdigest(), tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            try:
+                shutil.move(tmp_path, path)
+            except OSError:
+                os.remove(tmp_path)
+        raise
+
+def _prune_blob_store(digests=None):
+    """删除不再被任何工作区文件引用的内容文件；digests 为空时检查整个存储"""
+    if digests is None:
+        digests = []
+        for root, _, names in os.walk(BLOB_STORE_DIR):
+            digests.extend(name for name in names if not name.startswith('.'))
+    removed = 0
+    with blob_store_lock:
+        for digest in digests:
+            try:
+                if os.stat(_blob_path(digest)).st_nlink <= 1:
+                    os.remove(_blob_path(digest))
+                    removed += 1
+            except OSError:
+                continue
+    if removed:
+        print(f"已清理 {removed} 个未被引用的上传内容文件")
+
+def _register_module_upload(module_name, unique_filename, original_filename, save_path, sha256, deduplicated):
+    """将已保存到输入目录的文件登记到工作区，返回上传接口的响应内容"""
+    config = MODULE_CONFIG[module_name]
+    
+    # 将新文件信息添加到对应模块的列表中
+    file_info = {
+        'filename': unique_filename,
+        'original_name': original_filename,
+        'upload_time': datetime.now().isoformat(),
+        'path': save_path,
+        'module': module_name,
+        'sha256': sha256
+    }
+    
+    uploads = _update_workspace_uploads(module_name, None, lambda uploads: uploads.append(file_info))
+    
+    if module_name == 'video':
+        # 上传后立即在后台转码为网页兼容格式
+        _schedule_video_transcodes([unique_filename], 'input', _current_workspace_id())
+    
+    return {
+        'msg': f'文件已保存到{config["name"]}: {unique_filename}',
+        'filename': unique_filename,
+        'original_name': original_filename,
+        'module': module_name,
+        'sha256': sha256,
+        'deduplicated': deduplicated,
+        'total_images': len(uploads)
+    }
+
 # 通用上传函数
 def handle_module_upload(module_name):
     """处理指定模块的文件上传"""
@@ -170,7 +600,7 @@ def handle_module_upload(module_name):
         return jsonify({'error': 'No file uploaded'}), 400
     
     config = MODULE_CONFIG[module_name]
-    input_dir = config['input_dir']
+    input_dir, _ = _workspace_dirs(module_name)
     supported_formats = config['supported_formats']
     
     # 创建输入目录
@@ -190,35 +620,95 @@ def handle_module_upload(module_name):
     save_path = os.path.join(input_dir, unique_filename)
     
     try:
-        file.save(save_path)
-        
-        # 将新文件信息添加到对应模块的列表中
-        file_info = {
-            'filename': unique_filename,
-            'original_name': original_filename,
-            'upload_time': datetime.now().isoformat(),
-            'path': save_path,
-            'module': module_name
-        }
-        
-        uploaded_data[module_name]['images'].append(file_info)
-        
-        return jsonify({
-            'msg': f'文件已保存到{config["name"]}: {unique_filename}',
-            'filename': unique_filename,
-            'original_name': original_filename,
-            'module': module_name,
-            'total_images': len(uploaded_data[module_name]['images'])
-        })
+        sha256, deduplicated = _save_upload(file.stream, save_path)
+        return jsonify(_register_module_upload(module_name, unique_filename, original_filename, save_path,
+                                               sha256, deduplicated))
     except Exception as e:
         return jsonify({'error': f'保存失败: {str(e)}'}), 500
 
+# 文件夹上传 - 逐个文件上传，或整个文件夹打包为 tar/zip 一次上传并在服务端边接收边解压
+USER_INPUT_BASE = '/home/vipuser/home/img/userInput/Synthetic_NSVF'
+FOLDER_ARCHIVE_TYPES = {
+    'application/x-tar': 'tar',
+    'application/x-gtar': 'tar',
+    'application/gzip': 'tar',
+    'application/x-gzip': 'tar',
+    'application/x-bzip2': 'tar',
+    'application/x-xz': 'tar',
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip'
+}
+
+def _clean_folder_relative_path(relative_path, folder_name):
+    """处理相对路径，去除开头的文件夹名称避免重复"""
+    if relative_path.startswith(folder_name + '/'):
+        # 去除 "folder_name/" 部分，保留子路径
+        return relative_path[len(folder_name) + 1:]
+    elif relative_path.startswith(folder_name + os.sep):
+        # 去除 "folder_name\" 部分（Windows风格）
+        return relative_path[len(folder_name) + 1:]
+    # 如果不以文件夹名开头，直接使用原路径
+    return relative_path
+
+def _folder_upload_dir(folder_name):
+    """用户上传文件夹的保存目录，名称越界（如 ..）或不是单层目录名时返回 None"""
+    os.makedirs(USER_INPUT_BASE, exist_ok=True)
+    folder_input_dir = _safe_join(USER_INPUT_BASE, folder_name)
+    if folder_input_dir is None or os.path.dirname(folder_input_dir) != os.path.realpath(USER_INPUT_BASE):
+        return None
+    return folder_input_dir
+
+def _claim_upload_folder(folder_input_dir):
+    """文件夹目录由所有工作区共享（训练脚本从这里读取数据集），按名称登记归属的工作区：
+    第一次上传时登记，之后只有同一工作区可以继续上传；没有登记的已有目录不允许覆盖。返回是否可以写入"""
+    folder_name = os.path.basename(folder_input_dir)
+    workspace_id = _current_workspace_id()
+    exists = os.path.exists(folder_input_dir)
+    def claim(current):
+        if current is None and not exists:
+            return {'workspace_id': workspace_id, 'created_at': datetime.now().isoformat()}
+        return None
+    state_store.update('upload_folders', folder_name, claim)
+    owner = state_store.get('upload_folders', folder_name)
+    return owner is not None and owner['workspace_id'] == workspace_id
+
+def _release_empty_upload_folder(folder_input_dir):
+    """文件夹中没有任何文件时（例如压缩包上传中途失败）删除目录并解除当前工作区的登记"""
+    for _, _, names in os.walk(folder_input_dir):
+        if names:
+            return
+    shutil.rmtree(folder_input_dir, ignore_errors=True)
+    _dir_index_forget(folder_input_dir)
+    folder_name = os.path.basename(folder_input_dir)
+    owner = state_store.get('upload_folders', folder_name)
+    if owner is not None and owner['workspace_id'] == _current_workspace_id():
+        state_store.delete('upload_folders', folder_name)
+
+def _folder_file_info(module_name, folder_name, file_save_path, original_name, relative_path, cleaned_relative_path, sha256):
+    """文件夹上传中单个文件的登记信息"""
+    return {
+        'filename': os.path.basename(file_save_path),
+        'original_name': original_name,
+        'relative_path': relative_path,
+        'cleaned_relative_path': cleaned_relative_path,
+        'folder_name': folder_name,
+        'upload_time': datetime.now().isoformat(),
+        'path': file_save_path,
+        'module': module_name,
+        'sha256': sha256,
+        'is_folder_upload': True
+    }
+
 # 文件夹上传处理函数
 def handle_folder_upload(module_name):
     """处理指定模块的文件夹上传"""
     if module_name not in MODULE_CONFIG:
         return jsonify({'error': f'不支持的模块: {module_name}'}), 400
     
+    # 请求体是整个文件夹的压缩包
+    if request.mimetype in FOLDER_ARCHIVE_TYPES:
+        return handle_folder_archive_upload(module_name)
+    
     file = request.files.get('file')
     if not file:
         return jsonify({'error': 'No file uploaded'}), 400
@@ -227,78 +717,125 @@ def handle_folder_upload(module_name):
     relative_path = request.form.get('relative_path', '')
     folder_name = request.form.get('folder_name', 'uploaded_folder')
     
-    config = MODULE_CONFIG[module_name]
-    
-    # 创建专门的用户输入目录 /home/vipuser/home/img/userInput/Synthetic_NSVF
-    user_input_base = '/home/vipuser/home/img/userInput/Synthetic_NSVF'
-    os.makedirs(user_input_base, exist_ok=True)
-    
     # 创建以文件夹名命名的目录，保留文件夹本身
-    folder_input_dir = os.path.join(user_input_base, folder_name)
+    folder_input_dir = _folder_upload_dir(folder_name)
+    if folder_input_dir is None:
+        return jsonify({'error': f'无效的文件夹名称: {folder_name}'}), 400
+    if not _claim_upload_folder(folder_input_dir):
+        return jsonify({'error': f'文件夹 {folder_name} 已存在，请使用其他名称'}), 409
     os.makedirs(folder_input_dir, exist_ok=True)
     
-    # 处理相对路径，去除开头的文件夹名称避免重复
-    if relative_path:
-        # 如果relative_path以folder_name开头，则去除它
-        if relative_path.startswith(folder_name + '/'):
-            # 去除 "folder_name/" 部分，保留子路径
-            cleaned_relative_path = relative_path[len(folder_name) + 1:]
-        elif relative_path.startswith(folder_name + os.sep):
-            # 去除 "folder_name\" 部分（Windows风格）
-            cleaned_relative_path = relative_path[len(folder_name) + 1:]
-        else:
-            # 如果不以文件夹名开头，直接使用原路径
-            cleaned_relative_path = relative_path
-        
-        # 保存到文件夹目录下，保持子文件夹结构
-        if cleaned_relative_path:
-            file_save_path = os.path.join(folder_input_dir, cleaned_relative_path)
-            # 确保父目录存在
-            os.makedirs(os.path.dirname(file_save_path), exist_ok=True)
-        else:
-            # 如果清理后路径为空，直接保存到文件夹根目录
-            original_filename = file.filename or 'unnamed'
-            file_save_path = os.path.join(folder_input_dir, original_filename)
-    else:
-        # 如果没有相对路径，直接保存到文件夹根目录
-        original_filename = file.filename or 'unnamed'
-        file_save_path = os.path.join(folder_input_dir, original_filename)
+    # 保存到文件夹目录下，保持子文件夹结构；清理后路径为空时直接保存到文件夹根目录
+    cleaned_relative_path = _clean_folder_relative_path(relative_path, folder_name) if relative_path else ''
+    file_save_path = _safe_join(folder_input_dir, cleaned_relative_path or os.path.basename(file.filename or 'unnamed'))
+    if file_save_path is None or file_save_path == folder_input_dir:
+        return jsonify({'error': f'无效的文件路径: {relative_path}'}), 400
     
     # 对于文件夹上传，我们允许所有文件类型，不进行格式检查
     # 这样可以支持配置文件、标注文件、脚本文件等各种类型
     
     try:
-        file.save(file_save_path)
+        os.makedirs(os.path.dirname(file_save_path), exist_ok=True)
+        sha256, deduplicated = _save_upload(file.stream, file_save_path, deduplicate=False)
         
         # 将新文件信息添加到对应模块的列表中
-        file_info = {
-            'filename': os.path.basename(file_save_path),
-            'original_name': file.filename or 'unnamed',
-            'relative_path': relative_path,
-            'cleaned_relative_path': cleaned_relative_path if relative_path else '',
-            'folder_name': folder_name,
-            'upload_time': datetime.now().isoformat(),
-            'path': file_save_path,
-            'module': module_name,
-            'is_folder_upload': True
-        }
-        
-        uploaded_data[module_name]['images'].append(file_info)
+        file_info = _folder_file_info(module_name, folder_name, file_save_path,
+                                      file.filename or 'unnamed', relative_path, cleaned_relative_path, sha256)
+        uploads = _update_workspace_uploads(module_name, None, lambda uploads: uploads.append(file_info))
         
         return jsonify({
             'msg': f'文件已保存到 Synthetic_NSVF: {cleaned_relative_path if relative_path else file.filename}',
             'filename': os.path.basename(file_save_path),
             'original_name': file.filename,
             'relative_path': relative_path,
-            'cleaned_relative_path': cleaned_relative_path if relative_path else '',
+            'cleaned_relative_path': cleaned_relative_path,
             'folder_name': folder_name,
             'save_path': file_save_path,
             'module': module_name,
-            'total_files': len(uploaded_data[module_name]['images'])
+            'sha256': sha256,
+            'deduplicated': deduplicated,
+            'total_files': len(uploads)
         })
     except Exception as e:
         return jsonify({'error': f'保存失败: {str(e)}'}), 500
 
+def _archive_members(archive_type, stream):
+    """依次产出压缩包中的普通文件 (成员路径, 文件对象)；tar 直接从请求流中流式读取，zip 需要先落盘到临时文件"""
+    if archive_type == 'tar':
+        with tarfile.open(fileobj=stream, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member)
+        return
+    with tempfile.TemporaryFile() as spool:
+        shutil.copyfileobj(stream, spool, 1024 * 1024)
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as archive:
+            for info in archive.infolist():
+                # 跳过目录和符号链接
+                if info.is_dir() or stat.S_ISLNK(info.external_attr >> 16):
+                    continue
+                with archive.open(info) as member_file:
+                    yield info.filename, member_file
+
+def handle_folder_archive_upload(module_name):
+    """将请求体中的 tar/zip 压缩包解压到用户上传文件夹，返回一份文件清单"""
+    archive_type = FOLDER_ARCHIVE_TYPES[request.mimetype]
+    folder_name = request.args.get('folder_name', 'uploaded_folder')
+    folder_input_dir = _folder_upload_dir(folder_name)
+    if folder_input_dir is None:
+        return jsonify({'error': f'无效的文件夹名称: {folder_name}'}), 400
+    if not _claim_upload_folder(folder_input_dir):
+        return jsonify({'error': f'文件夹 {folder_name} 已存在，请使用其他名称'}), 409
+    
+    file_infos = []
+    skipped = []
+    total_bytes = 0
+    deduplicated_count = 0
+    created_dirs = set()
+    error = None
+    try:
+        for member_name, member_file in _archive_members(archive_type, request.stream):
+            relative_path = member_name[2:] if member_name.startswith('./') else member_name
+            cleaned_relative_path = _clean_folder_relative_path(relative_path, folder_name)
+            file_save_path = _safe_join(folder_input_dir, cleaned_relative_path) if cleaned_relative_path else None
+            if file_save_path is None or file_save_path == folder_input_dir:
+                skipped.append(member_name)
+                continue
+            parent = os.path.dirname(file_save_path)
+            if parent not in created_dirs:
+                os.makedirs(parent, exist_ok=True)
+                created_dirs.add(parent)
+            sha256, deduplicated = _save_upload(member_file, file_save_path, deduplicate=False)
+            total_bytes += os.path.getsize(file_save_path)
+            deduplicated_count += deduplicated
+            file_infos.append(_folder_file_info(module_name, folder_name, file_save_path,
+                                                os.path.basename(member_name), member_name, cleaned_relative_path, sha256))
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+        error = (f'无法解析压缩包: {str(e)}', 400)
+    except OSError as e:
+        error = (f'保存失败: {str(e)}', 500)
+    finally:
+        # 已解压的文件一次性登记；客户端断开或请求体超限（HTTPException）时也登记，之后可通过清除缓存删除
+        uploads = _update_workspace_uploads(module_name, None, lambda uploads: uploads.extend(file_infos))
+        if not file_infos:
+            _release_empty_upload_folder(folder_input_dir)
+    manifest = {
+        'folder_name': folder_name,
+        'save_path': folder_input_dir,
+        'module': module_name,
+        'files': [file_info['cleaned_relative_path'] for file_info in file_infos],
+        'file_count': len(file_infos),
+        'total_bytes': total_bytes,
+        'deduplicated_count': deduplicated_count,
+        'skipped': skipped,
+        'total_files': len(uploads)
+    }
+    if error:
+        return jsonify(dict(manifest, error=error[0])), error[1]
+    print(f"文件夹压缩包已解压: {folder_name}, {len(file_infos)} 个文件")
+    return jsonify(dict(manifest, msg=f'文件夹已保存到 Synthetic_NSVF: {folder_name} ({len(file_infos)} 个文件)'))
+
 # 模块化的上传API路由
 @app.route('/upload/<module_name>', methods=['POST'])
 def upload_to_module(module_name):
@@ -317,144 +854,1725 @@ def upload():
     """红外数据合成模块 - 上传图片接口（向后兼容）"""
     return handle_module_upload('infrared')
 
+# 分片上传 - 大文件按固定大小分片，分片可并行、乱序上传并直接写入目标文件的最终偏移（pwrite），中断后只需补传缺失分片
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 默认分片大小
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 16 * 1024 * 1024 * 1024  # 单个文件大小上限
+CHUNKED_UPLOAD_TTL_HOURS = 24  # 超过该时间没有新分片的上传会被清理
+CHUNKED_UPLOAD_DIR = 'chunked'  # 工作区中存放未完成上传的子目录
+CHUNK_CHECKSUM_HEADER = 'X-Chunk-SHA256'
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+def _chunked_upload_dir(module_name, workspace_id=None):
+    """工作区中存放未完成上传的目录"""
+    return os.path.join(_workspace_root(module_name, workspace_id), CHUNKED_UPLOAD_DIR)
+
+def _chunked_upload_paths(module_name, upload_id, workspace_id=None):
+    """分片上传的 (数据文件, 状态文件) 路径"""
+    root = _chunked_upload_dir(module_name, workspace_id)
+    return os.path.join(root, f'{upload_id}.part'), os.path.join(root, f'{upload_id}.json')
+
+def _write_chunked_upload_state(session):
+    """把上传状态写入状态文件（写临时文件后替换），服务重启后仍可续传"""
+    tmp_path = f"{session['state_path']}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(session, f)
+    os.replace(tmp_path, session['state_path'])
+
+def _update_chunked_upload(upload_id, fn):
+    """原子地修改上传会话（分片可能由不同的工作进程并发接收）：fn 原地修改会话并返回，返回 None 表示拒绝修改"""
+    def apply(session):
+        session = fn(session) if session is not None else None
+        if session is not None:
+            session['received'].sort()
+            _write_chunked_upload_state(session)
+        return session
+    return state_store.update('chunked_uploads', upload_id, apply)
+
+def _remove_chunked_upload(session):
+    """删除上传会话及其磁盘文件"""
+    state_store.delete('chunked_uploads', session['upload_id'])
+    for path in (session['part_path'], session['state_path']):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _get_chunked_upload(module_name, upload_id):
+    """获取当前工作区的上传会话，状态存储中没有时从状态文件恢复，不存在时返回 None"""
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        return None
+    workspace_id = _current_workspace_id()
+    session = state_store.get('chunked_uploads', upload_id)
+    if session is None:
+        part_path, state_path = _chunked_upload_paths(module_name, upload_id, workspace_id)
+        try:
+            with open(state_path) as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(part_path):
+            return None
+        state_store.put('chunked_uploads', upload_id, session)
+    if session['module'] != module_name or session['workspace_id'] != workspace_id:
+        return None
+    return session
+
+def _prune_chunked_uploads(module_name, workspace_id):
+    """清理工作区中长时间没有新分片的上传"""
+    root = _chunked_upload_dir(module_name, workspace_id)
+    cutoff = time.time() - CHUNKED_UPLOAD_TTL_HOURS * 3600
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        upload_id, ext = os.path.splitext(name)
+        if ext != '.json' or not UPLOAD_ID_PATTERN.match(upload_id):
+            continue
+        try:
+            if os.path.getmtime(os.path.join(root, name)) >= cutoff:
+                continue
+        except OSError:
+            continue
+        part_path, state_path = _chunked_upload_paths(module_name, upload_id, workspace_id)
+        _remove_chunked_upload({'upload_id': upload_id, 'part_path': part_path, 'state_path': state_path})
+        print(f"已清理过期分片上传: {upload_id}")
+
+def _chunked_upload_view(session):
+    """上传会话的接口表示"""
+    received = session['received']
+    return {
+        'upload_id': session['upload_id'],
+        'module': session['module'],
+        'filename': session['original_name'],
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'total_chunks': session['total_chunks'],
+        'received': received,
+        'received_count': len(received),
+        'status': session['status']
+    }
+
+def _pwrite_all(fd, data, offset):
+    """在指定偏移写入全部数据（处理部分写入）"""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+@app.route('/upload_chunks/<module_name>', methods=['POST'])
+def init_chunked_upload(module_name):
+    """创建分片上传会话并预分配目标文件"""
+    if module_name not in MODULE_CONFIG:
+        return jsonify({'error': f'不支持的模块: {module_name}'}), 400
+    
+    config = MODULE_CONFIG[module_name]
+    data = request.get_json(silent=True) or {}
+    original_filename = data.get('filename') or 'unnamed'
+    file_extension = os.path.splitext(original_filename)[1].lower()
+    if file_extension not in config['supported_formats']:
+        return jsonify({
+            'error': f'{config["name"]}不支持此文件格式。支持的格式: {", ".join(config["supported_formats"])}'
+        }), 400
+    
+    try:
+        size = int(data.get('size'))
+        chunk_size = int(data.get('chunk_size') or CHUNKED_UPLOAD_CHUNK_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({'error': '缺少有效的文件大小或分片大小'}), 400
+    if not 0 < size <= CHUNKED_UPLOAD_MAX_SIZE:
+        return jsonify({'error': f'文件大小必须在 1 到 {CHUNKED_UPLOAD_MAX_SIZE} 字节之间'}), 400
+    if not 0 < chunk_size <= CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        return jsonify({'error': f'分片大小必须在 1 到 {CHUNKED_UPLOAD_MAX_CHUNK_SIZE} 字节之间'}), 400
+    
+    workspace_id = _current_workspace_id()
+    _prune_chunked_uploads(module_name, workspace_id)
+    
+    upload_id = uuid.uuid4().hex
+    part_path, state_path = _chunked_upload_paths(module_name, upload_id, workspace_id)
+    session = {
+        'upload_id': upload_id,
+        'module': module_name,
+        'workspace_id': workspace_id,
+        'original_name': original_filename,
+        'extension': file_extension,
+        'size': size,
+        'chunk_size': chunk_size,
+        'total_chunks': (size + chunk_size - 1) // chunk_size,
+        'created_at': datetime.now().isoformat(),
+        'status': 'uploading',
+        'part_path': part_path,
+        'state_path': state_path,
+        'received': []
+    }
+    try:
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+        _write_chunked_upload_state(session)
+    except OSError as e:
+        _remove_chunked_upload(session)
+        return jsonify({'error': f'创建上传失败: {str(e)}'}), 500
+    
+    state_store.put('chunked_uploads', upload_id, session)
+    return jsonify(_chunked_upload_view(session))
+
+@app.route('/upload_chunks/<module_name>/<upload_id>', methods=['GET'])
+def get_chunked_upload(module_name, upload_id):
+    """查询上传会话，用于断点续传时获取已收到的分片"""
+    session = _get_chunked_upload(module_name, upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+    return jsonify(_chunked_upload_view(session))
+
+@app.route('/upload_chunks/<module_name>/<upload_id>/<int:index>', methods=['PUT'])
+def upload_chunk(module_name, upload_id, index):
+    """写入一个分片：直接写到目标文件中的最终偏移，带校验头时验证SHA-256"""
+    session = _get_chunked_upload(module_name, upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+    if not 0 <= index < session['total_chunks']:
+        return jsonify({'error': f'分片序号超出范围: {index}'}), 400
+    
+    offset = index * session['chunk_size']
+    expected = min(session['chunk_size'], session['size'] - offset)
+    if request.content_length != expected:
+        return jsonify({'error': f'分片 {index} 的大小应为 {expected} 字节'}), 400
+    checksum = (request.headers.get(CHUNK_CHECKSUM_HEADER) or '').strip().lower()
+    
+    def begin(session):
+        if session['status'] != 'uploading':
+            return None
+        # 重传的分片在校验通过前视为未收到
+        if index in session['received']:
+            session['received'].remove(index)
+        return session
+    if _update_chunked_upload(upload_id, begin) is None:
+        return jsonify({'error': '上传已结束'}), 409
+    try:
+        fd = os.open(session['part_path'], os.O_WRONLY)
+    except FileNotFoundError:
+        # 数据文件已被并发的取消或完成操作移走
+        current = state_store.get('chunked_uploads', upload_id)
+        if current is None or current['status'] != 'uploading':
+            return jsonify({'error': '上传已结束'}), 409
+        _remove_chunked_upload(current)
+        return jsonify({'error': '上传数据已丢失，请重新上传'}), 404
+    except OSError as e:
+        return jsonify({'error': f'写入分片失败: {str(e)}'}), 500
+    
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        while written < expected:
+            block = request.stream.read(min(1024 * 1024, expected - written))
+            if not block:
+                break
+            _pwrite_all(fd, block, offset + written)
+            digest.update(block)
+            written += len(block)
+    except OSError as e:
+        return jsonify({'error': f'写入分片失败: {str(e)}'}), 500
+    finally:
+        os.close(fd)
+    
+    if written != expected:
+        return jsonify({'error': f'分片 {index} 数据不完整'}), 400
+    if checksum and digest.hexdigest() != checksum:
+        return jsonify({'error': f'分片 {index} 校验失败'}), 400
+    
+    def mark_received(session):
+        if session['status'] != 'uploading':
+            return None
+        if index not in session['received']:
+            session['received'].append(index)
+        return session
+    session = _update_chunked_upload(upload_id, mark_received)
+    if session is None:
+        return jsonify({'error': '上传已结束'}), 409
+    return jsonify({
+        'index': index,
+        'sha256': digest.hexdigest(),
+        'received_count': len(session['received']),
+        'total_chunks': session['total_chunks']
+    })
+
+@app.route('/upload_chunks/<module_name>/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(module_name, upload_id):
+    """所有分片到齐后将文件移入输入目录并登记，响应与普通上传接口一致"""
+    session = _get_chunked_upload(module_name, upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+    
+    missing = []
+    def begin_complete(session):
+        if session['status'] != 'uploading':
+            return None
+        received = set(session['received'])
+        missing.extend(index for index in range(session['total_chunks']) if index not in received)
+        if missing:
+            return None
+        session['status'] = 'completing'
+        return session
+    if _update_chunked_upload(upload_id, begin_complete) is None:
+        if missing:
+            return jsonify({'error': f'还有 {len(missing)} 个分片未上传', 'missing': missing[:100]}), 409
+        return jsonify({'error': '上传已结束'}), 409
+    
+    input_dir, _ = _workspace_dirs(module_name, session['workspace_id'])
+    unique_filename = f'{upload_id}{session["extension"]}'
+    save_path = os.path.join(input_dir, unique_filename)
+    try:
+        os.makedirs(input_dir, exist_ok=True)
+        sha256, deduplicated = _save_upload_file(session['part_path'], save_path)
+    except OSError as e:
+        if os.path.exists(session['part_path']):
+            # 数据文件已放回，可以再次完成
+            _update_chunked_upload(upload_id, lambda session: dict(session, status='uploading'))
+        else:
+            _remove_chunked_upload(session)
+        return jsonify({'error': f'保存失败: {str(e)}'}), 500
+    
+    _remove_chunked_upload(session)
+    return jsonify(_register_module_upload(module_name, unique_filename, session['original_name'], save_path,
+                                           sha256, deduplicated))
+
+@app.route('/upload_chunks/<module_name>/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(module_name, upload_id):
+    """取消分片上传并删除已写入的数据"""
+    session = _get_chunked_upload(module_name, upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+    def abort(session):
+        if session['status'] not in ('uploading', 'aborted'):
+            return None
+        session['status'] = 'aborted'
+        return session
+    if _update_chunked_upload(upload_id, abort) is None:
+        return jsonify({'error': '上传已结束'}), 409
+    _remove_chunked_upload(session)
+    return jsonify({'msg': '上传已取消', 'upload_id': upload_id})
+
 @app.route('/run_inference', methods=['POST'])
 def run_inference():
-    """红外数据合成模块 - 执行RGB到红外转换推理（向后兼容）"""
+    """红外数据合成模块 - 提交RGB到红外转换推理任务（向后兼容）"""
     return run_module_inference('infrared')
 
-@app.route('/run_inference/<module_name>', methods=['POST'])
-def run_module_inference(module_name):
-    """模块化推理接口"""
-    if module_name not in MODULE_CONFIG:
-        return jsonify({'error': f'不支持的模块: {module_name}'}), 400
+# 推理任务队列 - 每个模块一个工作线程，不同模块的任务互不阻塞
+# 同一模块的脚本共用固定的 input/output 目录，因此同一模块内按提交顺序串行执行
+inference_jobs = {}
+inference_job_queues = {module_name: [] for module_name in MODULE_CONFIG}
+inference_job_lock = threading.Condition()
+inference_workers = {}
+inference_executor = False  # 本进程是否负责执行推理任务
+INFERENCE_JOB_FIELDS = ('job_id', 'module', 'workspace_id', 'force', 'status', 'created_at', 'started_at', 'finished_at',
+                        'result', 'status_code', 'live_dir', 'cancel_requested', 'gpu_id', 'pid', 'owner_pid')
+INFERENCE_JOB_TIMEOUT = 600  # 单个推理脚本的超时时间（秒）
+INFERENCE_JOB_RETENTION = 200  # 内存中保留的已结束任务数量
+
+def _check_inference_inputs(module_name, workspace_id):
+    """检查工作区是否具备执行推理的条件，返回 (错误信息, 状态码)，没有问题时返回 None"""
+    config = MODULE_CONFIG[module_name]
+    uploads = _workspace_uploads(module_name, workspace_id)
+    
+    # 检查用户是否上传了文件
+    if not uploads:
+        return f'请先上传文件到{config["name"]}再执行推理！', 400
+    
+    # 检查所有上传的文件是否还存在
+    missing_files = []
+    for file_info in uploads:
+        if not os.path.exists(file_info['path']):
+            missing_files.append(file_info['original_name'])
     
+    if missing_files:
+        return f'以下文件不存在，请重新上传：{", ".join(missing_files)}', 400
+    
+    # 检查脚本文件是否存在
+    script_path = config['script_path']
+    if not os.path.exists(script_path):
+        return f'脚本文件不存在: {script_path}', 500
+    
+    return None
+
+def _execute_module_inference(module_name, job):
+    """在工作线程中执行模块推理脚本，返回 (响应数据, 状态码)"""
     config = MODULE_CONFIG[module_name]
     
     try:
-        # 检查用户是否上传了文件
-        if not uploaded_data[module_name]['images']:
-            return jsonify({'error': f'请先上传文件到{config["name"]}再执行推理！'}), 400
-        
-        print(f"开始对 {len(uploaded_data[module_name]['images'])} 个文件执行{config['name']}推理...")
+        problem = _check_inference_inputs(module_name, job['workspace_id'])
+        if problem:
+            return {'error': problem[0]}, problem[1]
+        
+        # 只处理还没有有效结果的输入
+        _prepare_workspace_output(module_name, job['workspace_id'], job.get('force'))
+        pending = _pending_inference_uploads(module_name, job['workspace_id'])
+        if not pending:
+            return _skip_inference(module_name, job), 200
+        
+        # 优先交给已加载模型的常驻进程，不可用时执行推理脚本
+        worker = _model_worker(module_name)
+        if worker is not None:
+            result = _run_inference_on_worker(module_name, job, worker, pending)
+            if result is not None:
+                return result
+            if _inference_cancel_requested(job):
+                return {'error': f'{config["name"]}推理任务已被用户取消'}, 409
+            print(f"{config['name']}常驻模型进程不可用，改为执行推理脚本")
+        
+        # 申请GPU显存准入，显存不足时在此等待其他任务释放
+        job['status'] = 'waiting_gpu'
+        _save_inference_job(job)
+        reservation = _gpu_admit(module_name, f"{config['name']}推理 {job['job_id'][:8]}",
+                                 should_cancel=lambda: _inference_cancel_requested(job))
+        if reservation is None:
+            return {'error': f'{config["name"]}推理任务已被用户取消'}, 409
+        job['status'] = 'running'
+        job['gpu_id'] = reservation['gpu_id']
+        _save_inference_job(job)
         
-        # 检查所有上传的文件是否还存在
-        missing_files = []
-        for file_info in uploaded_data[module_name]['images']:
-            if not os.path.exists(file_info['path']):
-                missing_files.append(file_info['original_name'])
+        try:
+            return _run_inference_script(module_name, job, reservation, pending)
+        finally:
+            _gpu_release(reservation)
         
-        if missing_files:
-            return jsonify({'error': f'以下文件不存在，请重新上传：{", ".join(missing_files)}'}), 400
+    except Exception as e:
+        print(f"执行{config['name']}推理时发生异常: {str(e)}")
+        return {'error': f'执行异常: {str(e)}'}, 500
+
+def _run_inference_script(module_name, job, reservation, pending):
+    """运行模块推理脚本并收集结果文件，返回 (响应数据, 状态码)
+    
+    模块脚本固定读写 input_dir/output_dir，因此执行前将待处理的输入文件链接到 input_dir，
+    执行后把 output_dir 中的结果合并到工作区的输出目录（保留之前的结果）。同一模块的任务串行执行，互不干扰。
+    """
+    config = MODULE_CONFIG[module_name]
+    workspace_id = job['workspace_id']
+    uploads = list(_workspace_uploads(module_name, workspace_id))
+    _, workspace_output_dir = _workspace_dirs(module_name, workspace_id)
+    
+    try:
+        print(f"开始对 {len(pending)} 个文件执行{config['name']}推理 (任务 {job['job_id']}，共 {len(uploads)} 个上传文件)...")
         
-        # 检查脚本文件是否存在
         script_path = config['script_path']
-        if not os.path.exists(script_path):
-            return jsonify({'error': f'脚本文件不存在: {script_path}'}), 500
+        
+        # 将待处理的输入文件复制到模块输入目录（工作区文件与其他上传共享 inode，脚本可能原地改写输入）
+        input_dir = config['input_dir']
+        os.makedirs(input_dir, exist_ok=True)
+        _clear_directory(input_dir)
+        for file_info in pending:
+            _copy_on_write(file_info['path'], os.path.join(input_dir, file_info['filename']))
         
         # 清空输出目录
         output_dir = config['output_dir']
         os.makedirs(output_dir, exist_ok=True)
-        for existing_file in glob.glob(os.path.join(output_dir, "*")):
-            if os.path.isfile(existing_file):
-                os.remove(existing_file)
+        _clear_directory(output_dir)
         
         # 确保脚本有执行权限
         os.chmod(script_path, 0o755)
         
+        if _inference_cancel_requested(job):
+            return {'error': f'{config["name"]}推理任务已被用户取消'}, 409
+        
         # 添加CUDA显存清理的环境变量
-        env = os.environ.copy()
+        env = _gpu_env(reservation)
         env['CUDA_EMPTY_CACHE'] = '1'
         env['PYTORCH_CUDA_ALLOC_CONF'] = 'max_split_size_mb:128'
         
-        result = subprocess.run(
-            ['/bin/bash', script_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=600,  # 增加超时时间到10分钟
-            cwd=os.path.dirname(script_path),
-            env=env
-        )
-        
-        output = result.stdout.decode('utf-8')
-        error = result.stderr.decode('utf-8')
-        
-        print(f"脚本执行完成，返回码: {result.returncode}")
+        # 运行期间推送已经写完的结果文件
+        watcher = _ResultWatcher(job, output_dir)
+        try:
+            process = subprocess.Popen(
+                ['/bin/bash', script_path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=os.path.dirname(script_path),
+                env=env,
+                preexec_fn=os.setsid  # 创建新的进程组，便于取消任务
+            )
+            job['pid'] = process.pid
+            job['process'] = process
+            reservation['pgid'] = process.pid  # 进程以 setsid 启动，进程组号即PID
+            _save_inference_job(job)  # 其他工作进程取消任务时按进程组号终止
+            
+            try:
+                stdout, stderr = process.communicate(timeout=INFERENCE_JOB_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                _kill_process_group(process)
+                return {'error': f'{config["name"]}脚本执行超时（超过10分钟）'}, 500
+            finally:
+                job['process'] = None
+                job['pid'] = None
+                _save_inference_job(job)
+        finally:
+            watcher.stop()
+        
+        if _inference_cancel_requested(job):
+            return {'error': f'{config["name"]}推理任务已被用户取消'}, 409
+        
+        output = stdout.decode('utf-8', errors='replace')
+        error = stderr.decode('utf-8', errors='replace')
+        
+        print(f"脚本执行完成，返回码: {process.returncode}")
         print(f"输出: {output}")
         if error:
             print(f"错误: {error}")
         
-        # 查找生成的结果文件
-        result_files = []
-        print(f"检查输出目录: {output_dir}")
-        
-        # 扫描输出目录中的文件
-        if os.path.exists(output_dir):
-            for file_path in glob.glob(os.path.join(output_dir, "**/*"), recursive=True):
-                if os.path.isfile(file_path):
-                    relative_path = os.path.relpath(file_path, output_dir)
-                    filename = os.path.basename(file_path)
-                    file_size = os.path.getsize(file_path)
-                    
-                    # 对于视频模块，检查是否为视频文件
-                    if module_name == 'video':
-                        # 检查文件扩展名
-                        _, ext = os.path.splitext(filename.lower())
-                        if ext in ['.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv']:
-                            result_files.append({
-                                'filename': filename,
-                                'relative_path': relative_path,
-                                'full_path': file_path,
-                                'size': file_size
-                            })
-                    else:
-                        # 对于其他模块，添加所有文件
-                        result_files.append({
-                            'filename': filename,
-                            'relative_path': relative_path,
-                            'full_path': file_path,
-                            'size': file_size
-                        })
-            
-            print(f"找到 {len(result_files)} 个结果文件: {[f['filename'] for f in result_files]}")
-        
-        # 获取所有原始文件的名称
-        original_files = [file['original_name'] for file in uploaded_data[module_name]['images']]
-        
-        # 为了向后兼容，红外模块使用旧的字段名
-        result_key = 'result_images' if module_name == 'infrared' else 'result_files'
-        original_key = 'original_images' if module_name == 'infrared' else 'original_files'
-        total_key = 'total_input_images' if module_name == 'infrared' else 'total_input_files'
-        
-        response_data = {
-            'output': output, 
-            'error': error,
-            'returncode': result.returncode,
-            original_key: original_files,
-            total_key: len(original_files),
-            result_key: result_files,
-            'module': module_name,
-            'message': f"{config['name']}处理完成！处理了 {len(original_files)} 个文件: {', '.join(original_files[:3])}{'...' if len(original_files) > 3 else ''}" if result.returncode == 0 else f"{config['name']}执行出现问题"
-        }
+        # 将结果合并到工作区的输出目录，同名文件覆盖旧结果
+        produced = _merge_directory(output_dir, workspace_output_dir)
+        _record_inference_results(module_name, workspace_id, pending, produced, process.returncode)
         
-        return jsonify(response_data)
+        return _collect_inference_results(module_name, job, uploads, output, error, process.returncode, pending), 200
         
-    except subprocess.TimeoutExpired:
-        return jsonify({'error': f'{config["name"]}脚本执行超时（超过10分钟）'}), 500
     except Exception as e:
         print(f"执行{config['name']}推理时发生异常: {str(e)}")
-        return jsonify({'error': f'执行异常: {str(e)}'}), 500
+        return {'error': f'执行异常: {str(e)}'}, 500
+    finally:
+        # 不在共享的模块输入目录中保留其他用户的文件
+        _clear_directory(config['input_dir'])
+
+# 结果清单 - 每个工作区的输出目录维护一份清单（相对路径 -> 大小、修改时间、校验和、对应的输入），
+# 每次运行后只为新生成的文件增量更新；结果JSON、结果打包下载和输出视频列表都读取清单，不再遍历目录
+OUTPUT_MANIFEST_NAME = 'output_manifest.json'  # 保存在工作区根目录中
+
+output_manifests = {}  # (模块名, 工作区ID) -> (清单文件的修改时间, {相对路径: 文件信息})，文件被其他进程改写后重新读取
+output_manifest_lock = threading.Lock()
+
+def _output_manifest_path(module_name, workspace_id):
+    return os.path.join(_workspace_root(module_name, workspace_id), OUTPUT_MANIFEST_NAME)
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOB_COPY_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _manifest_entry(path, inputs, checksum=True):
+    """单个结果文件的清单信息，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'sha256': _file_sha256(path) if checksum else None,
+        'inputs': inputs
+    }
+
+def _load_output_manifest(module_name, workspace_id):
+    """读取结果清单（需持有 output_manifest_lock）；没有清单文件时扫描一次输出目录建立（不计算校验和）"""
+    key = (module_name, workspace_id)
+    path = _output_manifest_path(module_name, workspace_id)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    cached = output_manifests.get(key)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    try:
+        with open(path) as f:
+            manifest = json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        _, workspace_output_dir = _workspace_dirs(module_name, workspace_id)
+        manifest = {}
+        for relative_path in _snapshot_outputs(workspace_output_dir):
+            entry = _manifest_entry(os.path.join(workspace_output_dir, relative_path), [], checksum=False)
+            if entry:
+                manifest[relative_path] = entry
+    output_manifests[key] = (mtime_ns, manifest)
+    return manifest
+
+def _save_output_manifest(module_name, workspace_id, manifest):
+    """持久化结果清单（写临时文件后替换，需持有 output_manifest_lock）"""
+    path = _output_manifest_path(module_name, workspace_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'files': manifest}, f)
+    os.replace(tmp_path, path)
+    output_manifests[(module_name, workspace_id)] = (os.stat(path).st_mtime_ns, manifest)
+
+def _output_manifest(module_name, workspace_id=None):
+    """工作区结果清单的副本 {相对路径: 文件信息}"""
+    workspace_id = workspace_id or _current_workspace_id()
+    with output_manifest_lock:
+        return dict(_load_output_manifest(module_name, workspace_id))
+
+def _update_output_manifest(module_name, workspace_id, produced, owners):
+    """把一次运行新生成或改写的文件加入清单，owners 为 {相对路径: [输入文件名]}"""
+    _, workspace_output_dir = _workspace_dirs(module_name, workspace_id)
+    # 校验和在锁外计算
+    entries = {relative_path: _manifest_entry(os.path.join(workspace_output_dir, relative_path), owners.get(relative_path, []))
+               for relative_path in produced}
+    with output_manifest_lock:
+        manifest = _load_output_manifest(module_name, workspace_id)
+        for relative_path, entry in entries.items():
+            if entry is None:
+                manifest.pop(relative_path, None)
+            else:
+                manifest[relative_path] = entry
+        _save_output_manifest(module_name, workspace_id, manifest)
+
+def _reset_output_manifest(module_name, workspace_id):
+    """输出目录被清空后清空清单"""
+    with output_manifest_lock:
+        output_manifests[(module_name, workspace_id)] = (None, {})
+        try:
+            os.remove(_output_manifest_path(module_name, workspace_id))
+        except OSError:
+            pass
+
+def _prepare_workspace_output(module_name, workspace_id, force):
+    """准备工作区输出目录；force 时清空之前的结果，使所有输入重新处理"""
+    _, workspace_output_dir = _workspace_dirs(module_name, workspace_id)
+    os.makedirs(workspace_output_dir, exist_ok=True)
+    if force:
+        _clear_directory(workspace_output_dir)
+        _reset_output_manifest(module_name, workspace_id)
+        def forget_results(uploads):
+            for file_info in uploads:
+                file_info.pop('result', None)
+        _update_workspace_uploads(module_name, workspace_id, forget_results)
+    return workspace_output_dir
+
+def _has_valid_result(file_info, output_dir):
+    """输入是否已有有效结果：记录的结果文件都还在，且输入内容没有变化"""
+    result = file_info.get('result')
+    return bool(result and result['files'] and result['sha256'] == file_info.get('sha256')
+                and all(os.path.exists(os.path.join(output_dir, path)) for path in result['files']))
+
+def _pending_inference_uploads(module_name, workspace_id):
+    """工作区中还没有有效结果、需要执行推理的上传文件"""
+    _, workspace_output_dir = _workspace_dirs(module_name, workspace_id)
+    return [file_info for file_info in _workspace_uploads(module_name, workspace_id)
+            if not file_info.get('is_folder_upload') and not _has_valid_result(file_info, workspace_output_dir)]
+
+def _snapshot_outputs(output_dir):
+    """输出目录中所有文件的 {相对路径: (大小, 修改时间)}，用于找出一次运行新生成的结果"""
+    snapshot = {}
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[os.path.relpath(path, output_dir)] = (st.st_size, st.st_mtime_ns)
+    return snapshot
+
+def _changed_outputs(before, after):
+    """两次快照之间新增或被改写的文件"""
+    return [path for path, signature in after.items() if before.get(path) != signature]
+
+def _merge_directory(src_dir, dst_dir):
+    """把 src_dir 中的文件移动合并到 dst_dir（保留 dst_dir 中的其他文件），返回移动的相对路径"""
+    moved = []
+    for root, _, names in os.walk(src_dir):
+        for name in names:
+            relative_path = os.path.relpath(os.path.join(root, name), src_dir)
+            target = os.path.join(dst_dir, relative_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(os.path.join(root, name), target)
+            moved.append(relative_path)
+    return moved
+
+def _record_inference_results(module_name, workspace_id, pending, produced, returncode):
+    """把本次运行生成的结果文件归属到对应的输入：文件名包含输入文件名（唯一ID）的归属于该输入，
+    无法匹配的归属于本次处理的全部输入；同时更新结果清单。运行失败时不记录归属，下次重新处理"""
+    owned = {id(file_info): [] for file_info in pending}
+    owners = {}
+    for path in produced:
+        name = os.path.basename(path)
+        matched = [file_info for file_info in pending if os.path.splitext(file_info['filename'])[0] in name]
+        owners[path] = [file_info['filename'] for file_info in matched or pending] if returncode == 0 else []
+        for file_info in matched or pending:
+            owned[id(file_info)].append(path)
+    _update_output_manifest(module_name, workspace_id, produced, owners)
+    if returncode != 0:
+        return
+    finished_at = datetime.now().isoformat()
+    results = {file_info['filename']: {'files': owned[id(file_info)], 'sha256': file_info.get('sha256'), 'finished_at': finished_at}
+               for file_info in pending}
+    def apply(uploads):
+        for file_info in uploads:
+            if file_info['filename'] in results:
+                file_info['result'] = results[file_info['filename']]
+    _update_workspace_uploads(module_name, workspace_id, apply)
+
+def _skip_inference(module_name, job):
+    """所有输入都已有有效结果时直接返回之前的结果"""
+    uploads = list(_workspace_uploads(module_name, job['workspace_id']))
+    print(f"{MODULE_CONFIG[module_name]['name']}任务 {job['job_id']} 的输入都已有结果，跳过推理")
+    return _collect_inference_results(module_name, job, uploads, '所有输入都已有结果，未重新推理（使用 force=true 可重新处理全部输入）\n',
+                                      '', 0, [])
+
+def _collect_inference_results(module_name, job, uploads, output, error, returncode, processed):
+    """扫描工作区输出目录（包括之前运行保留的结果），生成推理接口的响应数据；processed 为本次实际处理的输入"""
+    config = MODULE_CONFIG[module_name]
+    _, workspace_output_dir = _workspace_dirs(module_name, job['workspace_id'])
+    
+    # 从结果清单中读取结果文件
+    result_files = []
+    for relative_path, entry in sorted(_output_manifest(module_name, job['workspace_id']).items()):
+        filename = os.path.basename(relative_path)
+        # 对于视频模块，只返回视频文件
+        if module_name == 'video' and os.path.splitext(filename.lower())[1] not in VIDEO_EXTENSIONS:
+            continue
+        result_files.append({
+            'filename': filename,
+            'relative_path': relative_path,
+            'full_path': os.path.join(workspace_output_dir, relative_path),
+            'size': entry['size'],
+            'sha256': entry['sha256'],
+            'inputs': entry['inputs'],
+            'url': f"/jobs/{job['job_id']}/files/{quote(relative_path)}"
+        })
+    
+    print(f"找到 {len(result_files)} 个结果文件: {[f['filename'] for f in result_files]}")
+    
+    if module_name == 'video' and returncode == 0:
+        # 推理生成的视频立即在后台转码为网页兼容格式
+        _schedule_video_transcodes([f['filename'] for f in result_files if os.path.dirname(f['relative_path']) == 'videos'],
+                                   'output', job['workspace_id'])
+    
+    # 获取所有原始文件的名称
+    original_files = [file['original_name'] for file in uploads]
+    processed_files = [file['original_name'] for file in processed]
+    
+    # 为了向后兼容，红外模块使用旧的字段名
+    result_key = 'result_images' if module_name == 'infrared' else 'result_files'
+    original_key = 'original_images' if module_name == 'infrared' else 'original_files'
+    total_key = 'total_input_images' if module_name == 'infrared' else 'total_input_files'
+    
+    response_data = {
+        'output': output, 
+        'error': error,
+        'returncode': returncode,
+        original_key: original_files,
+        total_key: len(original_files),
+        result_key: result_files,
+        'processed_files': processed_files,
+        'reused_count': len(original_files) - len(processed_files),
+        'module': module_name,
+        'message': f"{config['name']}处理完成！处理了 {len(processed_files)} 个文件: {', '.join(processed_files[:3])}{'...' if len(processed_files) > 3 else ''}" if returncode == 0 else f"{config['name']}执行出现问题"
+    }
+    
+    return response_data
+
+# 实时结果 - 推理运行期间监视结果目录，文件写完即向任务追加“结果就绪”事件，前端通过
+# /jobs/<id>/results/stream (SSE) 接收，不必等整个脚本结束；安装了 inotify_simple 时使用inotify，否则轮询
+RESULT_WATCH_POLL_INTERVAL = 0.5  # 轮询间隔（秒），文件大小和修改时间连续两次不变才视为写完
+
+class _ResultWatcher:
+    """监视一次运行的结果目录，把新写完的文件追加到 job['live_results']，并逐条写入状态存储供其他工作进程读取"""
+    
+    def __init__(self, job, directory):
+        self.job = job
+        self.directory = directory
+        self.emitted = _snapshot_outputs(directory)  # 运行前已有的文件不是本次的结果
+        self.candidates = {}
+        self.stopped = threading.Event()
+        job['live_dir'] = directory
+        _save_inference_job(job)
+        self.thread = threading.Thread(target=self._run, name=f"result-watcher-{job['job_id'][:8]}", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """停止监视，并补发运行结束时已写完但还没有推送的文件"""
+        self.stopped.set()
+        self.thread.join()
+        for relative_path in _snapshot_outputs(self.directory):
+            self._emit(relative_path)
+    
+    def _emit(self, relative_path):
+        path = os.path.join(self.directory, relative_path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        signature = (st.st_size, st.st_mtime_ns)
+        if not stat.S_ISREG(st.st_mode) or self.emitted.get(relative_path) == signature:
+            return
+        self.emitted[relative_path] = signature
+        with inference_job_lock:
+            results = self.job['live_results']
+            entry = {
+                'index': len(results),
+                'filename': os.path.basename(relative_path),
+                'relative_path': relative_path,
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'url': f"/jobs/{self.job['job_id']}/files/{quote(relative_path)}"
+            }
+            results.append(entry)
+            inference_job_lock.notify_all()
+        # 只追加一条记录，不重写整个任务记录（在锁外写入状态存储）
+        state_store.put(f"inference_live/{self.job['job_id']}", f"{entry['index']:08d}", entry)
+    
+    def _poll(self):
+        for relative_path, signature in _snapshot_outputs(self.directory).items():
+            if self.emitted.get(relative_path) == signature:
+                continue
+            if self.candidates.get(relative_path) == signature:
+                self._emit(relative_path)
+            else:
+                self.candidates[relative_path] = signature
+    
+    def _run(self):
+        try:
+            import inotify_simple
+            inotify = inotify_simple.INotify()
+        except (ImportError, OSError):
+            inotify = None
+        try:
+            if inotify is None or not self._watch(inotify):
+                while not self.stopped.wait(RESULT_WATCH_POLL_INTERVAL):
+                    self._poll()
+        finally:
+            if inotify:
+                inotify.close()
+    
+    def _watch(self, inotify):
+        """inotify模式：文件关闭写入或移入时推送；无法监听结果目录时返回 False"""
+        from inotify_simple import flags
+        mask = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO
+        watches = {}
+        
+        def add_tree(directory):
+            # 新建子目录中在监听建立前写完的文件由 stop() 的最终扫描补发
+            for root, _, _ in os.walk(directory):
+                try:
+                    watches[inotify.add_watch(root, mask)] = root
+                except OSError:
+                    pass
+        
+        add_tree(self.directory)
+        if self.directory not in watches.values():
+            return False
+        while not self.stopped.is_set():
+            for event in inotify.read(timeout=int(RESULT_WATCH_POLL_INTERVAL * 1000)):
+                parent = watches.get(event.wd)
+                if parent is None or not event.name:
+                    continue
+                path = os.path.join(parent, event.name)
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        add_tree(path)
+                elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    self._emit(os.path.relpath(path, self.directory))
+        return True
+
+def _terminate_process_group(pid, sig=15, grace=3):
+    """按进程组号终止其他工作进程启动的子进程（本进程没有它的 Popen 对象），超时后强制杀死"""
+    try:
+        os.killpg(pid, sig)
+        deadline = time.time() + grace
+        while _process_alive(pid) and time.time() < deadline:
+            time.sleep(0.1)
+        if _process_alive(pid):
+            os.killpg(pid, 9)  # SIGKILL
+    except ProcessLookupError:
+        pass
+    except OSError as e:
+        print(f"终止进程组 {pid} 时出错: {e}")
+
+def _kill_process_group(process, sig=15, grace=3):
+    """终止子进程所在的进程组，超时后强制杀死"""
+    try:
+        os.killpg(os.getpgid(process.pid), sig)
+        try:
+            process.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            os.killpg(os.getpgid(process.pid), 9)  # SIGKILL
+            process.wait()
+    except ProcessLookupError:
+        pass
+    except OSError as e:
+        print(f"终止进程时出错: {e}")
+
+# 常驻模型进程 - 每个模块一个长期运行的 model_worker.py 进程预先加载模型（只需一次导入torch、创建CUDA上下文和加载权重），
+# 推理任务通过Unix socket发送给它；后台线程做健康检查，进程退出或无响应时自动重启，不可用时退回执行推理脚本
+MODEL_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_worker.py')
+MODEL_WORKER_SOCKET_DIR = '/tmp/frontpage_model_workers'
+MODEL_WORKER_LOG_DIR = '/home/vipuser/Downloads/model_worker_logs'  # 与任务日志分开，任务日志清理不会删除
+MODEL_WORKER_START_TIMEOUT = 300  # 等待模型加载完成的时间（秒）
+MODEL_WORKER_HEALTH_INTERVAL = 10  # 健康检查间隔（秒）
+MODEL_WORKER_PING_TIMEOUT = 5
+MODEL_WORKER_MAX_PING_FAILURES = 3  # 连续多少次无响应后重启
+MODEL_WORKER_IDLE_TIMEOUT = 1800  # 空闲超过该时间停止进程并释放显存（秒），None 表示一直常驻
+MODEL_WORKER_RETRY_BACKOFF = 300  # 启动失败后的最长重试间隔（秒）
+
+model_workers = {}  # 模块名 -> _ModelWorker
+model_worker_lock = threading.Lock()
+model_worker_monitor_thread = None
+
+class _ModelWorker:
+    """一个模块的常驻模型进程：启动时申请显存准入并在整个生命周期内保留，任务在 self.lock 下串行执行"""
+    
+    def __init__(self, module_name, handler_path):
+        self.module_name = module_name
+        self.handler_path = handler_path
+        self.socket_path = os.path.join(MODEL_WORKER_SOCKET_DIR, f'{module_name}.sock')
+        self.log_path = os.path.join(MODEL_WORKER_LOG_DIR, f'{module_name}.log')
+        self.lock = threading.Lock()
+        self.process = None
+        self.reservation = None
+        self.status = 'stopped'
+        self.started_at = None
+        self.last_used = None
+        self.jobs = 0
+        self.restarts = 0
+        self.start_failures = 0
+        self.ping_failures = 0
+        self.retry_at = 0
+        self.last_error = None
+    
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+    
+    def request(self, payload, timeout):
+        """发送一个请求并等待一行JSON响应"""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(self.socket_path)
+            conn.sendall((json.dumps(payload) + '\n').encode('utf-8'))
+            line = conn.makefile('rb').readline()
+        if not line:
+            raise ConnectionError('常驻模型进程未返回响应')
+        return json.loads(line)
+    
+    def start(self, should_cancel=None):
+        """启动进程并等待模型加载完成（需持有 self.lock），返回是否成功"""
+        config = MODULE_CONFIG[self.module_name]
+        reservation = _gpu_admit(self.module_name, f"{config['name']}常驻模型", should_cancel=should_cancel)
+        if reservation is None:
+            return False
+        
+        os.makedirs(MODEL_WORKER_SOCKET_DIR, exist_ok=True)
+        os.makedirs(MODEL_WORKER_LOG_DIR, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        env = _gpu_env(reservation)
+        env['PYTORCH_CUDA_ALLOC_CONF'] = 'max_split_size_mb:128'
+        with open(self.log_path, 'ab') as log_file:
+            self.process = subprocess.Popen(
+                [sys.executable, MODEL_WORKER_SCRIPT, '--handler', self.handler_path, '--socket', self.socket_path],
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                cwd=os.path.dirname(self.handler_path),
+                env=env,
+                preexec_fn=os.setsid
+            )
+        reservation['pgid'] = self.process.pid
+        self.reservation = reservation
+        self.status = 'starting'
+        self.started_at = datetime.now().isoformat()
+        print(f"正在启动{config['name']}常驻模型进程，PID: {self.process.pid}")
+        
+        deadline = time.time() + MODEL_WORKER_START_TIMEOUT
+        while time.time() < deadline:
+            if not self.alive():
+                self.stop(f'进程启动失败，返回码: {self.process.returncode}，详见 {self.log_path}')
+                break
+            if should_cancel and should_cancel():
+                self.stop('启动被取消')
+                return False
+            try:
+                self.request({'op': 'ping'}, MODEL_WORKER_PING_TIMEOUT)
+            except (OSError, ValueError):
+                time.sleep(0.5)
+                continue
+            self.status = 'ready'
+            self.last_used = time.time()
+            self.start_failures = 0
+            self.ping_failures = 0
+            print(f"{config['name']}常驻模型进程已就绪")
+            return True
+        else:
+            self.stop('模型加载超时')
+        
+        # 连续启动失败时按指数退避，期间直接执行推理脚本
+        self.start_failures += 1
+        self.retry_at = time.time() + min(MODEL_WORKER_RETRY_BACKOFF, 5 * 2 ** self.start_failures)
+        return False
+    
+    def stop(self, reason=None):
+        """终止进程并释放显存预留"""
+        if self.process is not None:
+            _kill_process_group(self.process)
+            self.process = None
+        if self.reservation is not None:
+            _gpu_release(self.reservation)
+            self.reservation = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.status = 'failed' if reason else 'stopped'
+        if reason:
+            self.last_error = reason
+            print(f"{MODULE_CONFIG[self.module_name]['name']}常驻模型进程已停止: {reason}")
+    
+    def ensure_started(self, should_cancel=None):
+        """进程未运行时启动（需持有 self.lock），处于退避期时返回 False"""
+        if self.alive() and self.status == 'ready':
+            return True
+        if self.process is not None:
+            self.restarts += 1
+            self.stop('进程已退出')
+        if time.time() < self.retry_at:
+            return False
+        return self.start(should_cancel)
+    
+    def run(self, jobs, inputs, output_dirs):
+        """执行一个批次（一个或多个任务），第 i 个输入的结果写入 output_dirs[i]，返回 (输出, 错误, 返回码)；进程不可用时返回 None"""
+        all_cancelled = lambda: all(_inference_cancel_requested(job) for job in jobs)
+        # 其他任务或后台重启占用进程时等待，期间可以被取消
+        while not self.lock.acquire(timeout=1):
+            if all_cancelled():
+                return None
+        try:
+            if not self.ensure_started(should_cancel=all_cancelled):
+                return None
+            # 只有单个任务时取消才终止进程，合并的批次中被取消的任务只丢弃结果
+            job = jobs[0] if len(jobs) == 1 else None
+            if job is not None:
+                job['model_worker'] = self
+                _save_inference_job(job)
+            try:
+                response = self.request({'op': 'infer', 'inputs': inputs, 'output_dirs': output_dirs},
+                                        INFERENCE_JOB_TIMEOUT)
+            except (OSError, ValueError) as e:
+                # 超时、崩溃或被取消：进程状态未知，停止后在后台重启
+                self.restarts += 1
+                self.stop(f'任务执行中断: {str(e)}')
+                _restart_model_worker_async(self)
+                return '', f'常驻模型进程异常: {str(e)}', 1
+            finally:
+                if job is not None:
+                    job.pop('model_worker', None)
+                self.last_used = time.time()
+            self.jobs += 1
+        finally:
+            self.lock.release()
+        if response.get('ok'):
+            return response.get('output', ''), '', 0
+        return response.get('output', ''), response.get('error', '推理失败'), 1
+    
+    def view(self):
+        return {
+            'module': self.module_name,
+            'module_name': MODULE_CONFIG[self.module_name]['name'],
+            'status': self.status,
+            'pid': self.process.pid if self.alive() else None,
+            'gpu_id': self.reservation['gpu_id'] if self.reservation else None,
+            'started_at': self.started_at,
+            'idle_seconds': int(time.time() - self.last_used) if self.last_used and self.status == 'ready' else None,
+            'jobs': self.jobs,
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+            'log_path': self.log_path
+        }
+
+def _model_worker(module_name):
+    """获取模块的常驻模型进程，模块未配置处理模块或文件不存在时返回 None"""
+    global model_worker_monitor_thread
+    handler_path = MODULE_CONFIG[module_name].get('worker_handler')
+    if not handler_path or not os.path.exists(handler_path) or not os.path.exists(MODEL_WORKER_SCRIPT):
+        return None
+    with model_worker_lock:
+        worker = model_workers.get(module_name)
+        if worker is None:
+            worker = model_workers[module_name] = _ModelWorker(module_name, handler_path)
+        if model_worker_monitor_thread is None or not model_worker_monitor_thread.is_alive():
+            model_worker_monitor_thread = threading.Thread(target=_model_worker_monitor,
+                                                           name='model-worker-monitor', daemon=True)
+            model_worker_monitor_thread.start()
+    return worker
+
+def _restart_model_worker_async(worker):
+    """在后台线程中重启常驻模型进程，避免阻塞调用方"""
+    def restart():
+        with worker.lock:
+            worker.ensure_started()
+    threading.Thread(target=restart, name=f'model-worker-restart-{worker.module_name}', daemon=True).start()
+
+def _model_worker_monitor():
+    """健康检查线程：回收退出或无响应的进程并重启，停止长时间空闲的进程"""
+    while True:
+        time.sleep(MODEL_WORKER_HEALTH_INTERVAL)
+        with model_worker_lock:
+            workers = list(model_workers.values())
+        for worker in workers:
+            # 正在执行任务或启动中的进程跳过检查
+            if not worker.lock.acquire(blocking=False):
+                continue
+            try:
+                if worker.status != 'ready':
+                    continue
+                if not worker.alive():
+                    worker.restarts += 1
+                    worker.stop(f'进程意外退出，返回码: {worker.process.returncode}')
+                    _restart_model_worker_async(worker)
+                    continue
+                if MODEL_WORKER_IDLE_TIMEOUT is not None and time.time() - worker.last_used > MODEL_WORKER_IDLE_TIMEOUT:
+                    worker.stop()
+                    print(f"{MODULE_CONFIG[worker.module_name]['name']}常驻模型进程空闲超时，已停止并释放显存")
+                    continue
+                try:
+                    worker.request({'op': 'ping'}, MODEL_WORKER_PING_TIMEOUT)
+                    worker.ping_failures = 0
+                except (OSError, ValueError):
+                    worker.ping_failures += 1
+                    if worker.ping_failures >= MODEL_WORKER_MAX_PING_FAILURES:
+                        worker.restarts += 1
+                        worker.stop('健康检查无响应')
+                        _restart_model_worker_async(worker)
+            finally:
+                worker.lock.release()
+
+def _run_inference_on_worker(module_name, job, worker, pending):
+    """把待处理的输入文件直接交给常驻模型进程处理，结果写入工作区输出目录，返回 (响应数据, 状态码)；进程不可用时返回 None"""
+    config = MODULE_CONFIG[module_name]
+    workspace_id = job['workspace_id']
+    uploads = list(_workspace_uploads(module_name, workspace_id))
+    _, workspace_output_dir = _workspace_dirs(module_name, workspace_id)
+    inputs = [file_info['path'] for file_info in pending]
+    before = _snapshot_outputs(workspace_output_dir)
+    
+    job['status'] = 'running'
+    _save_inference_job(job)
+    print(f"开始对 {len(inputs)} 个文件执行{config['name']}推理 (任务 {job['job_id']}，常驻模型进程)...")
+    watcher = _ResultWatcher(job, workspace_output_dir)
+    try:
+        outcome = worker.run([job], inputs, [workspace_output_dir] * len(inputs))
+    finally:
+        watcher.stop()
+    if outcome is None:
+        return None
+    if _inference_cancel_requested(job):
+        return {'error': f'{config["name"]}推理任务已被用户取消'}, 409
+    
+    output, error, returncode = outcome
+    print(f"常驻模型进程执行完成，返回码: {returncode}")
+    if error:
+        print(f"错误: {error}")
+    _record_inference_results(module_name, workspace_id, pending,
+                              _changed_outputs(before, _snapshot_outputs(workspace_output_dir)), returncode)
+    return _collect_inference_results(module_name, job, uploads, output, error, returncode, pending), 200
+
+def _job_input_count(module_name, job):
+    """任务需要处理的输入文件数（force 时为全部输入，否则只计还没有结果的输入）"""
+    if job.get('force'):
+        uploads = _workspace_uploads(module_name, job['workspace_id'])
+        return max(1, sum(1 for file_info in uploads if not file_info.get('is_folder_upload')))
+    return max(1, len(_pending_inference_uploads(module_name, job['workspace_id'])))
+
+def _gather_inference_batch(module_name, first_job):
+    """在 batch_window 时间内从队列中收集更多任务（按提交顺序，直到输入数达到 batch_max_inputs），返回新加入的任务
+    
+    每个工作区最多一个任务（同一工作区的待处理输入相同），输入数和状态存储的读写都在 inference_job_lock 之外。
+    """
+    config = MODULE_CONFIG[module_name]
+    queue = inference_job_queues[module_name]
+    budget = config['batch_max_inputs'] - _job_input_count(module_name, first_job)
+    deadline = time.time() + config.get('batch_window', 0)
+    workspaces = {first_job['workspace_id']}
+    input_counts = {}
+    batch = []
+    while budget > 0:
+        if state_store.shared:
+            _import_queued_inference_jobs(module_name)
+        with inference_job_lock:
+            candidate = next((job for job in queue if job['workspace_id'] not in workspaces), None)
+        if candidate is not None and candidate['job_id'] not in input_counts:
+            input_counts[candidate['job_id']] = _job_input_count(module_name, candidate)
+            continue
+        
+        with inference_job_lock:
+            claimed = None
+            if candidate is not None and input_counts[candidate['job_id']] <= budget:
+                if candidate in queue:
+                    queue.remove(candidate)
+                    claimed = candidate
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0 or candidate is not None:
+                    # 超时，或下一个任务放不进当前批次
+                    break
+                inference_job_lock.wait(min(remaining, STATE_POLL_INTERVAL) if state_store.shared else remaining)
+                continue
+        if claimed is not None and _claim_inference_job(claimed):
+            batch.append(claimed)
+            workspaces.add(claimed['workspace_id'])
+            budget -= input_counts[claimed['job_id']]
+    return batch
+
+def _execute_inference_batch(module_name, jobs):
+    """把多个用户的任务合并为一个批次交给常驻模型进程，结果按输入写回各自的工作区，返回每个任务的 (响应数据, 状态码)"""
+    config = MODULE_CONFIG[module_name]
+    results = {}
+    prepared = []
+    for job in jobs:
+        problem = _check_inference_inputs(module_name, job['workspace_id'])
+        if problem:
+            results[job['job_id']] = ({'error': problem[0]}, problem[1])
+            continue
+        workspace_output_dir = _prepare_workspace_output(module_name, job['workspace_id'], job.get('force'))
+        pending = _pending_inference_uploads(module_name, job['workspace_id'])
+        if not pending:
+            results[job['job_id']] = (_skip_inference(module_name, job), 200)
+            continue
+        uploads = list(_workspace_uploads(module_name, job['workspace_id']))
+        prepared.append((job, uploads, pending, workspace_output_dir, _snapshot_outputs(workspace_output_dir)))
+    
+    if prepared:
+        inputs = [file_info['path'] for _, _, pending, _, _ in prepared for file_info in pending]
+        output_dirs = [output_dir for _, _, pending, output_dir, _ in prepared for _ in pending]
+        print(f"合并 {len(prepared)} 个{config['name']}推理任务为一个批次，共 {len(inputs)} 个文件")
+        worker = _model_worker(module_name)
+        watchers = [_ResultWatcher(job, output_dir) for job, _, _, output_dir, _ in prepared]
+        try:
+            outcome = worker.run([item[0] for item in prepared], inputs, output_dirs) if worker else None
+        except Exception as e:
+            print(f"执行{config['name']}批量推理时发生异常: {str(e)}")
+            outcome = ('', f'执行异常: {str(e)}', 1)
+        finally:
+            for watcher in watchers:
+                watcher.stop()
+        
+        for job, uploads, pending, output_dir, before in prepared:
+            if outcome is None:
+                # 常驻模型进程不可用，逐个执行
+                results[job['job_id']] = _execute_module_inference(module_name, job)
+            elif _inference_cancel_requested(job):
+                results[job['job_id']] = ({'error': f'{config["name"]}推理任务已被用户取消'}, 409)
+            else:
+                output, error, returncode = outcome
+                _record_inference_results(module_name, job['workspace_id'], pending,
+                                          _changed_outputs(before, _snapshot_outputs(output_dir)), returncode)
+                results[job['job_id']] = (_collect_inference_results(module_name, job, uploads, output, error, returncode, pending), 200)
+    
+    return [results[job['job_id']] for job in jobs]
+
+@app.route('/model_workers', methods=['GET'])
+def list_model_workers():
+    """查看各模块常驻模型进程的状态"""
+    with inference_job_lock:
+        if not _ensure_inference_executor():
+            return jsonify({'workers': [], 'message': '常驻模型进程由执行推理任务的工作进程管理'})
+    workers = [worker for worker in (_model_worker(module_name) for module_name in MODULE_CONFIG) if worker]
+    return jsonify({'workers': [worker.view() for worker in workers]})
+
+@app.route('/model_workers/<module_name>/start', methods=['POST'])
+def start_model_worker(module_name):
+    """预热常驻模型进程（在后台加载模型）"""
+    if module_name not in MODULE_CONFIG:
+        return jsonify({'error': f'不支持的模块: {module_name}'}), 400
+    with inference_job_lock:
+        if not _ensure_inference_executor():
+            return jsonify({'error': '常驻模型进程由执行推理任务的工作进程管理，请稍后重试'}), 409
+    worker = _model_worker(module_name)
+    if worker is None:
+        return jsonify({'error': f'{MODULE_CONFIG[module_name]["name"]}未配置常驻模型进程'}), 404
+    worker.retry_at = 0
+    _restart_model_worker_async(worker)
+    return jsonify({'message': f'{MODULE_CONFIG[module_name]["name"]}常驻模型进程正在启动', 'worker': worker.view()}), 202
+
+def _claim_inference_job(job):
+    """标记已从模块队列取出的任务开始执行（不能持有 inference_job_lock）；任务已被取消时返回 False"""
+    started_at = datetime.now().isoformat()
+    def claim(record):
+        if record is None or record['status'] != 'queued':
+            return None
+        record.update(status='running', started_at=started_at, owner_pid=os.getpid())
+        return record
+    record = state_store.update('inference_jobs', job['job_id'], claim)
+    if record is None:
+        record = state_store.get('inference_jobs', job['job_id']) or {}
+        state_store.delete(f"inference_queue/{job['module']}", job['job_id'])
+        with inference_job_lock:
+            job.update(status=record.get('status', 'cancelled'), cancel_requested=True,
+                       finished_at=record.get('finished_at'), result=record.get('result'),
+                       status_code=record.get('status_code'))
+            inference_job_lock.notify_all()
+        return False
+    _index_inference_job(record)
+    with inference_job_lock:
+        job.update(status='running', started_at=started_at, owner_pid=os.getpid(), revision=record.get('revision', 0))
+    return True
+
+def _inference_worker(module_name):
+    """模块推理工作线程：按顺序从模块队列中取出任务并执行；配置了批处理且有常驻模型进程时合并多个任务"""
+    queue = inference_job_queues[module_name]
+    config = MODULE_CONFIG[module_name]
+    while True:
+        while True:
+            if state_store.shared:
+                _import_queued_inference_jobs(module_name)
+            with inference_job_lock:
+                job = queue.pop(0) if queue else None
+                if job is None:
+                    inference_job_lock.wait(STATE_POLL_INTERVAL if state_store.shared else None)
+                    continue
+            if _claim_inference_job(job):
+                break
+        
+        jobs = [job]
+        if config.get('batch_max_inputs') and _model_worker(module_name) is not None:
+            jobs += _gather_inference_batch(module_name, job)
+        
+        if len(jobs) > 1:
+            results = _execute_inference_batch(module_name, jobs)
+        else:
+            results = [_execute_module_inference(module_name, job)]
+        
+        for job, (payload, status_code) in zip(jobs, results):
+            _finish_inference_job(module_name, job, payload, status_code)
+
+def _finish_inference_job(module_name, job, payload, status_code):
+    """记录任务结果并唤醒等待者"""
+    with inference_job_lock:
+        job['result'] = payload
+        job['status_code'] = status_code
+        if _inference_cancel_requested(job):
+            job['status'] = 'cancelled'
+        elif status_code == 200 and payload.get('returncode') == 0:
+            job['status'] = 'succeeded'
+        else:
+            job['status'] = 'failed'
+        job['finished_at'] = datetime.now().isoformat()
+        inference_job_lock.notify_all()
+    _save_inference_job(job)
+    _prune_inference_jobs()
+    print(f"推理任务 {job['job_id']} ({module_name}) 结束，状态: {job['status']}")
+
+def _save_inference_job(job):
+    """把任务记录写入状态存储，其他工作进程据此查询状态；保留其他进程写入的取消请求
+    
+    在 inference_job_lock 内取快照、锁外写入（SQLite 写入需要等待磁盘），不能持有该锁调用；
+    快照带递增的版本号，并发保存时较早的快照不会覆盖较新的记录。
+    """
+    with inference_job_lock:
+        job['revision'] = job.get('revision', 0) + 1
+        record = {key: job.get(key) for key in INFERENCE_JOB_FIELDS}
+        record['revision'] = job['revision']
+        worker = job.get('model_worker')
+        record['model_worker_pid'] = worker.process.pid if worker is not None and worker.alive() else None
+        record['live_result_count'] = len(job.get('live_results') or ())
+    def merge(stored):
+        if stored and stored.get('revision', 0) > record['revision']:
+            return None
+        if stored and stored.get('cancel_requested'):
+            record['cancel_requested'] = True
+        return record
+    if state_store.update('inference_jobs', job['job_id'], merge) is not None:
+        _index_inference_job(record)
+
+def _index_inference_job(record):
+    """维护按模块的排队索引、按工作区的任务索引和已结束索引，工作线程、任务列表和清理只读取这些小命名空间，不扫描全部任务记录"""
+    queue_namespace = f"inference_queue/{record['module']}"
+    if record['status'] == 'queued':
+        state_store.put(f"inference_workspace/{record['workspace_id']}", record['job_id'], record['created_at'])
+        state_store.put(queue_namespace, record['job_id'], record['created_at'])
+    else:
+        state_store.delete(queue_namespace, record['job_id'])
+    if record['status'] in ('succeeded', 'failed', 'cancelled'):
+        state_store.put('inference_finished', record['job_id'], record['finished_at'] or '')
+
+def _inference_live_results(job, start=0):
+    """任务从第 start 个开始的实时结果：本进程执行的任务读取 job['live_results']，否则从状态存储读取"""
+    if 'live_results' in job:
+        return job['live_results'][start:]
+    stored = state_store.items(f"inference_live/{job['job_id']}")
+    return [stored[key] for key in sorted(stored)][start:]
+
+def _find_inference_job(job_id):
+    """本进程中的任务，或状态存储中其他工作进程的任务记录，不存在时返回 None"""
+    with inference_job_lock:
+        job = inference_jobs.get(job_id)
+    return job if job is not None else state_store.get('inference_jobs', job_id)
+
+def _inference_cancel_requested(job):
+    """任务是否已被取消（包括在其他工作进程中发出的取消请求）"""
+    if not job.get('cancel_requested') and state_store.shared:
+        record = state_store.get('inference_jobs', job['job_id'])
+        if record and record.get('cancel_requested'):
+            job['cancel_requested'] = True
+    return bool(job.get('cancel_requested'))
+
+def _ensure_inference_executor():
+    """成为执行推理任务的进程并启动各模块的工作线程（需持有 inference_job_lock）；
+    共享存储时只有持有执行锁的进程执行任务，其他进程提交的任务经状态存储传递。返回本进程是否为执行进程"""
+    global inference_executor
+    if not inference_executor:
+        if not state_store.acquire_executor():
+            return False
+        inference_executor = True
+        _recover_orphaned_inference_jobs()
+    for module_name in MODULE_CONFIG:
+        worker = inference_workers.get(module_name)
+        if worker is None or not worker.is_alive():
+            worker = threading.Thread(target=_inference_worker, args=(module_name,),
+                                      name=f'inference-{module_name}', daemon=True)
+            worker.start()
+            inference_workers[module_name] = worker
+    return True
+
+def _recover_orphaned_inference_jobs():
+    """接管执行时，把由已退出的工作进程执行到一半的任务标记为失败"""
+    for job_id, record in state_store.items('inference_jobs').items():
+        if record['status'] not in ('running', 'waiting_gpu') or _process_alive(record.get('owner_pid')):
+            continue
+        def fail(record):
+            if record is None or record['status'] not in ('running', 'waiting_gpu'):
+                return None
+            record.update(status='failed', status_code=500, finished_at=datetime.now().isoformat(),
+                          result={'error': '执行任务的工作进程已退出'})
+            return record
+        record = state_store.update('inference_jobs', job_id, fail)
+        if record is not None:
+            _index_inference_job(record)
+        print(f"推理任务 {job_id} 的执行进程已退出，标记为失败")
+
+def _import_queued_inference_jobs(module_name):
+    """把其他工作进程提交到状态存储、本进程还没有的排队任务加入模块队列（在 inference_job_lock 之外读取状态存储）"""
+    queue = inference_job_queues[module_name]
+    queue_namespace = f'inference_queue/{module_name}'
+    with inference_job_lock:
+        known = set(inference_jobs)
+    imported = []
+    for job_id in state_store.items(queue_namespace):
+        if job_id in known:
+            continue
+        record = state_store.get('inference_jobs', job_id)
+        if record is None or record['status'] != 'queued':
+            state_store.delete(queue_namespace, job_id)  # 已被取消或清理
+            continue
+        record['live_results'] = []
+        imported.append(record)
+    if not imported:
+        return
+    with inference_job_lock:
+        for job in imported:
+            if job['job_id'] not in inference_jobs:
+                inference_jobs[job['job_id']] = job
+                queue.append(job)
+        queue.sort(key=lambda job: job['created_at'])
+        inference_job_lock.notify_all()
+
+def _prune_inference_jobs():
+    """只保留最近的已结束任务，避免任务记录无限增长（在 inference_job_lock 之外读写状态存储）"""
+    finished = state_store.items('inference_finished')
+    if len(finished) <= INFERENCE_JOB_RETENTION:
+        return
+    for job_id in sorted(finished, key=finished.get)[:len(finished) - INFERENCE_JOB_RETENTION]:
+        record = state_store.get('inference_jobs', job_id)
+        if record is not None:
+            state_store.delete(f"inference_workspace/{record['workspace_id']}", job_id)
+        state_store.delete('inference_jobs', job_id)
+        state_store.delete('inference_finished', job_id)
+        state_store.clear(f'inference_live/{job_id}')
+        with inference_job_lock:
+            inference_jobs.pop(job_id, None)
+
+def _inference_queue_position(job):
+    """排队任务在模块队列中的位置（从1开始），不在排队时为 0（本进程的任务需持有 inference_job_lock）"""
+    if job['status'] != 'queued':
+        return 0
+    for position, queued in enumerate(inference_job_queues[job['module']]):
+        if queued['job_id'] == job['job_id']:
+            return position + 1
+    # 其他工作进程提交、尚未被执行进程取入队列的任务
+    queued = state_store.items(f"inference_queue/{job['module']}")
+    return 1 + sum(1 for created_at in queued.values() if created_at < job['created_at'])
+
+def _inference_job_view(job):
+    """生成对外返回的任务信息（本进程的任务需持有 inference_job_lock，其他工作进程的任务记录从状态存储读取，不需要持有）"""
+    view = {
+        'job_id': job['job_id'],
+        'module': job['module'],
+        'module_name': MODULE_CONFIG[job['module']]['name'],
+        'status': job['status'],
+        'force': job.get('force', False),
+        'queue_position': _inference_queue_position(job),
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'status_url': f"/jobs/{job['job_id']}",
+        'results_stream_url': f"/jobs/{job['job_id']}/results/stream",
+        'live_result_count': len(job['live_results']) if 'live_results' in job else
+                             job.get('live_result_count') if job['status'] in ('succeeded', 'failed', 'cancelled') else
+                             len(_inference_live_results(job))
+    }
+    if job['status'] in ('succeeded', 'failed', 'cancelled'):
+        view['result'] = job['result']
+        view['status_code'] = job['status_code']
+    return view
+
+def _render_inference_job(job):
+    """生成任务信息：本进程的任务在 inference_job_lock 内读取内存状态，其他工作进程的任务在锁外读取状态存储"""
+    with inference_job_lock:
+        if inference_jobs.get(job['job_id']) is job:
+            return _inference_job_view(job)
+    return _inference_job_view(job)
+
+def _inference_force_requested():
+    """请求是否要求重新处理全部输入（?force=true 或 JSON 请求体中的 force）"""
+    value = request.args.get('force')
+    if value is None:
+        value = (request.get_json(silent=True) or {}).get('force')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+@app.route('/run_inference/<module_name>', methods=['POST'])
+def run_module_inference(module_name):
+    """模块化推理接口 - 提交推理任务并立即返回任务ID"""
+    if module_name not in MODULE_CONFIG:
+        return jsonify({'error': f'不支持的模块: {module_name}'}), 400
+    
+    workspace_id = _current_workspace_id()
+    problem = _check_inference_inputs(module_name, workspace_id)
+    if problem:
+        return jsonify({'error': problem[0]}), problem[1]
+    
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'module': module_name,
+        'workspace_id': workspace_id,
+        'force': _inference_force_requested(),
+        'status': 'queued',
+        'created_at': datetime.now().isoformat(),
+        'started_at': None,
+        'finished_at': None,
+        'result': None,
+        'status_code': None,
+        'live_results': []
+    }
+    
+    _save_inference_job(job)
+    with inference_job_lock:
+        if _ensure_inference_executor():
+            # 工作线程可能已经从状态存储导入了这个任务
+            if inference_jobs.setdefault(job['job_id'], job) is job:
+                inference_job_queues[module_name].append(job)
+            job = inference_jobs[job['job_id']]
+            inference_job_lock.notify_all()
+    view = _render_inference_job(job)
+    
+    print(f"已提交{MODULE_CONFIG[module_name]['name']}推理任务 {job['job_id']}，队列位置: {view['queue_position']}")
+    view['message'] = f"{MODULE_CONFIG[module_name]['name']}推理任务已提交"
+    return jsonify(view), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_inference_jobs():
+    """列出当前工作区的推理任务，可通过 ?module= 过滤"""
+    module_name = request.args.get('module')
+    if module_name and module_name not in MODULE_CONFIG:
+        return jsonify({'error': f'不支持的模块: {module_name}'}), 400
+    
+    workspace_id = _current_workspace_id()
+    jobs = []
+    for job_id in state_store.items(f'inference_workspace/{workspace_id}'):
+        with inference_job_lock:
+            job = inference_jobs.get(job_id)
+        job = job or state_store.get('inference_jobs', job_id)
+        if job is not None and (not module_name or job['module'] == module_name):
+            jobs.append(_render_inference_job(job))
+    
+    # 列表中不返回完整结果，避免响应过大
+    for job in jobs:
+        job.pop('result', None)
+    jobs.sort(key=lambda job: job['created_at'], reverse=True)
+    
+    return jsonify({
+        'jobs': jobs,
+        'count': len(jobs)
+    })
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_inference_job(job_id):
+    """获取当前工作区的推理任务的状态、队列位置和结果"""
+    job = _workspace_inference_job(job_id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    if state_store.shared and (job['status'] == 'queued' or (
+            job['status'] in ('waiting_gpu', 'running') and not _process_alive(job.get('owner_pid')))):
+        # 原执行进程已退出时由本进程接管排队中的任务，并把执行到一半的任务标记为失败
+        with inference_job_lock:
+            executor = _ensure_inference_executor()
+        if executor:
+            job = _find_inference_job(job_id) or job
+    return jsonify(_render_inference_job(job))
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_inference_job(job_id):
+    """取消当前工作区排队中或正在运行的推理任务"""
+    if not _workspace_inference_job(job_id):
+        return jsonify({'error': '任务不存在'}), 404
+    with inference_job_lock:
+        job = inference_jobs.get(job_id)
+        queue = inference_job_queues[job['module']] if job else None
+        # 已从队列取出、正在标记开始的任务按状态存储中的记录取消，标记开始时会发现已被取消
+        if not job or (job['status'] == 'queued' and job not in queue):
+            previous = None
+        else:
+            previous = job['status']
+            if previous == 'queued':
+                queue.remove(job)
+                job['status'] = 'cancelled'
+                job['cancel_requested'] = True
+                job['finished_at'] = datetime.now().isoformat()
+                job['result'] = {'error': '推理任务已被用户取消'}
+                job['status_code'] = 409
+                inference_job_lock.notify_all()
+            elif previous in ('running', 'waiting_gpu'):
+                job['cancel_requested'] = True
+            process = job.get('process')
+            model_worker = job.get('model_worker')
+    
+    if previous is None:
+        return _cancel_remote_inference_job(job_id)
+    if previous not in ('queued', 'running', 'waiting_gpu'):
+        return jsonify({'success': True, 'message': '任务已经结束'})
+    _save_inference_job(job)
+    if previous == 'queued':
+        return jsonify({'success': True, 'message': '排队中的任务已取消'})
+    
+    # 唤醒正在等待显存准入的任务，使其尽快放弃等待
+    with gpu_scheduler_lock:
+        gpu_scheduler_lock.notify_all()
+    
+    if process is not None and process.poll() is None:
+        print(f"正在取消推理任务 {job_id}，PID: {process.pid}")
+        _kill_process_group(process)
+    
+    # 常驻进程无法中断单个任务，只能终止进程（随后自动重启）
+    if model_worker is not None and model_worker.alive():
+        print(f"正在取消推理任务 {job_id}，终止常驻模型进程 PID: {model_worker.process.pid}")
+        _kill_process_group(model_worker.process)
+    
+    return jsonify({'success': True, 'message': '正在运行的任务已取消'})
+
+def _cancel_remote_inference_job(job_id):
+    """取消由其他工作进程执行的任务：排队中的直接标记为已取消，运行中的写入取消请求并按进程组号终止子进程"""
+    previous = {}
+    def request_cancel(record):
+        if record is None:
+            return None
+        previous['status'] = record['status']
+        if record['status'] == 'queued':
+            record.update(status='cancelled', cancel_requested=True, finished_at=datetime.now().isoformat(),
+                          result={'error': '推理任务已被用户取消'}, status_code=409)
+        elif record['status'] in ('running', 'waiting_gpu'):
+            record['cancel_requested'] = True
+        else:
+            return None
+        return record
+    record = state_store.update('inference_jobs', job_id, request_cancel)
+    if record is not None:
+        _index_inference_job(record)
+    
+    if 'status' not in previous:
+        return jsonify({'error': '任务不存在'}), 404
+    if record is None:
+        return jsonify({'success': True, 'message': '任务已经结束'})
+    if previous['status'] == 'queued':
+        return jsonify({'success': True, 'message': '排队中的任务已取消'})
+    
+    # 等待显存的任务由执行进程轮询取消请求；常驻进程无法中断单个任务，只能终止进程（随后自动重启）
+    for pid in (record.get('pid'), record.get('model_worker_pid')):
+        if pid:
+            print(f"正在取消推理任务 {job_id}，终止其他工作进程启动的进程组 {pid}")
+            _terminate_process_group(pid)
+    return jsonify({'success': True, 'message': '正在运行的任务已取消'})
+
+def _workspace_inference_job(job_id):
+    """当前工作区的推理任务，不存在或属于其他工作区时返回 None"""
+    job = _find_inference_job(job_id)
+    if not job or job['workspace_id'] != _current_workspace_id():
+        return None
+    return job
+
+def _wait_live_results(job_id, index, timeout):
+    """等待任务出现第 index 个之后的实时结果或任务结束，返回 (新结果, 任务状态)；
+    其他工作进程中的任务在 inference_job_lock 之外轮询状态存储"""
+    finished = ('succeeded', 'failed', 'cancelled')
+    deadline = time.time() + timeout
+    while True:
+        with inference_job_lock:
+            job = inference_jobs.get(job_id)
+            if job is not None:
+                inference_job_lock.wait_for(lambda: len(job['live_results']) > index or job['status'] in finished,
+                                            max(0, deadline - time.time()))
+                return job['live_results'][index:], job['status']
+        job = state_store.get('inference_jobs', job_id) or {'job_id': job_id, 'status': 'failed'}  # 记录已被清理
+        events = _inference_live_results(job, index)
+        remaining = deadline - time.time()
+        if events or job['status'] in finished or remaining <= 0:
+            return events, job['status']
+        time.sleep(min(remaining, STATE_POLL_INTERVAL))
+
+def _live_result_stream(job_id, start_index):
+    """生成任务实时结果的SSE事件流，任务结束后以 done 事件携带任务状态"""
+    index = start_index
+    yield 'retry: 3000\n\n'
+    
+    while True:
+        events, status = _wait_live_results(job_id, index, SSE_KEEPALIVE_INTERVAL)
+        
+        for event in events:
+            index += 1
+            yield f'id: {index}\nevent: result\ndata: {json.dumps(event)}\n\n'
+        
+        if status in ('succeeded', 'failed', 'cancelled'):
+            # 结果监视在任务结束前已停止，此时不会再有新的结果
+            yield f'event: done\ndata: {json.dumps({"status": status, "count": index})}\n\n'
+            return
+        if not events:
+            yield ': keepalive\n\n'
+
+@app.route('/jobs/<job_id>/results/stream', methods=['GET'])
+def stream_inference_results(job_id):
+    """以SSE方式推送推理任务运行期间新写完的结果文件"""
+    job = _workspace_inference_job(job_id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    return _sse_response(_live_result_stream(job_id, _sse_start_offset()))
+
+@app.route('/jobs/<job_id>/files/<path:relative_path>', methods=['GET'])
+def get_inference_job_file(job_id, relative_path):
+    """获取推理任务的结果文件：运行中先从正在监视的结果目录读取，否则从工作区输出目录读取"""
+    job = _workspace_inference_job(job_id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    _, workspace_output_dir = _workspace_dirs(job['module'], job['workspace_id'])
+    base_dirs = [workspace_output_dir]
+    if job['status'] not in ('succeeded', 'failed', 'cancelled') and job.get('live_dir'):
+        # 脚本的结果在运行结束后才移动到工作区，运行中同名的旧结果不应被返回
+        base_dirs.insert(0, job['live_dir'])
+    
+    for base_dir in base_dirs:
+        path = _safe_join(base_dir, relative_path)
+        if path and os.path.isfile(path):
+            return _serve_media_file(path)
+    return jsonify({'error': '文件不存在'}), 404
 
 @app.route('/upload_status', methods=['GET'])
 @app.route('/upload_status/<module_name>', methods=['GET'])
 def upload_status(module_name='infrared'):
-    """检查指定模块是否有已上传的文件"""
+    """检查当前工作区的指定模块是否有已上传的文件"""
     if module_name not in MODULE_CONFIG:
         return jsonify({'error': f'不支持的模块: {module_name}'}), 400
     
-    if uploaded_data[module_name]['images']:
-        total_files = len(uploaded_data[module_name]['images'])
-        latest_file = uploaded_data[module_name]['images'][-1]  # 最新上传的文件
-        all_filenames = [file['original_name'] for file in uploaded_data[module_name]['images']]
+    uploads = _workspace_uploads(module_name)
+    if uploads:
+        total_files = len(uploads)
+        latest_file = uploads[-1]  # 最新上传的文件
+        all_filenames = [file['original_name'] for file in uploads]
         
         return jsonify({
             'has_files': True,
@@ -475,78 +2593,47 @@ def upload_status(module_name='infrared'):
 @app.route('/clear_cache', methods=['POST'])  
 @app.route('/clear_cache/<module_name>', methods=['POST'])
 def clear_cache(module_name='infrared'):
-    """清除指定模块的上传文件缓存"""
+    """清除当前工作区在指定模块下的上传文件缓存"""
     if module_name not in MODULE_CONFIG:
         return jsonify({'error': f'不支持的模块: {module_name}'}), 400
     
     config = MODULE_CONFIG[module_name]
     
-    import shutil
     try:
-        # 清除内存中的文件信息
-        uploaded_data[module_name]['images'].clear()
-
-        # 递归清空 input 目录
-        input_dir = config['input_dir']
-        if os.path.exists(input_dir):
-            for item in os.listdir(input_dir):
-                item_path = os.path.join(input_dir, item)
-                if os.path.isfile(item_path):
-                    os.remove(item_path)
-                elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
+        # 清除上传索引中的文件信息
+        uploads = []
+        def take_all(current):
+            uploads.extend(current)
+            current.clear()
+        _update_workspace_uploads(module_name, None, take_all)
+        folder_names = {file_info['folder_name'] for file_info in uploads if file_info.get('is_folder_upload')}
+        digests = {file_info['sha256'] for file_info in uploads if file_info.get('sha256')}
 
-        # 递归清空 output 目录
-        output_dir = config['output_dir']
-        if os.path.exists(output_dir):
-            for item in os.listdir(output_dir):
-                item_path = os.path.join(output_dir, item)
-                if os.path.isfile(item_path):
-                    os.remove(item_path)
-                elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
+        # 递归清空工作区目录（输入、输出以及转换后的视频文件）
+        _clear_directory(_workspace_root(module_name))
+        _reset_output_manifest(module_name, _current_workspace_id())
 
-        # 清理转换后的视频文件
-        converted_dir = '/home/vipuser/Downloads/MAP-Net/converted'
-        if os.path.exists(converted_dir):
-            for item in os.listdir(converted_dir):
-                item_path = os.path.join(converted_dir, item)
-                if os.path.isfile(item_path):
-                    os.remove(item_path)
-                elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-
-        # 清理转换后的输出视频文件
-        converted_output_dir = '/home/vipuser/Downloads/MAP-Net/converted_output'
-        if os.path.exists(converted_output_dir):
-            for item in os.listdir(converted_output_dir):
-                item_path = os.path.join(converted_output_dir, item)
-                if os.path.isfile(item_path):
-                    os.remove(item_path)
-                elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-
-        # 如果是图像模块，额外清理指定的两个路径
+        # 如果是图像模块，额外清理本工作区上传的数据集文件夹及其实验结果（只删除登记为本工作区的文件夹）
         if module_name == 'image':
-            # 清理用户上传的文件夹路径
-            user_input_dir = '/home/vipuser/home/img/userInput/Synthetic_NSVF'
-            if os.path.exists(user_input_dir):
-                for item in os.listdir(user_input_dir):
-                    item_path = os.path.join(user_input_dir, item)
-                    if os.path.isfile(item_path):
-                        os.remove(item_path)
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-            
-            # 清理实验结果路径
             experiment_dir = '/home/vipuser/home/img/nvs/experiments'
-            if os.path.exists(experiment_dir):
-                for item in os.listdir(experiment_dir):
-                    item_path = os.path.join(experiment_dir, item)
-                    if os.path.isfile(item_path):
-                        os.remove(item_path)
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
+            workspace_id = _current_workspace_id()
+            for folder_name in folder_names:
+                owner = state_store.get('upload_folders', folder_name)
+                if owner is None or owner['workspace_id'] != workspace_id:
+                    continue
+                folder_input_dir = _folder_upload_dir(folder_name)
+                if folder_input_dir is None:
+                    continue
+                shutil.rmtree(folder_input_dir, ignore_errors=True)
+                _dir_index_forget(folder_input_dir)
+                state_store.delete('upload_folders', folder_name)
+                if os.path.exists(experiment_dir):
+                    for item in os.listdir(experiment_dir):
+                        if item.startswith(f'{folder_name}_output_'):
+                            shutil.rmtree(os.path.join(experiment_dir, item), ignore_errors=True)
+
+        # 释放只被本工作区引用的上传内容
+        _prune_blob_store(digests)
 
         return jsonify({
             'message': f'{config["name"]}缓存已清除，所有上传、输出和转换后的视频文件已删除' + 
@@ -559,211 +2646,279 @@ from flask import send_file
 import io
 import zipfile
 
+# 流式打包下载 - 边读文件边压缩边发送，内存占用与文件大小无关
+ZIP_STREAM_CHUNK_SIZE = 1024 * 1024  # 每次读取 1MB
+# 已经压缩过的媒体格式直接存储，不再重复压缩
+ZIP_STORED_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv', '.png', '.jpg', '.jpeg',
+                         '.gif', '.webp', '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z'}
+
+class _ZipStreamWriter:
+    """只写、不可寻址的文件对象：zipfile 写入的数据暂存于此，由生成器逐块取出发送"""
+    
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._position
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _collect_archive_files(base_dir):
+    """收集目录下所有非空文件，返回 [(绝对路径, zip内相对路径)]"""
+    files = []
+    for root, dirs, names in os.walk(base_dir):
+        dirs.sort()
+        for name in sorted(names):
+            abs_path = os.path.join(root, name)
+            if os.path.isfile(abs_path) and os.path.getsize(abs_path) > 0:
+                files.append((abs_path, os.path.relpath(abs_path, base_dir)))
+    return files
+
+def _generate_zip_stream(files):
+    """逐块生成zip数据（不可寻址写入，使用数据描述符；大文件自动使用zip64）"""
+    writer = _ZipStreamWriter()
+    with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for abs_path, arcname in files:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(abs_path, arcname)
+                extension = os.path.splitext(arcname)[1].lower()
+                zinfo.compress_type = zipfile.ZIP_STORED if extension in ZIP_STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                with open(abs_path, 'rb') as source, zf.open(zinfo, 'w') as dest:
+                    while True:
+                        chunk = source.read(ZIP_STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = writer.drain()
+                        if data:
+                            yield data
+            except OSError as e:
+                print(f"添加文件失败: {abs_path}, 错误: {e}")
+            data = writer.drain()
+            if data:
+                yield data
+    # 关闭时写入的中央目录
+    yield writer.drain()
+
+def _zip_stream_response(files, zip_filename):
+    """以流式zip响应返回文件列表"""
+    return Response(
+        _generate_zip_stream(files),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename={zip_filename}',
+            'Cache-Control': 'no-cache, no-store',  # 禁用缓存
+            'X-Accel-Buffering': 'no'  # 让nginx直接转发，不缓冲整个响应
+        }
+    )
+
 # 批量打包下载 output/result 目录下所有内容
 @app.route('/download_all_result/<module_name>', methods=['GET'])
 def download_all_result(module_name):
-    """打包下载指定模块的 output/result 目录所有内容（zip）"""
+    """打包下载当前工作区在指定模块下的结果目录所有内容（zip）"""
     if module_name not in MODULE_CONFIG:
         return jsonify({'error': f'不支持的模块: {module_name}'}), 400
-    config = MODULE_CONFIG[module_name]
-    output_dir = config['output_dir']
+    _, output_dir = _workspace_dirs(module_name)
     if not os.path.exists(output_dir):
         return jsonify({'error': '结果目录不存在'}), 404
     
-    # 添加调试信息
-    print(f"正在打包目录: {output_dir}")
-    
-    # 检查目录中的文件
-    all_files = []
-    for root, dirs, files in os.walk(output_dir):
-        for file in files:
-            abs_path = os.path.join(root, file)
-            if os.path.isfile(abs_path) and os.path.getsize(abs_path) > 0:
-                all_files.append(abs_path)
-                print(f"找到文件: {abs_path} (大小: {os.path.getsize(abs_path)} bytes)")
-    
+    all_files = [(os.path.join(output_dir, relative_path), relative_path)
+                 for relative_path, entry in sorted(_output_manifest(module_name).items()) if entry['size'] > 0]
     if not all_files:
         return jsonify({'error': '结果目录中没有文件'}), 404
     
-    # 创建一个新的BytesIO对象，避免缓存问题
-    mem_zip = io.BytesIO()
+    print(f"正在流式打包目录: {output_dir}，共 {len(all_files)} 个文件")
     
-    try:
-        with zipfile.ZipFile(mem_zip, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
-            for abs_path in all_files:
-                rel_path = os.path.relpath(abs_path, output_dir)
-                try:
-                    # 确保文件真的存在并且可读
-                    with open(abs_path, 'rb') as f:
-                        file_data = f.read()
-                    zf.writestr(rel_path, file_data)
-                    print(f"已添加到zip: {rel_path} (数据大小: {len(file_data)} bytes)")
-                except Exception as e:
-                    print(f"添加文件失败: {abs_path}, 错误: {e}")
-        
-        mem_zip.seek(0)
-        zip_size = len(mem_zip.getvalue())
-        print(f"生成的zip文件大小: {zip_size} bytes")
-        
-        if zip_size < 1000:  # 如果zip文件太小，可能有问题
-            print(f"警告：生成的zip文件异常小: {zip_size} bytes")
-        
-        # 使用时间戳避免缓存
-        from datetime import datetime
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        zip_filename = f"{module_name}_results_{timestamp}.zip"
-        
-        return send_file(
-            mem_zip, 
-            mimetype='application/zip', 
-            as_attachment=True, 
-            attachment_filename=zip_filename,
-            cache_timeout=0  # 禁用缓存
-        )
-    except Exception as e:
-        print(f"创建zip文件时发生错误: {e}")
-        return jsonify({'error': f'打包失败: {str(e)}'}), 500
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return _zip_stream_response(all_files, f"{module_name}_results_{timestamp}.zip")
 
-# 下载推荐数据集
-@app.route('/download_dataset/video', methods=['GET'])
-def download_video_dataset():
-    """下载视频模块的推荐数据集"""
-    dataset_dir = '/home/vipuser/Downloads/MAP-Net/dataset/video'
+def _send_file_conditional(path, mimetype=None, download_name=None, etag=None, max_age=None):
+    """发送文件，支持 ETag/Last-Modified 条件请求以及 HTTP Range 断点续传"""
+    stat = os.stat(path)
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
     
-    if not os.path.exists(dataset_dir):
-        return jsonify({'error': '数据集目录不存在'}), 404
+    response = Response(wrap_file(request.environ, open(path, 'rb')), mimetype=mimetype, direct_passthrough=True)
+    response.content_length = stat.st_size
+    response.last_modified = int(stat.st_mtime)
+    response.set_etag(etag or f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    if max_age is None:
+        response.cache_control.no_cache = True  # 允许缓存，但每次都需用 ETag 验证
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    if download_name:
+        response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    
+    return response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+
+# 媒体文件发送 - 路径检查在Python中完成，开启 X-Accel-Redirect 后由nginx的 internal location 直接发送文件
+# （零拷贝 sendfile，支持Range和条件请求），不再占用Python工作线程；未经nginx访问时由Flask直接发送
+MEDIA_ACCEL_REDIRECT = True  # 请求带有nginx设置的 X-Media-Accel 头时才会生效
+MEDIA_ACCEL_HEADER = 'X-Media-Accel'
+MEDIA_ACCEL_LOCATIONS = {
+    # internal location 前缀 -> 对应的文件系统目录（需与 nginx_config_updated.conf 保持一致）
+    '/_media/video_workspaces/': '/home/vipuser/Downloads/MAP-Net/workspaces',
+    '/_media/lidar_visualization/': '/home/vipuser/home/huangff/lidargen-main/kitti_pretrained/unconditional_samples',
+    '/_media/nvs_experiments/': '/home/vipuser/home/img/nvs/experiments',
+    '/_media/nvs_user_input/': '/home/vipuser/home/img/userInput/Synthetic_NSVF',
+    '/_media/dataset_archives/': '/home/vipuser/Downloads/dataset_archive_cache'
+}
+
+def _safe_join(base_dir, *parts):
+    """拼接路径并确认结果仍位于 base_dir 内（解析 .. 和符号链接），越界时返回 None"""
+    base = os.path.realpath(base_dir)
+    path = os.path.realpath(os.path.join(base, *parts))
+    if path != base and os.path.commonpath([base, path]) != base:
+        return None
+    return path
+
+def _media_accel_uri(path):
+    """文件对应的nginx internal location 地址，不在映射目录内时返回 None"""
+    for prefix, root in MEDIA_ACCEL_LOCATIONS.items():
+        root = os.path.realpath(root)
+        if path != root and os.path.commonpath([root, path]) == root:
+            return prefix + quote(os.path.relpath(path, root))
+    return None
+
+def _serve_media_file(path, mimetype=None, download_name=None, etag=None, max_age=None):
+    """发送已通过路径检查的文件：经nginx访问时交给 X-Accel-Redirect，否则由Flask发送"""
+    path = os.path.realpath(path)
+    accel_uri = _media_accel_uri(path) if MEDIA_ACCEL_REDIRECT and request.headers.get(MEDIA_ACCEL_HEADER) == '1' else None
+    if accel_uri is None:
+        return _send_file_conditional(path, mimetype=mimetype, download_name=download_name, etag=etag, max_age=max_age)
+    
+    response = Response(mimetype=mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = accel_uri
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    if download_name:
+        response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    return response
+
+# 推荐数据集 - 数据集内容基本不变，打包结果按文件清单哈希缓存到磁盘，目录变化时才重新打包
+DATASET_ARCHIVES = {
+    'video': {
+        'dataset_dir': '/home/vipuser/Downloads/MAP-Net/dataset/video',
+        'archive_name': 'video_dataset',
+        'label': '视频'
+    },
+    'image': {
+        'dataset_dir': '/home/vipuser/home/img/data/dataforUser',
+        'archive_name': 'image_dataset',
+        'label': '图像'
+    }
+}
+DATASET_ARCHIVE_CACHE_DIR = '/home/vipuser/Downloads/dataset_archive_cache'
+dataset_archive_locks = {name: threading.Lock() for name in DATASET_ARCHIVES}
+
+def _dataset_directory_manifest(entries):
+    """单个目录的清单：非空文件的名称、大小和修改时间的哈希，文件数和子目录列表"""
+    digest = hashlib.sha1()
+    files = sorted((entry for entry in entries if not entry['is_dir'] and entry['size'] > 0), key=lambda entry: entry['name'])
+    for entry in files:
+        digest.update(f"{entry['name']}\0{entry['size']}\0{entry['mtime']!r}\n".encode('utf-8'))
+    subdirs = sorted(entry['name'] for entry in entries if entry['is_dir'])
+    return digest.hexdigest(), len(files), subdirs
+
+def _dataset_manifest_hash(path):
+    """计算数据集清单哈希，返回 (哈希, 文件数)，目录不存在时返回 (None, 0)
     
-    # 添加调试信息
-    print(f"正在打包数据集目录: {dataset_dir}")
+    各目录的清单从目录索引读取，目录不变时直接使用缓存结果，下载（包括Range和条件请求）不再逐个stat全部文件。
+    """
+    manifest = _directory_summary(path, 'dataset_manifest', _dataset_directory_manifest, with_stat=True)
+    if manifest is None:
+        return None, 0
+    own_hash, file_count, subdirs = manifest
+    digest = hashlib.sha1(own_hash.encode('ascii'))
+    for name in subdirs:
+        subdir = os.path.join(path, name)
+        if os.path.islink(subdir):
+            continue  # 与打包时的 os.walk 一致，不进入符号链接目录
+        sub_hash, sub_count = _dataset_manifest_hash(subdir)
+        if sub_hash is not None:
+            digest.update(f'{name}\0{sub_hash}\n'.encode('utf-8'))
+            file_count += sub_count
+    return digest.hexdigest(), file_count
+
+def _build_dataset_archive(dataset, manifest_hash):
+    """确保数据集压缩包已按当前清单构建，返回压缩包路径；只有需要重新打包时才遍历数据集目录"""
+    archive_name = DATASET_ARCHIVES[dataset]['archive_name']
+    archive_path = os.path.join(DATASET_ARCHIVE_CACHE_DIR, f'{archive_name}-{manifest_hash[:16]}.zip')
     
-    # 检查目录中的文件
-    all_files = []
-    for root, dirs, files in os.walk(dataset_dir):
-        for file in files:
-            abs_path = os.path.join(root, file)
-            if os.path.isfile(abs_path) and os.path.getsize(abs_path) > 0:
-                all_files.append(abs_path)
-                print(f"找到数据集文件: {abs_path} (大小: {os.path.getsize(abs_path)} bytes)")
+    # 同一数据集同时只构建一次，其他请求等待构建完成后直接使用
+    with dataset_archive_locks[dataset]:
+        if os.path.exists(archive_path):
+            return archive_path
+        
+        os.makedirs(DATASET_ARCHIVE_CACHE_DIR, exist_ok=True)
+        print(f"数据集 {dataset} 首次打包或内容已变化，重新打包: {archive_path}")
+        files = _collect_archive_files(DATASET_ARCHIVES[dataset]['dataset_dir'])
+        temp_path = f'{archive_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in _generate_zip_stream(files):
+                    f.write(chunk)
+            os.replace(temp_path, archive_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        # 删除该数据集旧版本的压缩包
+        for old_archive in glob.glob(os.path.join(DATASET_ARCHIVE_CACHE_DIR, f'{archive_name}-*.zip')):
+            if old_archive != archive_path:
+                os.remove(old_archive)
+        
+        return archive_path
+
+def _serve_dataset_archive(dataset):
+    """提供推荐数据集压缩包下载（缓存 + ETag + Range）"""
+    config = DATASET_ARCHIVES[dataset]
+    dataset_dir = config['dataset_dir']
     
-    if not all_files:
+    manifest_hash, file_count = _dataset_manifest_hash(dataset_dir)
+    if manifest_hash is None:
+        return jsonify({'error': '数据集目录不存在'}), 404
+    if not file_count:
         return jsonify({'error': '数据集目录中没有文件'}), 404
     
-    # 创建一个新的BytesIO对象，避免缓存问题
-    mem_zip = io.BytesIO()
-    
     try:
-        with zipfile.ZipFile(mem_zip, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
-            for abs_path in all_files:
-                rel_path = os.path.relpath(abs_path, dataset_dir)
-                try:
-                    # 确保文件真的存在并且可读
-                    with open(abs_path, 'rb') as f:
-                        file_data = f.read()
-                    zf.writestr(rel_path, file_data)
-                    print(f"已添加数据集到zip: {rel_path} (数据大小: {len(file_data)} bytes)")
-                except Exception as e:
-                    print(f"添加数据集文件失败: {abs_path}, 错误: {e}")
-        
-        mem_zip.seek(0)
-        zip_size = len(mem_zip.getvalue())
-        print(f"生成的数据集zip文件大小: {zip_size} bytes")
-        
-        if zip_size < 1000:  # 如果zip文件太小，可能有问题
-            print(f"警告：生成的数据集zip文件异常小: {zip_size} bytes")
-        
-        # 使用时间戳避免缓存
-        from datetime import datetime
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        zip_filename = f"video_dataset_{timestamp}.zip"
-        
-        return send_file(
-            mem_zip, 
-            mimetype='application/zip', 
-            as_attachment=True, 
-            attachment_filename=zip_filename,
-            cache_timeout=0  # 禁用缓存
+        archive_path = _build_dataset_archive(dataset, manifest_hash)
+        return _serve_media_file(
+            archive_path,
+            mimetype='application/zip',
+            download_name=f"{config['archive_name']}_{manifest_hash[:8]}.zip",
+            etag=manifest_hash
         )
     except Exception as e:
-        print(f"创建数据集zip文件时发生错误: {e}")
+        print(f"提供{config['label']}数据集压缩包时发生错误: {e}")
         return jsonify({'error': f'数据集打包失败: {str(e)}'}), 500
 
+# 下载推荐数据集
+@app.route('/download_dataset/video', methods=['GET'])
+def download_video_dataset():
+    """下载视频模块的推荐数据集"""
+    return _serve_dataset_archive('video')
+
 # 下载图像模块推荐数据集
 @app.route('/download_dataset/image', methods=['GET'])
 def download_image_dataset():
     """下载图像模块的推荐数据集"""
-    dataset_dir = '/home/vipuser/home/img/data/dataforUser'
-    
-    if not os.path.exists(dataset_dir):
-        return jsonify({'error': '数据集目录不存在'}), 404
-    
-    # 添加调试信息
-    print(f"正在打包图像数据集目录: {dataset_dir}")
-    
-    # 检查目录中的文件
-    all_files = []
-    for root, dirs, files in os.walk(dataset_dir):
-        for file in files:
-            abs_path = os.path.join(root, file)
-            if os.path.isfile(abs_path) and os.path.getsize(abs_path) > 0:
-                # 包含所有类型的文件
-                all_files.append(abs_path)
-                print(f"找到数据集文件: {abs_path} (大小: {os.path.getsize(abs_path)} bytes)")
-    
-    if not all_files:
-        return jsonify({'error': '数据集目录中没有文件'}), 404
-    
-    # 创建一个新的BytesIO对象，避免缓存问题
-    mem_zip = io.BytesIO()
-    
-    try:
-        with zipfile.ZipFile(mem_zip, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
-            for abs_path in all_files:
-                rel_path = os.path.relpath(abs_path, dataset_dir)
-                try:
-                    # 使用流式处理大文件，避免内存溢出
-                    file_size = os.path.getsize(abs_path)
-                    if file_size > 50 * 1024 * 1024:  # 文件大于50MB时使用流式处理
-                        print(f"大文件流式处理: {rel_path} (大小: {file_size} bytes)")
-                        with open(abs_path, 'rb') as f:
-                            with zf.open(rel_path, 'w') as zip_file:
-                                while True:
-                                    chunk = f.read(8192)  # 8KB chunks
-                                    if not chunk:
-                                        break
-                                    zip_file.write(chunk)
-                    else:
-                        # 小文件直接读取
-                        with open(abs_path, 'rb') as f:
-                            file_data = f.read()
-                        zf.writestr(rel_path, file_data)
-                    
-                    print(f"已添加文件到zip: {rel_path} (大小: {file_size} bytes)")
-                except Exception as e:
-                    print(f"添加文件失败: {abs_path}, 错误: {e}")
-                    # 继续处理其他文件，不中断整个过程
-        
-        mem_zip.seek(0)
-        zip_size = len(mem_zip.getvalue())
-        print(f"生成的数据集zip文件大小: {zip_size} bytes")
-        
-        if zip_size < 1000:  # 如果zip文件太小，可能有问题
-            print(f"警告：生成的数据集zip文件异常小: {zip_size} bytes")
-        
-        # 使用时间戳避免缓存
-        from datetime import datetime
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        zip_filename = f"image_dataset_{timestamp}.zip"
-        
-        return send_file(
-            mem_zip, 
-            mimetype='application/zip', 
-            as_attachment=True, 
-            attachment_filename=zip_filename,
-            cache_timeout=0  # 禁用缓存
-        )
-    except Exception as e:
-        print(f"创建数据集zip文件时发生错误: {e}")
-        return jsonify({'error': f'数据集打包失败: {str(e)}'}), 500
+    return _serve_dataset_archive('image')
 
 @app.route('/clear_cuda', methods=['POST'])
 def clear_cuda():
@@ -784,82 +2939,540 @@ def clear_cuda():
     except Exception as e:
         return jsonify({'error': f'清理CUDA显存失败: {str(e)}'}), 500
 
-@app.route('/convert_video/<filename>')
-def convert_video(filename):
-    """将视频转换为网页兼容的H.264格式"""
+# 视频转码任务池 - 有限数量的工作线程执行ffmpeg转码，同一输出文件同时只有一个转码任务（single-flight）
+TRANSCODE_WORKERS = 2  # 同时运行的ffmpeg数量
+TRANSCODE_TIMEOUT = 300  # 单个转码的超时时间（秒）
+TRANSCODE_TIMEOUT_FACTOR = 4  # 整段处理时每秒视频允许的处理时间（秒），长视频的超时按时长放宽
+TRANSCODE_JOB_RETENTION = 200  # 保留的已结束转码任务数量
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv']
+
+transcode_jobs = {}  # job_id -> 转码任务
+transcode_inflight = {}  # 输出路径 -> 排队或运行中的转码任务
+transcode_queue = []
+transcode_lock = threading.Condition()
+transcode_workers = []
+
+# 视频元数据缓存 - 按 (路径, 大小, 修改时间) 缓存 ffprobe 结果，编码已兼容浏览器时只做封装转换（remux）
+VIDEO_PROBE_CACHE_SIZE = 512
+BROWSER_VIDEO_CODECS = {'h264'}
+BROWSER_PIX_FMTS = {'yuv420p', 'yuvj420p'}
+BROWSER_AUDIO_CODECS = {'aac', 'mp3'}
+
+video_probe_cache = {}
+video_probe_lock = threading.Lock()
+
+def _probe_video(path):
+    """获取视频的容器、时长和音视频编码信息，失败时返回 None"""
     try:
-        input_path = os.path.join('/home/vipuser/Downloads/MAP-Net/input', filename)
-        # 创建转换后的文件存储目录
-        converted_dir = '/home/vipuser/Downloads/MAP-Net/converted'
-        os.makedirs(converted_dir, exist_ok=True)
-        
-        # 生成转换后的文件名
-        base_name = os.path.splitext(filename)[0]
-        converted_filename = f"{base_name}_converted.mp4"
-        output_path = os.path.join(converted_dir, converted_filename)
-        
-        # 检查原文件是否存在
-        if not os.path.exists(input_path):
-            return jsonify({'error': '原视频文件不存在'}), 404
-            
-        # 检查是否已经转换过
-        if os.path.exists(output_path):
-            return send_from_directory(converted_dir, converted_filename)
-        
-        # 使用ffmpeg转换视频为网页兼容格式
-        cmd = [
-            'ffmpeg', '-i', input_path,
-            '-c:v', 'libx264',  # 使用H.264编码
-            '-c:a', 'aac',      # 使用AAC音频编码
-            '-movflags', '+faststart',  # 优化网页播放
-            '-preset', 'medium',  # 平衡质量和速度
-            '-crf', '23',       # 质量设置
-            '-y',               # 覆盖输出文件
-            output_path
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with video_probe_lock:
+        if key in video_probe_cache:
+            return video_probe_cache[key]
+    
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=format_name,duration:stream=codec_type,codec_name,pix_fmt',
+        '-of', 'json', path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            print(f"读取视频信息失败: {result.stderr}")
+            return None
+        info = json.loads(result.stdout)
+    except Exception as e:
+        print(f"读取视频信息失败: {str(e)}")
+        return None
+    
+    streams = info.get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), {})
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+    duration = info.get('format', {}).get('duration')
+    meta = {
+        'container': info.get('format', {}).get('format_name'),
+        'duration': float(duration) if duration not in (None, 'N/A') else None,
+        'video_codec': video.get('codec_name'),
+        'pix_fmt': video.get('pix_fmt'),
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'has_audio': audio is not None
+    }
+    
+    with video_probe_lock:
+        if len(video_probe_cache) >= VIDEO_PROBE_CACHE_SIZE:
+            video_probe_cache.pop(next(iter(video_probe_cache)))
+        video_probe_cache[key] = meta
+    return meta
+
+def _transcode_codec_args(meta):
+    """根据视频元数据选择编码参数：兼容的流直接复制，其余重新编码；返回 (参数, 模式)"""
+    reencode_video = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23']  # 平衡质量和速度
+    if meta is None:
+        return reencode_video + ['-c:a', 'aac'], 'transcode'
+    
+    copy_video = meta['video_codec'] in BROWSER_VIDEO_CODECS and (meta['pix_fmt'] or 'yuv420p') in BROWSER_PIX_FMTS
+    copy_audio = not meta['has_audio'] or meta['audio_codec'] in BROWSER_AUDIO_CODECS
+    args = ['-c:v', 'copy'] if copy_video else reencode_video
+    args += ['-c:a', 'copy'] if copy_audio else ['-c:a', 'aac']
+    if copy_video and copy_audio:
+        return args, 'remux'
+    return args, 'transcode' if not copy_video else 'audio_transcode'
+
+def _converted_input_video(filename, workspace_id=None):
+    """输入视频及其转码结果的路径，返回 (源文件, 转码文件)"""
+    input_dir, _ = _workspace_dirs('video', workspace_id)
+    converted_dir = os.path.join(_workspace_root('video', workspace_id), 'converted')
+    base_name = os.path.splitext(filename)[0]
+    return os.path.join(input_dir, filename), os.path.join(converted_dir, f"{base_name}_converted.mp4")
+
+def _converted_output_video(filename, workspace_id=None):
+    """输出视频及其转码结果的路径，返回 (源文件, 转码文件)"""
+    _, output_dir = _workspace_dirs('video', workspace_id)
+    converted_dir = os.path.join(_workspace_root('video', workspace_id), 'converted_output')
+    base_name = os.path.splitext(filename)[0]
+    return os.path.join(output_dir, 'videos', filename), os.path.join(converted_dir, f"{base_name}_output_converted.mp4")
+
+# 长视频分段并行转码 - 在关键帧处切分视频流，各段并行编码后无损拼接
+SEGMENT_TRANSCODE_MIN_DURATION = 120  # 超过该时长（秒）且需要重新编码视频时分段转码
+SEGMENT_TRANSCODE_SECONDS = 60  # 每段的目标时长（秒），实际在其后的第一个关键帧处切分
+SEGMENT_TRANSCODE_PARALLELISM = max(2, (os.cpu_count() or 2) // 2)  # 所有任务共享的并行编码数
+SEGMENT_TRANSCODE_THREADS = 2  # 每个分段编码进程使用的线程数
+
+segment_encode_slots = threading.BoundedSemaphore(SEGMENT_TRANSCODE_PARALLELISM)
+
+def _transcode_timeout(duration):
+    """处理整段视频的超时时间：按视频时长放宽，时长未知时使用默认值"""
+    return max(TRANSCODE_TIMEOUT, (duration or 0) * TRANSCODE_TIMEOUT_FACTOR)
+
+def _run_ffmpeg_command(cmd, timeout=TRANSCODE_TIMEOUT):
+    """执行ffmpeg命令，成功时返回 None，失败时返回错误信息"""
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        if result.returncode != 0:
+            return f'视频转换失败: {result.stderr}'
+        return None
+    except subprocess.TimeoutExpired:
+        return '视频转换超时'
+
+def _encode_segment(segment, encoded_path):
+    """重新编码单个分段，并根据ffmpeg的 -progress 输出更新该段进度"""
+    cmd = [
+        'ffmpeg', '-i', segment['path'],
+        '-c:v', 'libx264', '-preset', 'medium', '-crf', '23',
+        '-threads', str(SEGMENT_TRANSCODE_THREADS),
+        '-an', '-nostats', '-progress', 'pipe:1',
+        '-f', 'mp4', '-y', encoded_path
+    ]
+    with segment_encode_slots:
+        segment['status'] = 'running'
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        timer = threading.Timer(TRANSCODE_TIMEOUT, process.kill)
+        timer.start()
+        try:
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'out_time_us' and value.isdigit() and segment['duration']:
+                    segment['progress'] = min(1.0, int(value) / 1e6 / segment['duration'])
+            process.wait()
+        finally:
+            timer.cancel()
+    
+    if process.returncode != 0:
+        segment['status'] = 'failed'
+        return f"分段 {segment['index']} 编码失败，返回码: {process.returncode}"
+    segment['status'] = 'done'
+    segment['progress'] = 1.0
+    return None
+
+def _segmented_transcode(job, meta, tmp_path):
+    """分段并行转码：关键帧处切分视频流 -> 并行编码 -> 拼接并合入音频"""
+    work_dir = f"{tmp_path}.segments"
+    timeout = _transcode_timeout(meta['duration'])
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        # 在关键帧处切分视频流（只复制，不编码）
+        error = _run_ffmpeg_command([
+            'ffmpeg', '-i', job['source_path'], '-map', '0:v:0', '-c', 'copy',
+            '-f', 'segment', '-segment_time', str(SEGMENT_TRANSCODE_SECONDS), '-reset_timestamps', '1',
+            '-y', os.path.join(work_dir, 'segment_%04d.mkv')
+        ], timeout)
+        if error:
+            return error
+        
+        segment_paths = sorted(glob.glob(os.path.join(work_dir, 'segment_*.mkv')))
+        if not segment_paths:
+            return '视频切分失败：没有生成分段'
+        job['segments'] = [
+            {'index': index, 'path': path, 'status': 'queued', 'progress': 0.0,
+             'duration': (_probe_video(path) or {}).get('duration')}
+            for index, path in enumerate(segment_paths)
         ]
         
-        print(f"开始转换视频: {input_path} -> {output_path}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)  # 5分钟超时
-        
-        if result.returncode == 0:
-            print(f"视频转换成功: {converted_filename}")
-            return send_from_directory(converted_dir, converted_filename)
+        # 音频单独处理：兼容时直接复制，否则转为AAC
+        audio_path = None
+        if meta['has_audio']:
+            audio_path = os.path.join(work_dir, 'audio.mka')
+            audio_codec = 'copy' if meta['audio_codec'] in BROWSER_AUDIO_CODECS else 'aac'
+            error = _run_ffmpeg_command(['ffmpeg', '-i', job['source_path'], '-map', '0:a:0', '-vn',
+                                         '-c:a', audio_codec, '-y', audio_path], timeout)
+            if error:
+                return error
+        
+        # 并行编码各分段
+        print(f"分段并行转码: {len(segment_paths)} 段，并行数 {SEGMENT_TRANSCODE_PARALLELISM}")
+        encoded_paths = [f"{path[:-4]}_encoded.mp4" for path in segment_paths]
+        with ThreadPoolExecutor(max_workers=min(len(segment_paths), SEGMENT_TRANSCODE_PARALLELISM)) as executor:
+            errors = list(executor.map(_encode_segment, job['segments'], encoded_paths))
+        errors = [error for error in errors if error]
+        if errors:
+            return errors[0]
+        
+        # 使用concat分离器无损拼接，并合入音频
+        list_path = os.path.join(work_dir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            for path in encoded_paths:
+                f.write(f"file '{path}'\n")
+        cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path:
+            cmd += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+        cmd += ['-c', 'copy', '-movflags', '+faststart', '-f', 'mp4', '-y', tmp_path]
+        return _run_ffmpeg_command(cmd, timeout)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _run_ffmpeg(job, codec_args, tmp_path):
+    """执行ffmpeg处理整段视频，成功时返回 None，失败时返回错误信息（超时按视频时长计算）"""
+    cmd = ['ffmpeg', '-i', job['source_path']] + codec_args + [
+        '-sn', '-dn',  # 字幕和数据流不写入mp4
+        '-movflags', '+faststart',  # 优化网页播放
+        '-f', 'mp4',
+        '-y',               # 覆盖输出文件
+        tmp_path
+    ]
+    return _run_ffmpeg_command(cmd, _transcode_timeout(job.get('duration')))
+
+# HLS分段输出 - 将视频打包为短分段和播放列表，首批分段写出后即可开始播放，拖动进度时只加载对应分段
+HLS_PACKAGING_ENABLED = False  # 上传或推理产生新视频后是否自动打包HLS（未开启时在首次请求播放列表时打包）
+HLS_SEGMENT_SECONDS = 4
+HLS_PACKAGING_TIMEOUT = 3600  # 打包整段视频的超时时间（秒）
+HLS_PLAYLIST = 'index.m3u8'
+HLS_SEGMENT_PATTERN = re.compile(r'^segment_\d{5}\.ts$')
+
+def _hls_video(kind, filename, workspace_id=None):
+    """视频及其HLS播放列表的路径，返回 (源文件, 播放列表)；文件名不是单纯的文件名时返回 None"""
+    name = os.path.splitext(filename)[0]
+    if filename != os.path.basename(filename) or not name or name.startswith('.'):
+        return None
+    if kind == 'input':
+        input_dir, _ = _workspace_dirs('video', workspace_id)
+        source_path = _safe_join(input_dir, filename)
+    else:
+        source_path = _safe_join(_workspace_dirs('video', workspace_id)[1], 'videos', filename)
+    hls_dir = _safe_join(_workspace_root('video', workspace_id), 'hls', kind, name)
+    if source_path is None or hls_dir is None:
+        return None
+    return source_path, os.path.join(hls_dir, HLS_PLAYLIST)
+
+def _hls_playlist_ready(playlist_path):
+    """播放列表已写完（有 ENDLIST），或已有分段且打包仍在进行时即可开始播放；
+    打包中断留下的不完整播放列表不算就绪，需要重新打包"""
+    try:
+        with open(playlist_path) as f:
+            playlist = f.read()
+        modified = os.path.getmtime(playlist_path)
+    except OSError:
+        return False
+    if '#EXT-X-ENDLIST' in playlist:
+        return True
+    if '#EXTINF' not in playlist:
+        return False
+    with transcode_lock:
+        if playlist_path in transcode_inflight:
+            return True
+    # 其他工作进程中的打包每写完一个分段都会更新播放列表
+    return time.time() - modified < HLS_SEGMENT_SECONDS * 3
+
+def _package_hls(job):
+    """将视频打包为HLS分段，分段和播放列表直接写入目标目录，边写边可播放"""
+    playlist_path = job['output_path']
+    hls_dir = os.path.dirname(playlist_path)
+    shutil.rmtree(hls_dir, ignore_errors=True)
+    os.makedirs(hls_dir, exist_ok=True)
+    
+    meta = _probe_video(job['source_path'])
+    codec_args, job['mode'] = _transcode_codec_args(meta)
+    job['duration'] = meta['duration'] if meta else None
+    if job['mode'] == 'transcode':
+        # 重新编码时按分段时长插入关键帧，保证分段边界整齐
+        codec_args += ['-force_key_frames', f'expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})']
+    
+    cmd = ['ffmpeg', '-i', job['source_path']] + codec_args + [
+        '-sn', '-dn',
+        '-f', 'hls',
+        '-hls_time', str(HLS_SEGMENT_SECONDS),
+        '-hls_playlist_type', 'event',  # 打包过程中播放列表持续追加，结束时写入 ENDLIST
+        '-hls_flags', 'temp_file',  # 分段写完后才改名，避免读到写了一半的分段
+        '-hls_segment_filename', os.path.join(hls_dir, 'segment_%05d.ts'),
+        '-y', playlist_path
+    ]
+    print(f"开始打包HLS({job['mode']}): {job['source_path']} -> {hls_dir}")
+    error = _run_ffmpeg_command(cmd, timeout=max(HLS_PACKAGING_TIMEOUT, _transcode_timeout(job['duration'])))
+    if error:
+        print(f"HLS打包失败: {error}")
+        shutil.rmtree(hls_dir, ignore_errors=True)
+        return error
+    print(f"HLS打包完成: {hls_dir}")
+    return None
+
+def _transcode_video(job):
+    """执行一次视频转换，先写入临时文件，成功后原子替换为目标文件
+    
+    音视频编码已兼容浏览器时只复制流并重新封装，否则只重新编码不兼容的流；
+    需要重新编码的长视频分段并行编码。
+    """
+    if job['format'] == 'hls':
+        return _package_hls(job)
+    
+    output_path = job['output_path']
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.{job['job_id'][:8]}.tmp"
+    
+    try:
+        meta = _probe_video(job['source_path'])
+        codec_args, job['mode'] = _transcode_codec_args(meta)
+        job['duration'] = meta['duration'] if meta else None
+        
+        print(f"开始转换视频({job['mode']}): {job['source_path']} -> {output_path}")
+        if job['mode'] == 'transcode' and meta and (meta['duration'] or 0) >= SEGMENT_TRANSCODE_MIN_DURATION:
+            error = _segmented_transcode(job, meta, tmp_path)
+            if error:
+                # 分段转码失败时退回到单进程转码
+                print(f"分段转码失败，改为单进程转码: {error}")
+                job['segments'] = None
+                error = _run_ffmpeg(job, codec_args, tmp_path)
         else:
-            print(f"视频转换失败: {result.stderr}")
-            return jsonify({'error': f'视频转换失败: {result.stderr}'}), 500
-            
-    except subprocess.TimeoutExpired:
-        return jsonify({'error': '视频转换超时'}), 500
+            error = _run_ffmpeg(job, codec_args, tmp_path)
+        if error and job['mode'] != 'transcode':
+            # 直接复制流失败（如时间戳异常），退回到完整重新编码
+            print(f"视频封装转换失败，改为重新编码: {error}")
+            codec_args, job['mode'] = _transcode_codec_args(None)
+            error = _run_ffmpeg(job, codec_args, tmp_path)
+        if error:
+            print(error)
+            return error
+        
+        os.replace(tmp_path, output_path)
+        print(f"视频转换成功: {os.path.basename(output_path)}")
+        return None
+    except Exception as e:
+        print(f"视频转换异常: {str(e)}")
+        return f'视频转换异常: {str(e)}'
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _transcode_worker():
+    """转码工作线程：按提交顺序取出任务并执行"""
+    while True:
+        with transcode_lock:
+            while not transcode_queue:
+                transcode_lock.wait()
+            job = transcode_queue.pop(0)
+            job['status'] = 'running'
+            job['started_at'] = datetime.now().isoformat()
+            _publish_transcode_job(job)
+        
+        error = _transcode_video(job)
+        
+        with transcode_lock:
+            job['status'] = 'failed' if error else 'succeeded'
+            job['error'] = error
+            job['finished_at'] = datetime.now().isoformat()
+            transcode_inflight.pop(job['output_path'], None)
+            _publish_transcode_job(job)
+            _prune_transcode_jobs()
+            transcode_lock.notify_all()
+
+def _prune_transcode_jobs():
+    """只保留最近的已结束转码任务（需持有 transcode_lock）"""
+    finished = [job for job in transcode_jobs.values() if job['status'] in ('succeeded', 'failed')]
+    for job in finished[:max(0, len(finished) - TRANSCODE_JOB_RETENTION)]:
+        transcode_jobs.pop(job['job_id'], None)
+        state_store.delete('transcode_jobs', job['job_id'])
+
+def _publish_transcode_job(job):
+    """状态变化时把任务信息写入状态存储，其他工作进程可以查询（需持有 transcode_lock）"""
+    state_store.put('transcode_jobs', job['job_id'], _transcode_job_view(job))
+
+def _submit_transcode(source_path, output_path, output_format='mp4'):
+    """提交转码任务；同一输出文件已有排队或运行中的任务时直接返回该任务
+    
+    output_format 为 'mp4' 时输出单个网页兼容的mp4文件，为 'hls' 时 output_path 为HLS播放列表。
+    """
+    with transcode_lock:
+        job = transcode_inflight.get(output_path)
+        if job is not None:
+            return job
+        
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'source_path': source_path,
+            'output_path': output_path,
+            'format': output_format,
+            'status': 'queued',
+            'error': None,
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        }
+        transcode_jobs[job['job_id']] = job
+        transcode_inflight[output_path] = job
+        transcode_queue.append(job)
+        _publish_transcode_job(job)
+        
+        # 按需启动工作线程
+        transcode_workers[:] = [worker for worker in transcode_workers if worker.is_alive()]
+        while len(transcode_workers) < TRANSCODE_WORKERS:
+            worker = threading.Thread(target=_transcode_worker, name=f'transcode-{len(transcode_workers)}', daemon=True)
+            worker.start()
+            transcode_workers.append(worker)
+        
+        transcode_lock.notify_all()
+        return job
+
+def _transcode_job_view(job):
+    """生成对外返回的转码任务信息（需持有 transcode_lock）"""
+    return {
+        'job_id': job['job_id'],
+        'filename': os.path.basename(job['source_path']),
+        'status': job['status'],
+        'format': job['format'],
+        'mode': job.get('mode'),
+        'duration': job.get('duration'),
+        'segments': [{key: segment[key] for key in ('index', 'status', 'progress', 'duration')}
+                     for segment in job['segments']] if job.get('segments') else None,
+        'queue_position': transcode_queue.index(job) + 1 if job in transcode_queue else 0,
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'status_url': f"/transcode_jobs/{job['job_id']}"
+    }
+
+def _serve_converted_video(source_path, output_path, missing_message):
+    """转码结果已存在时直接返回视频，否则提交（或复用）转码任务并返回 202"""
+    if os.path.exists(output_path):
+        return _serve_media_file(output_path, mimetype='video/mp4')
+    
+    # 检查原文件是否存在
+    if not os.path.isfile(source_path):
+        return jsonify({'error': missing_message}), 404
+    
+    job = _submit_transcode(source_path, output_path)
+    with transcode_lock:
+        view = _transcode_job_view(job)
+    view['video_url'] = request.path
+    return jsonify(view), 202
+
+def _schedule_video_transcodes(filenames, kind, workspace_id):
+    """上传（kind='input'）或推理（kind='output'）产生新视频后立即在后台开始转码"""
+    converted_path = _converted_input_video if kind == 'input' else _converted_output_video
+    for filename in filenames:
+        if os.path.splitext(filename)[1].lower() not in VIDEO_EXTENSIONS:
+            continue
+        source_path, output_path = converted_path(filename, workspace_id)
+        if not os.path.exists(output_path):
+            _submit_transcode(source_path, output_path)
+        hls_paths = _hls_video(kind, filename, workspace_id) if HLS_PACKAGING_ENABLED else None
+        if hls_paths is not None:
+            source_path, playlist_path = hls_paths
+            if not os.path.exists(playlist_path):
+                _submit_transcode(source_path, playlist_path, output_format='hls')
+
+@app.route('/transcode_jobs/<job_id>', methods=['GET'])
+def get_transcode_job(job_id):
+    """查询视频转码任务状态；由其他工作进程执行的任务返回其最近一次状态变化时的信息"""
+    with transcode_lock:
+        job = transcode_jobs.get(job_id)
+        if job is not None:
+            return jsonify(_transcode_job_view(job))
+    view = state_store.get('transcode_jobs', job_id)
+    if view is None:
+        return jsonify({'error': '转码任务不存在'}), 404
+    return jsonify(view)
+
+@app.route('/hls/<kind>/<filename>/<name>')
+def serve_hls(kind, filename, name):
+    """提供视频的HLS播放列表和分段；播放列表尚未生成时开始打包并返回 202 和任务状态地址"""
+    if kind not in ('input', 'output'):
+        return jsonify({'error': f'不支持的视频类型: {kind}'}), 400
+    
+    paths = _hls_video(kind, filename)
+    if paths is None:
+        return jsonify({'error': '无效的文件名'}), 400
+    source_path, playlist_path = paths
+    hls_dir = os.path.dirname(playlist_path)
+    
+    if name != HLS_PLAYLIST:
+        if not HLS_SEGMENT_PATTERN.match(name) or not os.path.isfile(os.path.join(hls_dir, name)):
+            return jsonify({'error': 'HLS分段不存在'}), 404
+        # 分段写出后内容不再变化
+        return _serve_media_file(os.path.join(hls_dir, name), mimetype='video/mp2t', max_age=86400)
+    
+    if _hls_playlist_ready(playlist_path):
+        with open(playlist_path) as f:
+            playlist = f.read()
+        response = Response(playlist, mimetype='application/vnd.apple.mpegurl')
+        response.cache_control.no_cache = True  # 打包过程中播放列表持续更新
+        return response
+    
+    if not os.path.isfile(source_path):
+        return jsonify({'error': '视频文件不存在'}), 404
+    
+    job = _submit_transcode(source_path, playlist_path, output_format='hls')
+    with transcode_lock:
+        view = _transcode_job_view(job)
+    view['playlist_url'] = request.path
+    return jsonify(view), 202
+
+@app.route('/convert_video/<filename>')
+def convert_video(filename):
+    """将视频转换为网页兼容的H.264格式；转码进行中时返回 202 和任务状态地址"""
+    try:
+        source_path, output_path = _converted_input_video(filename)
+        return _serve_converted_video(source_path, output_path, '原视频文件不存在')
     except Exception as e:
         print(f"视频转换异常: {str(e)}")
         return jsonify({'error': f'视频转换异常: {str(e)}'}), 500
 
+def _video_listing(entries):
+    """从目录索引生成视频列表，按修改时间倒序"""
+    videos = []
+    for entry in entries:
+        if entry['is_dir'] or os.path.splitext(entry['name'])[1].lower() not in VIDEO_EXTENSIONS:
+            continue
+        videos.append({
+            'filename': entry['name'],
+            'size': entry['size'],
+            'size_mb': round(entry['size'] / (1024 * 1024), 2),
+            'modified_time': datetime.fromtimestamp(entry['mtime']).strftime('%Y-%m-%d %H:%M:%S')
+        })
+    
+    # 按修改时间排序
+    videos.sort(key=lambda x: x['modified_time'], reverse=True)
+    return videos
+
 @app.route('/list_input_videos')
 def list_input_videos():
-    """列出输入目录中的所有视频文件"""
+    """列出当前工作区输入目录中的所有视频文件"""
     try:
-        input_dir = '/home/vipuser/Downloads/MAP-Net/input'
+        input_dir, _ = _workspace_dirs('video')
         if not os.path.exists(input_dir):
             return jsonify({'videos': [], 'message': '输入目录不存在'})
         
-        video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv']
-        videos = []
-        
-        for file in os.listdir(input_dir):
-            if any(file.lower().endswith(ext) for ext in video_extensions):
-                file_path = os.path.join(input_dir, file)
-                file_size = os.path.getsize(file_path)
-                file_mtime = os.path.getmtime(file_path)
-                
-                videos.append({
-                    'filename': file,
-                    'size': file_size,
-                    'size_mb': round(file_size / (1024 * 1024), 2),
-                    'modified_time': datetime.fromtimestamp(file_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        # 按修改时间排序
-        videos.sort(key=lambda x: x['modified_time'], reverse=True)
+        videos = _directory_summary(input_dir, 'videos', _video_listing, with_stat=True) or []
         
         return jsonify({
             'videos': videos,
@@ -871,30 +3484,16 @@ def list_input_videos():
 
 @app.route('/list_output_videos')
 def list_output_videos():
-    """列出输出目录中的所有视频文件"""
+    """列出当前工作区输出目录中的所有视频文件"""
     try:
-        output_dir = '/home/vipuser/Downloads/MAP-Net/result/videos'
+        output_dir = os.path.join(_workspace_dirs('video')[1], 'videos')
         if not os.path.exists(output_dir):
             return jsonify({'videos': [], 'message': '输出目录不存在'})
         
-        video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv']
-        videos = []
-        
-        for file in os.listdir(output_dir):
-            if any(file.lower().endswith(ext) for ext in video_extensions):
-                file_path = os.path.join(output_dir, file)
-                file_size = os.path.getsize(file_path)
-                file_mtime = os.path.getmtime(file_path)
-                
-                videos.append({
-                    'filename': file,
-                    'size': file_size,
-                    'size_mb': round(file_size / (1024 * 1024), 2),
-                    'modified_time': datetime.fromtimestamp(file_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        # 按修改时间排序
-        videos.sort(key=lambda x: x['modified_time'], reverse=True)
+        videos = _video_listing([
+            {'name': os.path.basename(relative_path), 'is_dir': False, 'size': entry['size'], 'mtime': entry['mtime']}
+            for relative_path, entry in _output_manifest('video').items() if os.path.dirname(relative_path) == 'videos'
+        ])
         
         return jsonify({
             'videos': videos,
@@ -906,67 +3505,43 @@ def list_output_videos():
 
 @app.route('/input_video/<filename>')
 def serve_input_video(filename):
-    """提供输入视频文件服务"""
-    input_dir = '/home/vipuser/Downloads/MAP-Net/input'
-    file_path = os.path.join(input_dir, filename)
+    """提供当前工作区的输入视频文件服务"""
+    input_dir, _ = _workspace_dirs('video')
+    file_path = _safe_join(input_dir, filename)
     
-    if os.path.exists(file_path):
-        return send_from_directory(input_dir, filename)
+    if file_path and os.path.isfile(file_path):
+        return _serve_media_file(file_path)
     else:
         return "Input video file not found", 404
 
 @app.route('/convert_output_video/<filename>')
 def convert_output_video(filename):
-    """将输出视频转换为网页兼容的H.264格式"""
+    """将输出视频转换为网页兼容的H.264格式；转码进行中时返回 202 和任务状态地址"""
     try:
-        input_path = os.path.join('/home/vipuser/Downloads/MAP-Net/result/videos', filename)
-        # 创建转换后的文件存储目录
-        converted_dir = '/home/vipuser/Downloads/MAP-Net/converted_output'
-        os.makedirs(converted_dir, exist_ok=True)
-        
-        # 生成转换后的文件名
-        base_name = os.path.splitext(filename)[0]
-        converted_filename = f"{base_name}_output_converted.mp4"
-        output_path = os.path.join(converted_dir, converted_filename)
-        
-        # 检查原文件是否存在
-        if not os.path.exists(input_path):
-            return jsonify({'error': '输出视频文件不存在'}), 404
-            
-        # 检查是否已经转换过
-        if os.path.exists(output_path):
-            return send_from_directory(converted_dir, converted_filename)
-        
-        # 使用ffmpeg转换视频为网页兼容格式
-        cmd = [
-            'ffmpeg', '-i', input_path,
-            '-c:v', 'libx264',  # 使用H.264编码
-            '-c:a', 'aac',      # 使用AAC音频编码
-            '-movflags', '+faststart',  # 优化网页播放
-            '-preset', 'medium',  # 平衡质量和速度
-            '-crf', '23',       # 质量设置
-            '-y',               # 覆盖输出文件
-            output_path
-        ]
-        
-        print(f"开始转换输出视频: {input_path} -> {output_path}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)  # 5分钟超时
-        
-        if result.returncode == 0:
-            print(f"输出视频转换成功: {converted_filename}")
-            return send_from_directory(converted_dir, converted_filename)
-        else:
-            print(f"输出视频转换失败: {result.stderr}")
-            return jsonify({'error': f'输出视频转换失败: {result.stderr}'}), 500
-            
-    except subprocess.TimeoutExpired:
-        return jsonify({'error': '输出视频转换超时'}), 500
+        source_path, output_path = _converted_output_video(filename)
+        return _serve_converted_video(source_path, output_path, '输出视频文件不存在')
     except Exception as e:
         print(f"输出视频转换异常: {str(e)}")
         return jsonify({'error': f'输出视频转换异常: {str(e)}'}), 500
 
-# 任务管理 - 用于跟踪长时间运行的任务
-running_tasks = {}
+# 任务管理 - 用于跟踪长时间运行的任务：任务记录保存在状态存储的 'tasks' 命名空间中，
+# 进程对象和日志写入端只存在于启动任务的工作进程中
+running_tasks = {}  # 任务ID -> 本进程启动的任务的 {'process', 'log', ...}
+
+def _save_task(task_id, record):
+    state_store.put('tasks', task_id, record)
+
+def _load_task(task_id):
+    return state_store.get('tasks', task_id)
+
+def _mark_task(task_id, **fields):
+    """更新任务记录中的字段，返回更新后的记录"""
+    return state_store.update('tasks', task_id, lambda current: dict(current, **fields) if current else None)
+
+def _task_output_log(task_id, record):
+    """任务的输出日志：本进程启动的任务直接使用 _ProcessLog，否则从日志文件读取"""
+    local = running_tasks.get(task_id)
+    return local['log'] if local else _task_log(record['log_name'])
 
 # 清除激光雷达缓存文件
 @app.route('/clear_lidar_cache', methods=['POST'])
@@ -1197,14 +3772,14 @@ def serve_lidar_visualization(subpath):
     """提供激光雷达可视化图片文件服务"""
     try:
         base_dir = '/home/vipuser/home/huangff/lidargen-main/kitti_pretrained/unconditional_samples'
-        file_path = os.path.join(base_dir, subpath)
+        file_path = _safe_join(base_dir, subpath)
         
         # 安全检查，确保路径在允许的目录内
-        if not file_path.startswith(base_dir):
+        if file_path is None:
             return "Access denied", 403
         
         if os.path.exists(file_path) and os.path.isfile(file_path):
-            return send_file(file_path)
+            return _serve_media_file(file_path)
         else:
             return "File not found", 404
             
@@ -1212,13 +3787,238 @@ def serve_lidar_visualization(subpath):
         print(f"提供可视化图片失败: {str(e)}")
         return "Internal server error", 500
 
+# 后台任务日志 - 每个子进程由独立线程持续读取输出，写入内存环形缓冲区和磁盘溢出文件，
+# 客户端按字节偏移读取；无论是否有人查看，管道都不会写满阻塞子进程
+TASK_LOG_DIR = '/home/vipuser/Downloads/task_logs'
+TASK_LOG_RING_BYTES = 1024 * 1024  # 内存中保留的最近输出（字节）
+TASK_LOG_READ_LIMIT = 1024 * 1024  # 单次读取返回的最大字节数
+TASK_LOG_RETENTION = 20  # 保留的已结束任务日志数量
+
+def _complete_lines(data, finished, limit):
+    """输出未结束时只返回完整的行（超长的单行除外），进度条用回车刷新，\r 也算作行结束"""
+    if not finished:
+        # 末尾的 \r 可能是 \r\n 的前半部分，留到下次读取
+        newline = max(data.rfind(b'\n'), data.rfind(b'\r', 0, len(data) - 1))
+        if newline >= 0:
+            data = data[:newline + 1]
+        elif len(data) < limit:
+            data = b''  # 不完整的行，等待换行后再返回
+    return data
+
+class _ProcessLog:
+    """后台进程的输出日志：最近的输出保存在内存环形缓冲区，完整输出写入磁盘溢出文件；
+    日志路径、结束时的大小和返回码记录在状态存储中，其他工作进程通过 _StoredLog 读取"""
+    
+    def __init__(self, name):
+        os.makedirs(TASK_LOG_DIR, exist_ok=True)
+        self.name = name
+        self.path = os.path.join(TASK_LOG_DIR, f'{name}.log')
+        self._file = open(self.path, 'w+b')
+        self._ring = deque()  # (起始偏移, 数据)
+        self._ring_start = 0
+        self._cond = threading.Condition()
+        self.size = 0
+        self.closed = False  # 输出已结束（进程退出、启动失败或被取消）
+        self.returncode = None
+        self._save_record()
+    
+    def _save_record(self):
+        state_store.put('task_logs', self.name, {'path': self.path, 'size': self.size, 'closed': self.closed,
+                                                 'returncode': self.returncode, 'owner_pid': os.getpid()})
+    
+    def append(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._cond:
+            if self._file is None:
+                return
+            self._file.write(data)
+            self._file.flush()
+            self._ring.append((self.size, data))
+            self.size += len(data)
+            # 淘汰超出容量的旧数据，这部分改为从溢出文件读取
+            while self.size - self._ring[0][0] - len(self._ring[0][1]) >= TASK_LOG_RING_BYTES:
+                self._ring.popleft()
+            self._ring_start = self._ring[0][0]
+            self._cond.notify_all()
+    
+    def close(self, returncode=None):
+        with self._cond:
+            if not self.closed:
+                self.closed = True
+                self.returncode = returncode
+                self._save_record()
+            self._cond.notify_all()
+    
+    def discard(self):
+        """关闭并删除溢出文件"""
+        with self._cond:
+            self.closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._ring.clear()
+            self._cond.notify_all()
+        _discard_task_log(self.name)
+    
+    def read(self, offset, limit=TASK_LOG_READ_LIMIT):
+        """从字节偏移处读取，返回 (数据, 下一次读取的偏移)
+        
+        只返回完整的行（超长的单行除外），输出结束后返回剩余的全部内容。
+        """
+        with self._cond:
+            offset = min(max(0, offset), self.size)
+            end = min(self.size, offset + limit)
+            if end <= offset:
+                return b'', offset
+            if offset >= self._ring_start:
+                parts = []
+                for start, chunk in self._ring:
+                    if start + len(chunk) <= offset:
+                        continue
+                    if start >= end:
+                        break
+                    parts.append(chunk[max(0, offset - start):end - start])
+                data = b''.join(parts)
+            elif self._file is not None:
+                data = os.pread(self._file.fileno(), end - offset, offset)
+            else:
+                return b'', offset
+            finished = self.closed and end == self.size
+        
+        data = _complete_lines(data, finished, limit)
+        return data, offset + len(data)
+    
+    def wait(self, offset, timeout):
+        """等待偏移之后出现新数据或输出结束"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.size > offset or self.closed, timeout)
+
+class _StoredLog:
+    """其他工作进程中运行的任务的输出日志：从溢出文件读取，是否结束取自状态存储（写日志的进程退出时也视为结束）"""
+    
+    def __init__(self, name, record):
+        self.name = name
+        self.path = record['path']
+        self._record = record
+    
+    def _refresh(self):
+        if not self._record['closed']:
+            record = state_store.get('task_logs', self.name)
+            if record is None or (not record['closed'] and not _process_alive(record.get('owner_pid'))):
+                record = dict(self._record, closed=True)  # 日志已删除或写日志的进程已退出
+            self._record = record
+        return self._record
+    
+    @property
+    def closed(self):
+        return self._refresh()['closed']
+    
+    @property
+    def returncode(self):
+        return self._refresh()['returncode']
+    
+    @property
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+    
+    def read(self, offset, limit=TASK_LOG_READ_LIMIT):
+        """与 _ProcessLog.read 相同，从溢出文件读取"""
+        closed = self.closed  # 先确认是否结束再取大小，结束时文件中已是全部输出
+        size = self.size
+        offset = min(max(0, offset), size)
+        end = min(size, offset + limit)
+        if end <= offset:
+            return b'', offset
+        try:
+            with open(self.path, 'rb') as f:
+                data = os.pread(f.fileno(), end - offset, offset)
+        except OSError:
+            return b'', offset
+        data = _complete_lines(data, closed and offset + len(data) == size, limit)
+        return data, offset + len(data)
+    
+    def wait(self, offset, timeout):
+        """轮询等待偏移之后出现新数据或输出结束"""
+        deadline = time.time() + timeout
+        while self.size <= offset and not self.closed and time.time() < deadline:
+            time.sleep(min(STATE_POLL_INTERVAL, max(0, deadline - time.time())))
+
+def _discard_task_log(name):
+    """删除任务日志的记录和溢出文件（日志可能由其他工作进程写入，或写日志的进程已退出）"""
+    record = state_store.get('task_logs', name)
+    state_store.delete('task_logs', name)
+    if record:
+        try:
+            os.remove(record['path'])
+        except OSError:
+            pass
+
+def _task_log(name):
+    """其他工作进程写入的日志，记录不存在时返回 None"""
+    record = state_store.get('task_logs', name)
+    return _StoredLog(name, record) if record else None
+
+def _start_log_reader(process, log):
+    """启动读取线程，持续把进程输出写入日志，进程退出后关闭日志"""
+    def reader():
+        fd = process.stdout.fileno()
+        try:
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                log.append(chunk)
+        except OSError as e:
+            print(f"读取 {log.name} 输出失败: {e}")
+        finally:
+            process.stdout.close()
+            log.close(process.wait())
+    
+    threading.Thread(target=reader, name=f'log-reader-{log.name[:8]}', daemon=True).start()
+
+def _log_cursor_args():
+    """解析按字节偏移读取日志的 offset/limit 参数"""
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = int(request.args.get('limit', TASK_LOG_READ_LIMIT))
+    except ValueError:
+        offset, limit = 0, TASK_LOG_READ_LIMIT
+    return offset, min(max(1, limit), TASK_LOG_READ_LIMIT)
+
+def _prune_task_logs():
+    """清理多余的已结束任务及其日志文件，以及上次运行遗留的日志文件"""
+    records = state_store.items('tasks')
+    finished = sorted((record['start_time'], task_id) for task_id, record in records.items() if record.get('completed'))
+    for _, task_id in finished[:max(0, len(finished) - TASK_LOG_RETENTION)]:
+        state_store.delete('tasks', task_id)
+        local = running_tasks.pop(task_id, None)
+        if local:
+            local['log'].discard()
+        else:
+            _discard_task_log(records[task_id]['log_name'])
+    for task_id in [task_id for task_id in running_tasks if _load_task(task_id) is None]:
+        running_tasks.pop(task_id)['log'].discard()  # 记录已被其他工作进程清理
+    
+    in_use = {record['path'] for record in state_store.items('task_logs').values()}
+    for path in glob.glob(os.path.join(TASK_LOG_DIR, '*.log')):
+        if path not in in_use:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
 # 执行激光雷达生成脚本
 @app.route('/run_lidar_script', methods=['POST'])
 def run_lidar_script():
     """执行激光雷达数据生成脚本"""
     try:
         # 检查是否已有任务在运行
-        active_tasks = [task_id for task_id, task in running_tasks.items() if not task.get('completed', False)]
+        active_tasks = [task_id for task_id, record in state_store.items('tasks').items()
+                        if not _refresh_task_state(task_id, record)['completed']]
         if active_tasks:
             return jsonify({
                 'success': False,
@@ -1245,34 +4045,39 @@ def run_lidar_script():
                 'error': f'脚本文件没有执行权限: {script_path}'
             }), 403
         
-        # 启动后台进程
-        print(f"启动激光雷达生成脚本: {script_path}")
-        # 使用stdbuf强制无缓冲输出
-        process = subprocess.Popen(
-            ['stdbuf', '-oL', '-eL', 'bash', script_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=0,  # 无缓冲
-            preexec_fn=os.setsid,  # 创建新的进程组
-            env=dict(os.environ, PYTHONUNBUFFERED='1')  # 强制Python无缓冲输出
-        )
+        def launch(env):
+            # 启动后台进程
+            print(f"启动激光雷达生成脚本: {script_path}")
+            # 使用stdbuf强制无缓冲输出
+            return subprocess.Popen(
+                ['stdbuf', '-oL', '-eL', 'bash', script_path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0,  # 无缓冲，输出由日志读取线程按字节读取
+                preexec_fn=os.setsid,  # 创建新的进程组
+                env=dict(env, PYTHONUNBUFFERED='1')  # 强制Python无缓冲输出
+            )
         
-        # 存储任务信息
-        running_tasks[task_id] = {
-            'process': process,
-            'output': '',
+        # 存储任务信息，进程在获得GPU显存准入后才启动
+        _prune_task_logs()
+        log = _ProcessLog(task_id)
+        running_tasks[task_id] = {'process': None, 'log': log}
+        _save_task(task_id, {
+            'log_name': log.name,
             'start_time': datetime.now().isoformat(),
             'completed': False,
             'success': False,
-            'pid': process.pid
-        }
+            'pid': None,
+            'status': 'waiting_gpu',
+            'owner_pid': os.getpid()
+        })
+        _run_when_gpu_admitted('lidar_generation', f'激光雷达生成 {task_id[:8]}', running_tasks[task_id], launch,
+                               record=('tasks', task_id))
         
         return jsonify({
             'success': True,
             'task_id': task_id,
-            'message': '激光雷达生成脚本已启动',
-            'pid': process.pid
+            'message': '激光雷达生成任务已提交，获得GPU显存后自动启动'
         })
         
     except Exception as e:
@@ -1282,11 +4087,31 @@ def run_lidar_script():
             'error': f'启动失败: {str(e)}'
         }), 500
 
+def _refresh_task_state(task_id, record, log=None):
+    """日志输出结束后更新任务的完成状态（日志已被清理时也视为结束），返回最新的任务记录"""
+    if record['completed']:
+        return record
+    log = log or _task_output_log(task_id, record)
+    if log is not None and not log.closed:
+        return record
+    returncode = log.returncode if log is not None else None
+    
+    def finish(current):
+        if current is None or current['completed']:
+            return None
+        return dict(current, completed=True, success=(returncode == 0), end_time=datetime.now().isoformat())
+    
+    if state_store.update('tasks', task_id, finish) is not None:
+        print(f"激光雷达任务 {task_id} 完成，返回码: {returncode}")
+    return _load_task(task_id) or dict(record, completed=True, success=False)
+
 # 获取任务输出
 @app.route('/get_task_output/<task_id>', methods=['GET'])
 def get_task_output(task_id):
-    """获取指定任务的输出"""
-    if task_id not in running_tasks:
+    """获取指定任务的输出，offset 为上次返回的字节偏移，只返回其后的新输出"""
+    task = _load_task(task_id)
+    log = task and _task_output_log(task_id, task)
+    if log is None:
         return jsonify({
             'error': '任务不存在',
             'output': '',
@@ -1294,87 +4119,145 @@ def get_task_output(task_id):
             'success': False
         }), 404
     
-    task = running_tasks[task_id]
-    process = task['process']
-    
     try:
-        # 使用非阻塞方式读取输出
-        import select
-        
-        # 检查是否有可读数据
-        if hasattr(select, 'select'):
-            ready, _, _ = select.select([process.stdout], [], [], 0)
-            if ready:
-                # 逐行读取可用的输出
-                while True:
-                    try:
-                        line = process.stdout.readline()
-                        if not line:
-                            break
-                        task['output'] += line
-                    except Exception:
-                        break
-        else:
-            # 对于不支持select的系统，使用readline
-            try:
-                while True:
-                    line = process.stdout.readline()
-                    if not line:
-                        break
-                    task['output'] += line
-            except Exception:
-                pass
-        
-        # 检查进程是否结束
-        if process.poll() is not None:
-            # 进程已结束，读取剩余输出
-            try:
-                remaining_output = process.stdout.read()
-                if remaining_output:
-                    task['output'] += remaining_output
-            except Exception:
-                pass
-            
-            task['completed'] = True
-            task['success'] = (process.returncode == 0)
-            task['end_time'] = datetime.now().isoformat()
-            
-            print(f"激光雷达任务 {task_id} 完成，返回码: {process.returncode}")
-        
-        return jsonify({
-            'output': task['output'],
-            'completed': task['completed'],
+        task = _refresh_task_state(task_id, task, log)
+        offset, limit = _log_cursor_args()
+        data, next_offset = log.read(offset, limit)
+        
+        response = {
+            'output': data.decode('utf-8', errors='replace'),
+            'offset': next_offset,
+            'size': log.size,
+            'completed': task['completed'] and next_offset >= log.size,
             'success': task['success'] if task['completed'] else None,
             'start_time': task['start_time']
-        })
+        }
+        if not task.get('pid'):
+            response['status'] = task.get('status', 'waiting_gpu')
+        return jsonify(response)
         
     except Exception as e:
         print(f"获取任务输出失败: {str(e)}")
         return jsonify({
             'error': f'获取输出失败: {str(e)}',
-            'output': task.get('output', ''),
+            'output': '',
             'completed': True,
             'success': False
         }), 500
 
+# 日志流式推送（Server-Sent Events）- 只推送新增的行，事件ID为已推送的字节偏移，断线后可凭 Last-Event-ID 续传
+SSE_KEEPALIVE_INTERVAL = 15  # 没有新输出时发送心跳的间隔（秒），避免代理超时断开
+
+def _sse_start_offset():
+    """从 Last-Event-ID 请求头（或 last_event_id 参数）获取续传位置"""
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or '0'
+    try:
+        return max(0, int(value))
+    except ValueError:
+        return 0
+
+def _sse_format_lines(text):
+    """将输出文本转换为SSE的 data 行；带回车的进度行只保留最后一次刷新的内容"""
+    lines = []
+    for line in text.split('\n'):
+        segments = [segment for segment in line.split('\r') if segment]
+        lines.append(f'data: {segments[-1] if segments else ""}\n')
+    return ''.join(lines)
+
+def _sse_log_stream(log, start_offset, get_success):
+    """生成日志的SSE事件流，输出结束后以 done 事件携带 get_success() 的结果"""
+    offset = start_offset
+    yield 'retry: 3000\n\n'
+    
+    while True:
+        data, next_offset = log.read(offset)
+        if next_offset > offset:
+            text = data.decode('utf-8', errors='replace')
+            if text.endswith('\n'):
+                text = text[:-1]
+            yield f'id: {next_offset}\n{_sse_format_lines(text)}\n'
+            offset = next_offset
+            continue
+        
+        if log.closed:
+            yield f'event: done\ndata: {json.dumps({"success": get_success()})}\n\n'
+            return
+        
+        size = log.size
+        log.wait(size, SSE_KEEPALIVE_INTERVAL)
+        if log.size == size and not log.closed:
+            yield ': keepalive\n\n'
+
+def _sse_response(stream):
+    """包装SSE响应"""
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 禁止nginx缓冲，保证实时推送
+    })
+
+@app.route('/stream_task_output/<task_id>', methods=['GET'])
+def stream_task_output(task_id):
+    """以SSE方式推送指定任务的新输出行"""
+    task = _load_task(task_id)
+    log = task and _task_output_log(task_id, task)
+    if log is None:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    def get_success():
+        return _refresh_task_state(task_id, _load_task(task_id) or task, log)['success']
+    
+    return _sse_response(_sse_log_stream(log, _sse_start_offset(), get_success))
+
 # 停止任务
 @app.route('/stop_task/<task_id>', methods=['POST'])
 def stop_task(task_id):
     """停止指定的任务"""
-    if task_id not in running_tasks:
+    record = _load_task(task_id)
+    if record is None:
         return jsonify({
             'success': False,
             'error': '任务不存在'
         }), 404
     
-    task = running_tasks[task_id]
-    process = task['process']
+    task = running_tasks.get(task_id)
+    
+    if not record.get('pid') and not record['completed']:
+        # 任务还在等待GPU显存，取消启动即可（由其他工作进程启动的任务在下次检查准入时放弃）
+        _mark_task(task_id, cancel_requested=True, completed=True, success=False, end_time=datetime.now().isoformat())
+        if task is not None:
+            task['cancel_requested'] = True
+            task['log'].append('\n\n=== 任务已被用户中断 ===\n')
+            task['log'].close()
+        with gpu_scheduler_lock:
+            gpu_scheduler_lock.notify_all()
+        return jsonify({
+            'success': True,
+            'message': '等待中的任务已取消'
+        })
+    
+    if task is None or task['process'] is None:
+        # 由其他工作进程启动的任务：按记录中的PID终止进程组
+        log = _task_output_log(task_id, record)
+        if record['completed'] or log is None or log.closed:
+            _refresh_task_state(task_id, record, log)
+            return jsonify({
+                'success': True,
+                'message': '任务已经结束'
+            })
+        print(f"正在终止任务 {task_id}，PID: {record['pid']}")
+        _terminate_process_group(record['pid'])
+        _mark_task(task_id, completed=True, success=False, end_time=datetime.now().isoformat())
+        return jsonify({
+            'success': True,
+            'message': '任务已成功停止'
+        })
     
+    process = task['process']
     try:
         # 检查进程是否还在运行
         if process.poll() is None:
             # 进程还在运行，尝试终止它
-            print(f"正在终止任务 {task_id}，PID: {task.get('pid', 'unknown')}")
+            print(f"正在终止任务 {task_id}，PID: {process.pid}")
             
             try:
                 # 首先尝试优雅地终止进程组
@@ -1405,10 +4288,8 @@ def stop_task(task_id):
                     pass
             
             # 标记任务为已完成但不成功
-            task['completed'] = True
-            task['success'] = False
-            task['end_time'] = datetime.now().isoformat()
-            task['output'] += '\n\n=== 任务已被用户中断 ===\n'
+            _mark_task(task_id, completed=True, success=False, end_time=datetime.now().isoformat())
+            task['log'].append('\n\n=== 任务已被用户中断 ===\n')
             
             return jsonify({
                 'success': True,
@@ -1416,8 +4297,7 @@ def stop_task(task_id):
             })
         else:
             # 进程已经结束
-            task['completed'] = True
-            task['success'] = (process.returncode == 0)
+            _mark_task(task_id, completed=True, success=(process.returncode == 0))
             return jsonify({
                 'success': True,
                 'message': '任务已经结束'
@@ -1430,167 +4310,652 @@ def stop_task(task_id):
             'error': f'停止任务失败: {str(e)}'
         }), 500
 
+def _read_gpu_devices(nvml):
+    """通过已初始化的NVML读取所有GPU的显存、利用率、温度、功率及占用显存的进程"""
+    # 获取GPU设备数量
+    device_count = nvml.nvmlDeviceGetCount()
+    gpu_info = []
+    
+    for i in range(device_count):
+        handle = nvml.nvmlDeviceGetHandleByIndex(i)
+        
+        # 获取GPU名称
+        name = nvml.nvmlDeviceGetName(handle)
+        if isinstance(name, bytes):
+            name = name.decode('utf-8')
+        
+        # 获取显存信息
+        memory_info = nvml.nvmlDeviceGetMemoryInfo(handle)
+        total_memory = memory_info.total
+        used_memory = memory_info.used
+        free_memory = memory_info.free
+        
+        # 获取GPU利用率
+        try:
+            utilization = nvml.nvmlDeviceGetUtilizationRates(handle)
+            gpu_util = utilization.gpu
+        except:
+            gpu_util = -1
+        
+        # 获取温度
+        try:
+            temp = nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU)
+        except:
+            temp = -1
+        
+        # 获取功率使用情况
+        try:
+            power = nvml.nvmlDeviceGetPowerUsage(handle) / 1000.0  # 转换为瓦特
+        except:
+            power = -1
+        
+        # 获取占用显存的计算进程，用于统计各任务的实际显存占用
+        processes = []
+        try:
+            for proc in nvml.nvmlDeviceGetComputeRunningProcesses(handle):
+                processes.append({'pid': proc.pid, 'used_memory': proc.usedGpuMemory or 0})
+        except:
+            pass
+        
+        gpu_info.append({
+            'id': i,
+            'name': name,
+            'memory': {
+                'total': total_memory,
+                'used': used_memory,
+                'free': free_memory,
+                'total_gb': round(total_memory / (1024**3), 2),
+                'used_gb': round(used_memory / (1024**3), 2),
+                'free_gb': round(free_memory / (1024**3), 2),
+                'usage_percent': round((used_memory / total_memory) * 100, 1)
+            },
+            'utilization': gpu_util,
+            'temperature': temp,
+            'power': power,
+            'processes': processes
+        })
+    
+    return gpu_info
+
+def _read_gpu_devices_nvidia_smi():
+    """通过 nvidia-smi 命令读取GPU状态"""
+    result = subprocess.run(['nvidia-smi', '--query-gpu=index,name,memory.total,memory.used,memory.free,utilization.gpu,temperature.gpu,power.draw', '--format=csv,noheader,nounits'], 
+                          capture_output=True, text=True, timeout=10)
+    
+    if result.returncode != 0:
+        raise RuntimeError(f'nvidia-smi command failed: {result.stderr}')
+    
+    lines = result.stdout.strip().split('\n')
+    gpu_info = []
+    
+    for i, line in enumerate(lines):
+        if line.strip():
+            parts = [p.strip() for p in line.split(',')]
+            if len(parts) >= 6:
+                try:
+                    total_mb = float(parts[2])
+                    used_mb = float(parts[3])
+                    free_mb = float(parts[4])
+                    
+                    # 解析利用率
+                    try:
+                        util_val = float(parts[5]) if parts[5] not in ['[Not Supported]', '[N/A]'] else -1
+                    except (ValueError, IndexError):
+                        util_val = -1
+                    
+                    # 解析温度
+                    try:
+                        temp_val = float(parts[6]) if len(parts) > 6 and parts[6] not in ['[Not Supported]', '[N/A]'] else -1
+                    except (ValueError, IndexError):
+                        temp_val = -1
+                    
+                    # 解析功耗
+                    try:
+                        power_val = float(parts[7]) if len(parts) > 7 and parts[7] not in ['[Not Supported]', '[N/A]'] else -1
+                    except (ValueError, IndexError):
+                        power_val = -1
+                    
+                    gpu_info.append({
+                        'id': i,
+                        'name': parts[1],
+                        'memory': {
+                            'total': int(total_mb * 1024 * 1024),
+                            'used': int(used_mb * 1024 * 1024),
+                            'free': int(free_mb * 1024 * 1024),
+                            'total_gb': round(total_mb / 1024, 2),
+                            'used_gb': round(used_mb / 1024, 2),
+                            'free_gb': round(free_mb / 1024, 2),
+                            'usage_percent': round((used_mb / total_mb) * 100, 1) if total_mb > 0 else 0
+                        },
+                        'utilization': util_val,
+                        'temperature': temp_val,
+                        'power': power_val,
+                        'processes': []
+                    })
+                except (ValueError, IndexError) as e:
+                    print(f"解析GPU信息失败: {e}, 行内容: {line}")
+                    continue
+    
+    return gpu_info
+
+# GPU状态采样 - 后台线程按固定间隔读取一次GPU状态并写入环形缓冲区
+# /api/gpu_status 直接返回最新采样，/api/gpu_history 返回时间序列，调度器也使用同一份采样
+GPU_SAMPLE_INTERVAL = 1.0  # 采样间隔（秒）
+GPU_SAMPLE_RETRY_INTERVAL = 30  # 采样失败（无GPU或驱动异常）后的重试间隔（秒）
+GPU_HISTORY_SIZE = 3600  # 环形缓冲区保留的采样数量（按1秒间隔约1小时）
+
+gpu_nvml_backend = None  # 可替换为实现了NVML接口的对象（例如测试用的假NVML），None 表示自动加载
+gpu_samples = deque(maxlen=GPU_HISTORY_SIZE)
+gpu_sample_error = None  # 最近一次采样失败的信息
+gpu_sample_lock = threading.Condition()
+gpu_sampler_thread = None
+
+def _load_nvml_backend():
+    """加载并初始化NVML，未安装 nvidia-ml-py3 时返回 None（退回到 nvidia-smi）"""
+    nvml = gpu_nvml_backend
+    if nvml is None:
+        try:
+            import nvidia_ml_py3 as nvml
+        except ImportError:
+            return None
+    nvml.nvmlInit()
+    return nvml
+
+def _gpu_sample_error_info(e):
+    """将采样异常转换为接口返回的错误信息和状态码"""
+    if isinstance(e, subprocess.TimeoutExpired):
+        return {'error': 'nvidia-smi command timeout', 'status_code': 500}
+    if isinstance(e, FileNotFoundError):
+        return {'error': 'NVIDIA GPU not detected or nvidia-smi not available', 'status_code': 404}
+    return {'error': f'Failed to get GPU status: {str(e)}', 'status_code': 500}
+
+def _gpu_sample_once(state):
+    """采样一次GPU状态，写入环形缓冲区并通知调度器，返回错误信息（成功时为 None）；
+    state 保存采样线程的NVML句柄：{'nvml': 模块或 None, 'loaded': 是否已初始化}"""
+    global gpu_sample_error
+    try:
+        if not state['loaded']:
+            state['nvml'] = _load_nvml_backend()
+            state['loaded'] = True
+        nvml = state['nvml']
+        devices = _read_gpu_devices(nvml) if nvml is not None else _read_gpu_devices_nvidia_smi()
+        error = None
+    except Exception as e:
+        devices = None
+        error = _gpu_sample_error_info(e)
+        if state['nvml'] is not None:
+            # NVML可能已失效（例如驱动重载），下次重新初始化
+            try:
+                state['nvml'].nvmlShutdown()
+            except Exception:
+                pass
+        state['nvml'], state['loaded'] = None, False
+    
+    with gpu_sample_lock:
+        if error is None:
+            gpu_samples.append({'time': time.time(), 'gpus': devices})
+        elif gpu_sample_error is None:
+            print(f"GPU采样失败: {error['error']}")
+        gpu_sample_error = error
+        gpu_sample_lock.notify_all()
+    
+    # 采样失败时调度器继续使用最近一次成功的采样，不会因为没有显存信息而放开准入；
+    # 从未采样成功（没有GPU或驱动）时不限制
+    _gpu_scheduler_on_sample(devices if devices is not None else (gpu_last_devices or []))
+    return error
+
+def _gpu_sampler():
+    """GPU采样线程：NVML只初始化一次，之后按固定间隔采样"""
+    state = {'nvml': None, 'loaded': False}
+    while True:
+        error = _gpu_sample_once(state)
+        time.sleep(GPU_SAMPLE_INTERVAL if error is None else GPU_SAMPLE_RETRY_INTERVAL)
+
+def _ensure_gpu_sampler():
+    """按需启动GPU采样线程"""
+    global gpu_sampler_thread
+    with gpu_sample_lock:
+        if gpu_sampler_thread is None or not gpu_sampler_thread.is_alive():
+            gpu_sampler_thread = threading.Thread(target=_gpu_sampler, name='gpu-sampler', daemon=True)
+            gpu_sampler_thread.start()
+
 @app.route('/api/gpu_status', methods=['GET'])
 def get_gpu_status():
-    """获取GPU状态信息，包括显存使用情况"""
+    """获取GPU状态信息，包括显存使用情况（读取后台采样的最新结果）"""
+    _ensure_gpu_sampler()
+    
+    with gpu_sample_lock:
+        # 服务刚启动时等待第一次采样
+        if not gpu_samples and gpu_sample_error is None:
+            gpu_sample_lock.wait(2 * GPU_SAMPLE_INTERVAL + 10)
+        error = gpu_sample_error
+        latest = gpu_samples[-1] if gpu_samples else None
+    
+    if error is not None or latest is None:
+        error = error or {'error': 'GPU status not sampled yet', 'status_code': 503}
+        return jsonify({
+            'success': False,
+            'error': error['error']
+        }), error['status_code']
+    
+    return jsonify({
+        'success': True,
+        'gpu_count': len(latest['gpus']),
+        'gpus': latest['gpus'],
+        'timestamp': datetime.fromtimestamp(latest['time']).isoformat()
+    })
+
+@app.route('/api/gpu_history', methods=['GET'])
+def get_gpu_history():
+    """获取最近一段时间的GPU状态时间序列，window 为时间窗口（秒），默认300秒"""
+    _ensure_gpu_sampler()
+    
     try:
-        import nvidia_ml_py3 as nvml
-        nvml.nvmlInit()
-        
-        # 获取GPU设备数量
-        device_count = nvml.nvmlDeviceGetCount()
-        gpu_info = []
-        
-        for i in range(device_count):
-            handle = nvml.nvmlDeviceGetHandleByIndex(i)
-            
-            # 获取GPU名称
-            name = nvml.nvmlDeviceGetName(handle).decode('utf-8')
-            
-            # 获取显存信息
-            memory_info = nvml.nvmlDeviceGetMemoryInfo(handle)
-            total_memory = memory_info.total
-            used_memory = memory_info.used
-            free_memory = memory_info.free
-            
-            # 获取GPU利用率
-            try:
-                utilization = nvml.nvmlDeviceGetUtilizationRates(handle)
-                gpu_util = utilization.gpu
-            except:
-                gpu_util = -1
-            
-            # 获取温度
-            try:
-                temp = nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU)
-            except:
-                temp = -1
-            
-            # 获取功率使用情况
-            try:
-                power = nvml.nvmlDeviceGetPowerUsage(handle) / 1000.0  # 转换为瓦特
-            except:
-                power = -1
-            
-            gpu_info.append({
-                'id': i,
-                'name': name,
-                'memory': {
-                    'total': total_memory,
-                    'used': used_memory,
-                    'free': free_memory,
-                    'total_gb': round(total_memory / (1024**3), 2),
-                    'used_gb': round(used_memory / (1024**3), 2),
-                    'free_gb': round(free_memory / (1024**3), 2),
-                    'usage_percent': round((used_memory / total_memory) * 100, 1)
-                },
-                'utilization': gpu_util,
-                'temperature': temp,
-                'power': power
+        window = float(request.args.get('window', 300))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'window 参数必须是数字（秒）'}), 400
+    window = max(1.0, min(window, GPU_HISTORY_SIZE * GPU_SAMPLE_INTERVAL))
+    
+    since = time.time() - window
+    with gpu_sample_lock:
+        samples = [sample for sample in gpu_samples if sample['time'] >= since]
+    
+    # 按GPU整理为列式时间序列，减小响应体积
+    series = {}
+    for sample in samples:
+        for gpu in sample['gpus']:
+            entry = series.setdefault(gpu['id'], {
+                'id': gpu['id'],
+                'name': gpu['name'],
+                'timestamps': [],
+                'memory_used_gb': [],
+                'memory_usage_percent': [],
+                'utilization': [],
+                'temperature': [],
+                'power': []
             })
-        
-        nvml.nvmlShutdown()
-        
-        return jsonify({
-            'success': True,
-            'gpu_count': device_count,
-            'gpus': gpu_info,
-            'timestamp': datetime.now().isoformat()
-        })
-        
-    except ImportError:
-        # 如果没有安装nvidia-ml-py3，尝试使用nvidia-smi命令
+            entry['timestamps'].append(round(sample['time'], 3))
+            entry['memory_used_gb'].append(gpu['memory']['used_gb'])
+            entry['memory_usage_percent'].append(gpu['memory']['usage_percent'])
+            entry['utilization'].append(gpu['utilization'])
+            entry['temperature'].append(gpu['temperature'])
+            entry['power'].append(gpu['power'])
+    
+    return jsonify({
+        'success': True,
+        'interval': GPU_SAMPLE_INTERVAL,
+        'window': window,
+        'sample_count': len(samples),
+        'gpus': [series[gpu_id] for gpu_id in sorted(series)]
+    })
+
+# GPU显存准入调度 - 所有GPU任务（各模块推理、激光雷达生成、批量训练）启动前统一申请显存
+# 任务按声明的显存占用申请准入，运行过程中统计实际峰值并学习，之后按学习到的占用调度
+GPU_TASK_FOOTPRINT_MB = {
+    'infrared': 4096,
+    'image': 12288,
+    'lidar': 8192,
+    'video': 16384,
+    'lidar_generation': 10240,
+    'batch_training': 24576
+}
+GPU_SCHEDULER_HEADROOM_MB = 1024  # 每张卡预留的安全余量
+GPU_FOOTPRINT_MARGIN = 1.15  # 学习到的占用再加上的安全系数
+
+gpu_scheduler_lock = threading.Condition()
+gpu_reservations = {}  # reservation_id -> 显存预留信息
+gpu_waiting = {}  # waiter_id -> 等待准入的任务信息
+gpu_footprint_learned = {}  # 任务类型 -> 观测到的峰值显存（MB）
+gpu_last_devices = None  # 最近一次采样到的GPU状态，None 表示尚未采样
+
+def _gpu_footprint_mb(key):
+    """获取任务类型的显存占用（MB）：优先使用学习值，否则使用声明值"""
+    learned = gpu_footprint_learned.get(key)
+    if learned:
+        return int(learned * GPU_FOOTPRINT_MARGIN)
+    return GPU_TASK_FOOTPRINT_MB.get(key, 0)
+
+def _pick_gpu_device(footprint_mb):
+    """选择能容纳指定显存占用的GPU，返回GPU编号；无GPU信息时返回 -1，放不下时返回 None（需持有 gpu_scheduler_lock）"""
+    if not gpu_last_devices:
+        # 没有可用的GPU信息（未安装驱动或从未采样成功），不做限制
+        return -1
+    
+    best_id, best_available = None, None
+    for device in gpu_last_devices:
+        total_mb = device['memory']['total'] / (1024 * 1024)
+        free_mb = device['memory']['free'] / (1024 * 1024)
+        reserved_mb = sum(r['footprint_mb'] for r in gpu_reservations.values() if r['gpu_id'] == device['id'])
+        # 刚启动的任务可能还没真正分配显存，因此同时按预留量扣减
+        available_mb = min(free_mb, total_mb - reserved_mb) - GPU_SCHEDULER_HEADROOM_MB
+        if available_mb >= footprint_mb and (best_available is None or available_mb > best_available):
+            best_id, best_available = device['id'], available_mb
+    return best_id
+
+def _gpu_admit(key, label=None, should_cancel=None):
+    """阻塞等待显存准入，返回显存预留信息；should_cancel 返回 True 时放弃等待并返回 None"""
+    footprint_mb = _gpu_footprint_mb(key)
+    waiter_id = uuid.uuid4().hex
+    _ensure_gpu_sampler()
+    
+    with gpu_scheduler_lock:
+        gpu_waiting[waiter_id] = {
+            'key': key,
+            'label': label or key,
+            'footprint_mb': footprint_mb,
+            'since': datetime.now().isoformat()
+        }
         try:
-            result = subprocess.run(['nvidia-smi', '--query-gpu=index,name,memory.total,memory.used,memory.free,utilization.gpu,temperature.gpu,power.draw', '--format=csv,noheader,nounits'], 
-                                  capture_output=True, text=True, timeout=10)
+            # 等待第一次采样完成
+            while gpu_last_devices is None:
+                gpu_scheduler_lock.wait(GPU_SAMPLE_INTERVAL)
             
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\n')
-                gpu_info = []
-                
-                for i, line in enumerate(lines):
-                    if line.strip():
-                        parts = [p.strip() for p in line.split(',')]
-                        if len(parts) >= 6:
-                            try:
-                                total_mb = float(parts[2])
-                                used_mb = float(parts[3])
-                                free_mb = float(parts[4])
-                                
-                                # 解析利用率
-                                try:
-                                    util_val = float(parts[5]) if parts[5] not in ['[Not Supported]', '[N/A]'] else -1
-                                except (ValueError, IndexError):
-                                    util_val = -1
-                                
-                                # 解析温度
-                                try:
-                                    temp_val = float(parts[6]) if len(parts) > 6 and parts[6] not in ['[Not Supported]', '[N/A]'] else -1
-                                except (ValueError, IndexError):
-                                    temp_val = -1
-                                
-                                # 解析功耗
-                                try:
-                                    power_val = float(parts[7]) if len(parts) > 7 and parts[7] not in ['[Not Supported]', '[N/A]'] else -1
-                                except (ValueError, IndexError):
-                                    power_val = -1
-                                
-                                gpu_info.append({
-                                    'id': i,
-                                    'name': parts[1],
-                                    'memory': {
-                                        'total': int(total_mb * 1024 * 1024),
-                                        'used': int(used_mb * 1024 * 1024),
-                                        'free': int(free_mb * 1024 * 1024),
-                                        'total_gb': round(total_mb / 1024, 2),
-                                        'used_gb': round(used_mb / 1024, 2),
-                                        'free_gb': round(free_mb / 1024, 2),
-                                        'usage_percent': round((used_mb / total_mb) * 100, 1) if total_mb > 0 else 0
-                                    },
-                                    'utilization': util_val,
-                                    'temperature': temp_val,
-                                    'power': power_val
-                                })
-                            except (ValueError, IndexError) as e:
-                                print(f"解析GPU信息失败: {e}, 行内容: {line}")
-                                continue
-                
-                return jsonify({
-                    'success': True,
-                    'gpu_count': len(gpu_info),
-                    'gpus': gpu_info,
-                    'timestamp': datetime.now().isoformat()
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': 'nvidia-smi command failed',
-                    'stderr': result.stderr
-                }), 500
-                
-        except subprocess.TimeoutExpired:
-            return jsonify({
-                'success': False,
-                'error': 'nvidia-smi command timeout'
-            }), 500
-        except FileNotFoundError:
-            return jsonify({
-                'success': False,
-                'error': 'NVIDIA GPU not detected or nvidia-smi not available'
-            }), 404
+            while True:
+                if should_cancel and should_cancel():
+                    return None
+                gpu_id = _pick_gpu_device(footprint_mb)
+                if gpu_id is not None:
+                    reservation = {
+                        'reservation_id': waiter_id,
+                        'key': key,
+                        'label': label or key,
+                        'gpu_id': gpu_id,
+                        'footprint_mb': footprint_mb,
+                        'peak_mb': 0,
+                        'pgid': None,
+                        'admitted_at': datetime.now().isoformat()
+                    }
+                    gpu_reservations[waiter_id] = reservation
+                    print(f"GPU准入: {reservation['label']} -> GPU {gpu_id}，预留 {footprint_mb} MB")
+                    return reservation
+                gpu_scheduler_lock.wait(GPU_SAMPLE_INTERVAL)
+        finally:
+            gpu_waiting.pop(waiter_id, None)
+
+def _gpu_release(reservation):
+    """释放显存预留，并根据观测到的峰值更新该任务类型的学习占用"""
+    with gpu_scheduler_lock:
+        gpu_reservations.pop(reservation['reservation_id'], None)
+        peak_mb = reservation['peak_mb']
+        if peak_mb > 0:
+            previous = gpu_footprint_learned.get(reservation['key'])
+            # 指数滑动平均，但不低于本次观测值的八成，避免低估
+            learned = peak_mb if previous is None else max(0.5 * previous + 0.5 * peak_mb, 0.8 * peak_mb)
+            gpu_footprint_learned[reservation['key']] = learned
+            print(f"GPU释放: {reservation['label']} 峰值显存 {peak_mb} MB，学习占用更新为 {int(learned)} MB")
+        gpu_scheduler_lock.notify_all()
+
+def _gpu_env(reservation, env=None):
+    """为已准入的任务生成环境变量，多卡时将任务绑定到分配的GPU"""
+    env = dict(env if env is not None else os.environ)
+    if reservation['gpu_id'] >= 0 and gpu_last_devices and len(gpu_last_devices) > 1:
+        env['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
+        env['CUDA_VISIBLE_DEVICES'] = str(reservation['gpu_id'])
+    return env
+
+def _gpu_scheduler_on_sample(devices):
+    """GPU采样回调：统计各预留任务的实际显存峰值，并唤醒等待准入的任务"""
+    global gpu_last_devices
+    with gpu_scheduler_lock:
+        gpu_last_devices = devices
+        for reservation in gpu_reservations.values():
+            if reservation['pgid'] is None:
+                continue
+            used_bytes = 0
+            for device in devices:
+                for proc in device.get('processes', []):
+                    try:
+                        if os.getpgid(proc['pid']) == reservation['pgid']:
+                            used_bytes += proc['used_memory']
+                    except OSError:
+                        continue
+            reservation['peak_mb'] = max(reservation['peak_mb'], int(used_bytes / (1024 * 1024)))
+        gpu_scheduler_lock.notify_all()
+
+def _run_when_gpu_admitted(key, label, task, launch, record=None):
+    """在后台线程中等待显存准入后启动进程，进程结束后释放显存预留
+    
+    launch(env) 负责启动并返回 Popen 对象；task['cancel_requested'] 为 True 时放弃启动。
+    task 中带有 'log'（_ProcessLog）时由读取线程持续收集进程输出。
+    record 为状态存储中的 (命名空间, 键) 时同步 status/pid/launch_error，并响应其他工作进程写入的 cancel_requested；
+    记录的 log_name 已不是本任务的日志时（记录被删除或被新任务替换）视为取消。
+    """
+    log = task.get('log')
+    log_name = log.name if log is not None else None
+    
+    def update(**fields):
+        task.update(fields)
+        if record is not None:
+            state_store.update(*record, lambda current: dict(current, **fields)
+                               if current and current.get('log_name') == log_name else None)
+    
+    def should_cancel():
+        if task.get('cancel_requested'):
+            return True
+        if record is None:
+            return False
+        current = state_store.get(*record)
+        return current is None or current.get('log_name') != log_name or bool(current.get('cancel_requested'))
+    
+    def runner():
+        update(status='waiting_gpu')
+        reservation = _gpu_admit(key, label, should_cancel=should_cancel)
+        if reservation is None:
+            update(status='cancelled')
+            if log is not None:
+                log.close()
+            return
+        try:
+            process = launch(_gpu_env(reservation))
         except Exception as e:
-            return jsonify({
-                'success': False,
-                'error': f'Failed to get GPU status: {str(e)}'
-            }), 500
+            print(f"启动 {label} 失败: {str(e)}")
+            update(status='failed', launch_error=str(e))
+            if log is not None:
+                log.append(f"启动失败: {str(e)}\n")
+                log.close()
+            _gpu_release(reservation)
+            return
+        
+        reservation['pgid'] = process.pid  # 进程以 setsid 启动，进程组号即PID
+        if log is not None:
+            _start_log_reader(process, log)
+        task['process'] = process
+        update(pid=process.pid, status='running')
+        if should_cancel():
+            _kill_process_group(process)
+        process.wait()
+        _gpu_release(reservation)
     
-    except Exception as e:
+    threading.Thread(target=runner, name=f'gpu-launch-{key}', daemon=True).start()
+
+@app.route('/api/gpu_scheduler', methods=['GET'])
+def get_gpu_scheduler_status():
+    """获取GPU显存调度状态：已准入的任务、等待中的任务以及各类任务的显存占用"""
+    with gpu_scheduler_lock:
         return jsonify({
-            'success': False,
-            'error': f'Failed to get GPU status: {str(e)}'
-        }), 500
+            'reservations': list(gpu_reservations.values()),
+            'waiting': list(gpu_waiting.values()),
+            'footprints_mb': {key: _gpu_footprint_mb(key) for key in set(GPU_TASK_FOOTPRINT_MB) | set(gpu_footprint_learned)},
+            'learned_mb': {key: int(value) for key, value in gpu_footprint_learned.items()},
+            'headroom_mb': GPU_SCHEDULER_HEADROOM_MB,
+            'timestamp': datetime.now().isoformat()
+        })
+
+# 目录索引 - 列表接口从内存中的目录索引读取，目录内容变化时才重新扫描
+# 安装了 inotify_simple 时由inotify事件使索引失效，否则按目录的修改时间轮询检查
+DIR_INDEX_POLL_INTERVAL = 2.0  # 轮询模式下同一目录两次检查之间的最小间隔（秒）
+DIR_INDEX_MAX_ENTRIES = 1024  # 内存中最多保留的目录索引数量，超出时淘汰最久未使用的索引并移除其监听
+
+dir_index = OrderedDict()  # (目录, 是否包含文件信息) -> 索引，按最近使用排序
+dir_index_generation = {}  # 目录 -> 变化次数（inotify事件到达时递增）
+dir_index_watches = {}  # inotify watch 描述符 -> 目录
+dir_index_watched = {}  # 目录 -> inotify watch 描述符
+dir_index_watch_full = False  # 已达到系统的inotify监听数量上限（ENOSPC）
+dir_index_lock = threading.Lock()
+dir_index_inotify = None  # None: 尚未初始化；False: 不可用，使用轮询
+
+def _dir_index_watcher():
+    """inotify事件线程：目录内容变化时递增该目录的版本号，使对应索引失效"""
+    from inotify_simple import flags
+    while True:
+        for event in dir_index_inotify.read():
+            with dir_index_lock:
+                path = dir_index_watches.get(event.wd)
+                if path is None:
+                    continue
+                dir_index_generation[path] = dir_index_generation.get(path, 0) + 1
+                if event.mask & flags.IGNORED:  # 目录已删除，watch 自动移除
+                    dir_index_watches.pop(event.wd, None)
+                    dir_index_watched.pop(path, None)
+
+def _dir_index_watch(path):
+    """为目录添加inotify监听，返回 watch 描述符，无法监听时返回 None（需持有 dir_index_lock）"""
+    global dir_index_inotify, dir_index_watch_full
+    if path in dir_index_watched:
+        return dir_index_watched[path]
+    if dir_index_inotify is None:
+        try:
+            import inotify_simple
+            dir_index_inotify = inotify_simple.INotify()
+            threading.Thread(target=_dir_index_watcher, name='dir-index-watcher', daemon=True).start()
+        except (ImportError, OSError):
+            print("inotify 不可用，目录索引改为按修改时间轮询")
+            dir_index_inotify = False
+    if dir_index_inotify is False:
+        return None
+    from inotify_simple import flags
+    mask = (flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | flags.MODIFY |
+            flags.ATTRIB | flags.DELETE_SELF | flags.MOVE_SELF)
+    try:
+        wd = dir_index_inotify.add_watch(path, mask)
+    except OSError as e:
+        # 超出系统监听数量上限等情况下该目录退回到轮询，之后再访问时重试
+        if e.errno == errno.ENOSPC and not dir_index_watch_full:
+            print("inotify 监听数量已达上限，新的目录索引改为按修改时间轮询")
+            dir_index_watch_full = True
+        return None
+    dir_index_watch_full = False
+    dir_index_watches[wd] = path
+    dir_index_watched[path] = wd
+    return wd
+
+def _dir_index_release(path):
+    """目录已没有任何索引时移除其inotify监听和版本号（需持有 dir_index_lock）"""
+    if (path, False) in dir_index or (path, True) in dir_index:
+        return
+    dir_index_generation.pop(path, None)
+    wd = dir_index_watched.pop(path, None)
+    if wd is None:
+        return
+    dir_index_watches.pop(wd, None)
+    try:
+        dir_index_inotify.rm_watch(wd)
+    except OSError:
+        pass  # 目录已删除，watch 已被内核移除
+
+def _dir_index_forget(root):
+    """丢弃目录及其子目录的索引和监听（删除目录树时调用）"""
+    prefix = os.path.join(root, '')
+    with dir_index_lock:
+        paths = {path for path, _ in dir_index if path == root or path.startswith(prefix)}
+        paths.update(path for path in dir_index_watched if path == root or path.startswith(prefix))
+        for path in paths:
+            dir_index.pop((path, False), None)
+            dir_index.pop((path, True), None)
+            _dir_index_release(path)
+
+def _dir_index_entry(path, with_stat=False):
+    """获取目录索引，目录不存在或不是目录时返回 None"""
+    key = (path, with_stat)
+    now = time.time()
+    with dir_index_lock:
+        entry = dir_index.get(key)
+        if entry is not None:
+            dir_index.move_to_end(key)
+            if entry['watched'] and entry['generation'] == dir_index_generation.get(path, 0):
+                return entry
+            if not entry['watched'] and now - entry['checked_at'] < DIR_INDEX_POLL_INTERVAL:
+                return entry
+        wd = _dir_index_watch(path) if os.path.isdir(path) else None
+        generation = dir_index_generation.get(path, 0)
+    
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        if entry is not None and wd is None and entry['mtime_ns'] == mtime_ns:
+            entry['checked_at'] = now
+            return entry
+        
+        entries = []
+        with os.scandir(path) as iterator:
+            for item in iterator:
+                is_dir = item.is_dir()
+                info = {'name': item.name, 'is_dir': is_dir}
+                if with_stat and not is_dir:
+                    stat = item.stat()
+                    info['size'] = stat.st_size
+                    info['mtime'] = stat.st_mtime
+                entries.append(info)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        with dir_index_lock:
+            dir_index.pop(key, None)
+            _dir_index_release(path)
+        return None
+    
+    entry = {
+        'entries': entries,
+        'summaries': {},
+        'mtime_ns': mtime_ns,
+        'checked_at': now,
+        'watched': False,
+        'generation': generation
+    }
+    with dir_index_lock:
+        # 扫描期间监听可能已随索引淘汰而移除，此时按轮询处理
+        entry['watched'] = wd is not None and dir_index_watched.get(path) == wd
+        dir_index[key] = entry
+        dir_index.move_to_end(key)
+        while len(dir_index) > DIR_INDEX_MAX_ENTRIES:
+            evicted_key, _ = dir_index.popitem(last=False)
+            _dir_index_release(evicted_key[0])
+    return entry
+
+def _list_directory(path, with_stat=False):
+    """列出目录内容 [{'name', 'is_dir'[, 'size', 'mtime']}]，目录不存在时返回 None"""
+    entry = _dir_index_entry(path, with_stat)
+    return entry['entries'] if entry is not None else None
+
+def _directory_summary(path, name, compute, with_stat=False):
+    """基于目录内容计算的汇总值（如图片数量），目录不变时直接返回缓存结果"""
+    entry = _dir_index_entry(path, with_stat)
+    if entry is None:
+        return None
+    summaries = entry['summaries']
+    if name not in summaries:
+        summaries[name] = compute(entry['entries'])
+    return summaries[name]
 
 # 输入数据集预览相关API
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif', '.webp')
+
+def _count_images(entries):
+    """统计目录中的图片数量"""
+    return sum(1 for entry in entries if not entry['is_dir'] and entry['name'].lower().endswith(IMAGE_EXTENSIONS))
+
+def _image_names(entries):
+    """目录中的图片文件名列表"""
+    return [entry['name'] for entry in entries if not entry['is_dir'] and entry['name'].lower().endswith(IMAGE_EXTENSIONS)]
+
+def _count_result_images(entries):
+    """统计结果目录中的深度图（*_d.png）和RGB图（*.png）数量"""
+    depth_count = rgb_count = 0
+    for entry in entries:
+        name = entry['name']
+        if name.endswith('_d.png'):
+            depth_count += 1
+        elif name.endswith('.png'):
+            rgb_count += 1
+    return depth_count, rgb_count
+
 @app.route('/list_input_datasets', methods=['GET'])
 def list_input_datasets():
     """获取所有输入数据集列表"""
@@ -1608,32 +4973,20 @@ def list_input_datasets():
         
         datasets = []
         
-        # 扫描所有数据集文件夹
-        for dataset_name in os.listdir(user_input_base):
-            dataset_path = os.path.join(user_input_base, dataset_name)
-            
+        # 扫描所有数据集文件夹（从目录索引读取）
+        for entry in _list_directory(user_input_base) or []:
             # 确保是文件夹
-            if not os.path.isdir(dataset_path):
+            if not entry['is_dir']:
                 continue
+            dataset_name = entry['name']
+            dataset_path = os.path.join(user_input_base, dataset_name)
             
-            # 检查是否包含 rgb 文件夹
+            # 统计 rgb 文件夹中的图片数量，没有 rgb 文件夹时跳过
             rgb_path = os.path.join(dataset_path, 'rgb')
-            if not os.path.exists(rgb_path) or not os.path.isdir(rgb_path):
-                continue
-            
-            # 统计 rgb 文件夹中的图片数量
-            image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif', '.webp']
-            image_count = 0
-            
-            try:
-                for filename in os.listdir(rgb_path):
-                    if any(filename.lower().endswith(ext) for ext in image_extensions):
-                        image_count += 1
-            except PermissionError:
-                continue
+            image_count = _directory_summary(rgb_path, 'image_count', _count_images)
             
             # 只包含有图片的数据集
-            if image_count > 0:
+            if image_count:
                 datasets.append({
                     'name': dataset_name,
                     'path': dataset_path,
@@ -1663,7 +5016,7 @@ def list_output_datasets():
         import random
         
         # 输出数据集的基础目录
-        output_base = '/home/vipuser/home/img/nvs/experiments'
+        output_base = NVS_EXPERIMENTS_DIR
         
         if not os.path.exists(output_base):
             return jsonify({
@@ -1672,35 +5025,27 @@ def list_output_datasets():
             })
         
         datasets = []
+        catalog = _experiment_catalog()
         
-        # 扫描所有输出文件夹
-        for folder_name in os.listdir(output_base):
+        # 扫描所有输出文件夹（从目录索引读取）
+        for entry in _list_directory(output_base) or []:
+            folder_name = entry['name']
             folder_path = os.path.join(output_base, folder_name)
             
-            # 确保是文件夹且以 _output_ 开头
-            if not os.path.isdir(folder_path) or '_output_' not in folder_name:
+            # 确保是文件夹且名称为 <数据集>_output_<时间戳>
+            parsed = _parse_experiment_folder(folder_name) if entry['is_dir'] else None
+            if parsed is None:
                 continue
             
             # 提取数据集名称（去除时间戳后缀）
-            dataset_name = folder_name.split('_output_')[0]
+            dataset_name, _, run_time = parsed
             
-            # 检查是否包含 results 文件夹
+            # 统计深度图和RGB图的数量，没有 results 文件夹时跳过
             results_path = os.path.join(folder_path, 'results')
-            if not os.path.exists(results_path) or not os.path.isdir(results_path):
-                continue
-            
-            # 统计深度图和RGB图的数量
-            depth_count = 0
-            rgb_count = 0
-            
-            try:
-                for filename in os.listdir(results_path):
-                    if filename.endswith('_d.png'):
-                        depth_count += 1
-                    elif filename.endswith('.png') and not filename.endswith('_d.png'):
-                        rgb_count += 1
-            except PermissionError:
+            counts = _directory_summary(results_path, 'result_counts', _count_result_images)
+            if counts is None:
                 continue
+            depth_count, rgb_count = counts
             
             # 只包含有图片的数据集
             if depth_count > 0 or rgb_count > 0:
@@ -1711,11 +5056,14 @@ def list_output_datasets():
                     'results_path': results_path,
                     'depth_count': depth_count,
                     'rgb_count': rgb_count,
-                    'total_images': depth_count + rgb_count
+                    'total_images': depth_count + rgb_count,
+                    'run_time': run_time.isoformat() if run_time else None,
+                    'is_latest': catalog[dataset_name][0]['folder_name'] == folder_name
                 })
         
-        # 按数据集名称排序
-        datasets.sort(key=lambda x: x['name'])
+        # 按数据集名称排序，同一数据集的最新运行排在最前
+        run_order = {run['folder_name']: index for runs in catalog.values() for index, run in enumerate(runs)}
+        datasets.sort(key=lambda x: (x['name'], run_order.get(x['folder_name'], 0)))
         
         return jsonify({
             'datasets': datasets,
@@ -1729,6 +5077,149 @@ def list_output_datasets():
             'datasets': []
         }), 500
 
+# 实验目录索引 - 解析 nvs/experiments 下 <数据集>_output_<时间戳> 文件夹，按数据集分组并按时间从新到旧排序
+NVS_EXPERIMENTS_DIR = '/home/vipuser/home/img/nvs/experiments'
+EXPERIMENT_TIMESTAMP_FORMATS = {14: '%Y%m%d%H%M%S', 12: '%Y%m%d%H%M', 8: '%Y%m%d'}  # 按时间戳数字位数匹配
+
+def _parse_experiment_folder(folder_name):
+    """解析实验文件夹名，返回 (数据集名称, 时间戳后缀, 运行时间)；不是实验文件夹时返回 None"""
+    dataset_name, separator, suffix = folder_name.rpartition('_output_')
+    if not separator or not dataset_name:
+        return None
+    
+    digits = re.sub(r'\D', '', suffix)
+    run_time = None
+    try:
+        if len(digits) in EXPERIMENT_TIMESTAMP_FORMATS:
+            run_time = datetime.strptime(digits, EXPERIMENT_TIMESTAMP_FORMATS[len(digits)])
+        elif len(digits) in (10, 13):  # Unix 时间戳（秒/毫秒）
+            run_time = datetime.fromtimestamp(int(digits) / (1000 if len(digits) == 13 else 1))
+    except (ValueError, OverflowError, OSError):
+        run_time = None
+    return dataset_name, suffix, run_time
+
+def _build_experiment_catalog(entries):
+    """按数据集分组实验文件夹：{数据集名称: [运行信息, ...]}，最新的运行排在最前"""
+    catalog = {}
+    for entry in entries:
+        if not entry['is_dir']:
+            continue
+        parsed = _parse_experiment_folder(entry['name'])
+        if parsed is None:
+            continue
+        dataset_name, suffix, run_time = parsed
+        catalog.setdefault(dataset_name, []).append({
+            'folder_name': entry['name'],
+            'timestamp': suffix,
+            'run_time': run_time.isoformat() if run_time else None
+        })
+    
+    # 无法解析时间的运行排在最后，其余按时间排序；时间相同时按后缀排序，保证结果确定
+    for runs in catalog.values():
+        runs.sort(key=lambda run: (run['run_time'] is not None, run['run_time'] or '', run['timestamp']), reverse=True)
+    return catalog
+
+def _experiment_catalog():
+    """获取实验目录索引，实验目录不存在时返回空字典"""
+    return _directory_summary(NVS_EXPERIMENTS_DIR, 'experiment_catalog', _build_experiment_catalog) or {}
+
+def _find_experiment_run(dataset_name, run='latest'):
+    """查找数据集的指定运行（文件夹名或 latest），找不到时返回 None"""
+    runs = _experiment_catalog().get(dataset_name)
+    if not runs:
+        return None
+    if run == 'latest':
+        return runs[0]
+    return next((item for item in runs if item['folder_name'] == run or item['timestamp'] == run), None)
+
+def _experiment_run_view(dataset_name, run):
+    """生成对外返回的运行信息，包括结果图片数量"""
+    results_path = os.path.join(NVS_EXPERIMENTS_DIR, run['folder_name'], 'results')
+    counts = _directory_summary(results_path, 'result_counts', _count_result_images)
+    return dict(run,
+                dataset=dataset_name,
+                has_results=counts is not None,
+                depth_count=counts[0] if counts else 0,
+                rgb_count=counts[1] if counts else 0)
+
+@app.route('/experiments', methods=['GET'])
+def list_experiments():
+    """列出所有有训练输出的数据集及其最新运行"""
+    catalog = _experiment_catalog()
+    return jsonify({
+        'datasets': [{'name': name, 'run_count': len(runs), 'latest': runs[0]['folder_name']}
+                     for name, runs in sorted(catalog.items())],
+        'total_datasets': len(catalog)
+    })
+
+@app.route('/experiments/<dataset_name>', methods=['GET'])
+def list_experiment_runs(dataset_name):
+    """列出数据集的所有训练运行，最新的排在最前"""
+    runs = _experiment_catalog().get(dataset_name)
+    if not runs:
+        return jsonify({'error': f'未找到数据集 {dataset_name} 的输出文件夹', 'runs': []}), 404
+    return jsonify({
+        'dataset': dataset_name,
+        'latest': runs[0]['folder_name'],
+        'runs': [_experiment_run_view(dataset_name, run) for run in runs]
+    })
+
+@app.route('/experiments/<dataset_name>/<run>', methods=['GET'])
+def get_experiment_run(dataset_name, run):
+    """获取数据集的指定运行，run 为文件夹名、时间戳后缀或 latest"""
+    found = _find_experiment_run(dataset_name, run)
+    if found is None:
+        return jsonify({'error': f'未找到数据集 {dataset_name} 的运行 {run}'}), 404
+    return jsonify(_experiment_run_view(dataset_name, found))
+
+# 输出帧配对索引 - 每个 results 目录维护一份深度图/RGB图配对编号的数组及文件大小，
+# 目录变化时只处理新增和删除的编号，随机预览直接从数组中抽样
+frame_pair_indexes = {}  # results 目录 -> 配对索引
+frame_pair_lock = threading.Lock()
+
+def _result_pair_numbers(entries):
+    """结果目录中同时有深度图（*_d.png）和RGB图（*.png）的编号集合"""
+    names = {entry['name'] for entry in entries if not entry['is_dir']}
+    return {name[:-len('_d.png')] for name in names
+            if name.endswith('_d.png') and f"{name[:-len('_d.png')]}.png" in names}
+
+def _frame_pair_index(results_path):
+    """获取结果目录的配对索引，目录不存在时返回 None"""
+    numbers = _directory_summary(results_path, 'pair_numbers', _result_pair_numbers)
+    if numbers is None:
+        return None
+    
+    with frame_pair_lock:
+        index = frame_pair_indexes.get(results_path)
+        if index is None:
+            index = {'numbers': set(), 'ids': [], 'positions': {}, 'sizes': {}, 'lock': threading.Lock()}
+            frame_pair_indexes[results_path] = index
+    
+    with index['lock']:
+        if index['numbers'] is numbers:
+            return index  # 目录没有变化
+        
+        ids, positions, sizes = index['ids'], index['positions'], index['sizes']
+        # 删除的编号：与数组末尾交换后弹出
+        for number in set(positions) - numbers:
+            position = positions.pop(number)
+            last = ids.pop()
+            if last != number:
+                ids[position] = last
+                positions[last] = position
+            sizes.pop(number, None)
+        # 新增的编号：记录文件大小后追加到数组末尾
+        for number in numbers - set(positions):
+            try:
+                sizes[number] = (os.path.getsize(os.path.join(results_path, f'{number}_d.png')),
+                                 os.path.getsize(os.path.join(results_path, f'{number}.png')))
+            except OSError:
+                continue
+            positions[number] = len(ids)
+            ids.append(number)
+        index['numbers'] = numbers
+        return index
+
 @app.route('/get_random_output_images/<dataset_name>', methods=['GET'])
 def get_random_output_images(dataset_name):
     """获取指定输出数据集的随机图片（深度图和RGB图）"""
@@ -1739,81 +5230,46 @@ def get_random_output_images(dataset_name):
         count = int(request.args.get('count', 5))
         count = max(1, min(count, 20))  # 限制在1-20组之间
         
-        # 查找对应的输出文件夹
-        output_base = '/home/vipuser/home/img/nvs/experiments'
-        output_folder = None
-        
-        for folder_name in os.listdir(output_base):
-            if folder_name.startswith(f"{dataset_name}_output_"):
-                output_folder = folder_name
-                break
-        
-        if not output_folder:
+        # 查找对应的输出文件夹，默认使用最新一次运行
+        run = _find_experiment_run(dataset_name, request.args.get('run', 'latest'))
+        if run is None:
             return jsonify({
                 'error': f'未找到数据集 {dataset_name} 的输出文件夹',
                 'images': []
             }), 404
         
-        results_path = os.path.join(output_base, output_folder, 'results')
+        output_folder = run['folder_name']
+        results_path = os.path.join(NVS_EXPERIMENTS_DIR, output_folder, 'results')
         
-        # 检查路径是否存在
-        if not os.path.exists(results_path):
+        # 获取配对索引（同时有深度图和RGB图的编号）
+        index = _frame_pair_index(results_path)
+        if index is None:
             return jsonify({
                 'error': f'数据集 {dataset_name} 的输出结果文件夹不存在',
                 'images': []
             }), 404
         
-        # 获取所有深度图和RGB图的编号
-        depth_files = {}
-        rgb_files = {}
-        
-        try:
-            for filename in os.listdir(results_path):
-                if filename.endswith('_d.png'):
-                    # 深度图，提取编号
-                    number = filename.replace('_d.png', '')
-                    depth_files[number] = filename
-                elif filename.endswith('.png') and not filename.endswith('_d.png'):
-                    # RGB图，提取编号
-                    number = filename.replace('.png', '')
-                    rgb_files[number] = filename
-        except PermissionError:
-            return jsonify({
-                'error': f'无权限访问数据集 {dataset_name} 的输出',
-                'images': []
-            }), 403
-        
-        # 找到同时有深度图和RGB图的编号
-        common_numbers = set(depth_files.keys()) & set(rgb_files.keys())
-        
-        if not common_numbers:
-            return jsonify({
-                'error': f'数据集 {dataset_name} 中没有找到配对的深度图和RGB图',
-                'images': []
-            })
-        
-        # 随机选择指定数量的图片组
-        selected_numbers = random.sample(list(common_numbers), min(count, len(common_numbers)))
+        with index['lock']:
+            if not index['ids']:
+                return jsonify({
+                    'error': f'数据集 {dataset_name} 中没有找到配对的深度图和RGB图',
+                    'images': []
+                })
+            
+            # 随机选择指定数量的图片组
+            total_pairs = len(index['ids'])
+            selected_numbers = random.sample(index['ids'], min(count, total_pairs))
+            selected_sizes = [index['sizes'][number] for number in selected_numbers]
         
         # 构建返回的图片信息
         images = []
-        for number in selected_numbers:
-            depth_filename = depth_files[number]
-            rgb_filename = rgb_files[number]
-            
-            # 获取文件大小信息
-            depth_path = os.path.join(results_path, depth_filename)
-            rgb_path = os.path.join(results_path, rgb_filename)
-            
-            depth_size = round(os.path.getsize(depth_path) / (1024 * 1024), 2) if os.path.exists(depth_path) else 0
-            rgb_size = round(os.path.getsize(rgb_path) / (1024 * 1024), 2) if os.path.exists(rgb_path) else 0
-            
+        for number, (depth_size, rgb_size) in zip(selected_numbers, selected_sizes):
             images.append({
                 'number': number,
-                'depth_filename': depth_filename,
-                'rgb_filename': rgb_filename,
-                'depth_size_mb': depth_size,
-                'rgb_size_mb': rgb_size,
+                'depth_filename': f'{number}_d.png',
+                'rgb_filename': f'{number}.png',
+                'depth_size_mb': round(depth_size / (1024 * 1024), 2),
+                'rgb_size_mb': round(rgb_size / (1024 * 1024), 2),
                 'output_folder': output_folder
             })
         
@@ -1821,7 +5277,7 @@ def get_random_output_images(dataset_name):
             'images': images,
             'dataset_name': dataset_name,
             'output_folder': output_folder,
-            'total_pairs': len(common_numbers)
+            'total_pairs': total_pairs
         })
         
     except Exception as e:
@@ -1837,10 +5293,10 @@ def serve_output_image(output_folder, filename):
     """提供输出图片文件服务"""
     try:
         output_base = '/home/vipuser/home/img/nvs/experiments'
-        results_path = os.path.join(output_base, output_folder, 'results')
+        file_path = _safe_join(output_base, output_folder, 'results', filename)
         
-        if os.path.exists(os.path.join(results_path, filename)):
-            return send_from_directory(results_path, filename)
+        if file_path and os.path.isfile(file_path):
+            return _serve_media_file(file_path)
         else:
             return jsonify({'error': '文件不存在'}), 404
             
@@ -1862,27 +5318,14 @@ def get_random_dataset_images(dataset_name):
         dataset_path = os.path.join(user_input_base, dataset_name)
         rgb_path = os.path.join(dataset_path, 'rgb')
         
-        # 检查路径是否存在
-        if not os.path.exists(rgb_path):
+        # 获取所有图片文件（从目录索引读取）
+        all_images = _directory_summary(rgb_path, 'image_names', _image_names)
+        if all_images is None:
             return jsonify({
                 'error': f'数据集 {dataset_name} 的 rgb 文件夹不存在',
                 'images': []
             }), 404
         
-        # 获取所有图片文件
-        image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif', '.webp']
-        all_images = []
-        
-        try:
-            for filename in os.listdir(rgb_path):
-                if any(filename.lower().endswith(ext) for ext in image_extensions):
-                    all_images.append(filename)
-        except PermissionError:
-            return jsonify({
-                'error': f'无权限访问数据集 {dataset_name}',
-                'images': []
-            }), 403
-        
         if not all_images:
             return jsonify({
                 'error': f'数据集 {dataset_name} 中没有找到图片文件',
@@ -1919,9 +5362,9 @@ def serve_input_dataset_image(dataset_name, filename):
         if not os.path.exists(rgb_path):
             return "Dataset not found", 404
         
-        # 检查文件是否存在
-        file_path = os.path.join(rgb_path, filename)
-        if not os.path.exists(file_path):
+        # 检查文件是否存在（同时确保路径没有越出数据集目录）
+        file_path = _safe_join(user_input_base, dataset_name, 'rgb', filename)
+        if not file_path or not os.path.isfile(file_path):
             return "Image file not found", 404
         
         # 检查是否是图片文件
@@ -1929,25 +5372,46 @@ def serve_input_dataset_image(dataset_name, filename):
         if not any(filename.lower().endswith(ext) for ext in image_extensions):
             return "Not an image file", 400
         
-        return send_from_directory(rgb_path, filename)
+        return _serve_media_file(file_path)
         
     except Exception as e:
         print(f"提供输入数据集图片服务失败: {str(e)}")
         return f"Error serving image: {str(e)}", 500
 
 # 批量训练脚本相关的全局变量
-batch_training_process = None
-batch_training_task_id = None
-batch_training_output_buffer = ""  # 累积输出缓冲区
+# 批量训练 - 当前（最近一次）训练任务的记录保存在状态存储的 ('batch_training', 'current') 中：
+# task_id、log_name、status（waiting_gpu/running/failed/cancelled/stopped）、pid、result 等
+batch_training_local = None  # 本进程启动的训练任务（{'process', 'log', ...}），其他工作进程启动时为 None
+
+def _load_batch_training():
+    return state_store.get('batch_training', 'current')
+
+def _update_batch_training(record, **fields):
+    """更新训练记录中的字段（记录已被新任务替换时不修改），返回更新后的记录"""
+    return state_store.update('batch_training', 'current', lambda current: dict(current, **fields)
+                              if current and current['log_name'] == record['log_name'] else None)
+
+def _batch_training_log(record):
+    """训练任务的输出日志：本进程启动时直接使用 _ProcessLog，否则从日志文件读取"""
+    if batch_training_local is not None and batch_training_local['log'].name == record['log_name']:
+        return batch_training_local['log']
+    return _task_log(record['log_name'])
+
+def _batch_training_active(record):
+    """训练任务是否在运行或在等待显存（启动它的工作进程退出后不再视为运行中）"""
+    if record is None or record['status'] not in ('waiting_gpu', 'running') or record.get('cancel_requested'):
+        return False
+    log = _batch_training_log(record)
+    return log is not None and not log.closed
 
 @app.route('/start_batch_training', methods=['POST'])
 def start_batch_training():
     """启动批量训练脚本"""
-    global batch_training_process, batch_training_task_id, batch_training_output_buffer
+    global batch_training_local
     
     try:
-        # 检查是否已有训练任务在运行
-        if batch_training_process and batch_training_process.poll() is None:
+        # 检查是否已有训练任务在运行或在等待显存
+        if _batch_training_active(_load_batch_training()):
             return jsonify({
                 'success': False,
                 'error': '批量训练任务已在运行中，请先停止当前任务'
@@ -1963,28 +5427,54 @@ def start_batch_training():
                 'error': f'批量训练脚本不存在: {script_path}'
             }), 404
         
-        # 生成任务ID并重置输出缓冲区
-        batch_training_task_id = str(uuid.uuid4())
-        batch_training_output_buffer = ""  # 重置输出缓冲区
-        
-        print(f"启动批量训练脚本: {script_path}")
-        
-        # 启动批量训练脚本
-        batch_training_process = subprocess.Popen(
-            ['python3', script_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1,  # 行缓冲
-            cwd=os.path.dirname(script_path),
-            preexec_fn=os.setsid  # 创建新的进程组
-        )
+        # 生成任务ID并创建新的输出日志，原子地替换训练记录（其他工作进程可能同时提交）
+        task_id = str(uuid.uuid4())
+        log = _ProcessLog(f'batch_{task_id}')
+        previous = _load_batch_training()
+        
+        def claim(current):
+            nonlocal previous
+            if _batch_training_active(current):
+                return None
+            previous = current
+            return {'task_id': task_id, 'log_name': log.name, 'status': 'waiting_gpu', 'pid': None, 'result': None,
+                    'launch_error': None, 'owner_pid': os.getpid(), 'cancel_requested': False}
+        
+        if state_store.update('batch_training', 'current', claim) is None:
+            log.discard()
+            return jsonify({
+                'success': False,
+                'error': '批量训练任务已在运行中，请先停止当前任务'
+            }), 409
+        if previous is not None:
+            if batch_training_local is not None and batch_training_local['log'].name == previous['log_name']:
+                batch_training_local['log'].discard()
+            else:
+                _discard_task_log(previous['log_name'])
+        
+        def launch(env):
+            print(f"启动批量训练脚本: {script_path}")
+            
+            # 启动批量训练脚本
+            return subprocess.Popen(
+                ['python3', script_path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0,  # 输出由日志读取线程按字节读取
+                cwd=os.path.dirname(script_path),
+                env=env,
+                preexec_fn=os.setsid  # 创建新的进程组
+            )
+        
+        # 训练进程在获得GPU显存准入后才启动
+        batch_training_local = {'process': None, 'log': log}
+        _run_when_gpu_admitted('batch_training', f'批量训练 {task_id[:8]}', batch_training_local, launch,
+                               record=('batch_training', 'current'))
         
         return jsonify({
             'success': True,
-            'task_id': batch_training_task_id,
-            'message': '批量训练脚本已启动',
-            'pid': batch_training_process.pid
+            'task_id': task_id,
+            'message': '批量训练任务已提交，获得GPU显存后自动启动'
         })
         
     except Exception as e:
@@ -1994,149 +5484,156 @@ def start_batch_training():
             'error': f'启动失败: {str(e)}'
         }), 500
 
-@app.route('/get_batch_training_output', methods=['GET'])
-def get_batch_training_output():
-    """获取批量训练脚本的输出"""
-    global batch_training_process, batch_training_output_buffer
-    
-    if not batch_training_process:
-        return jsonify({
-            'output': batch_training_output_buffer,
+def _batch_training_state(record):
+    """获取批量训练的完成状态，日志输出结束后记录训练结果"""
+    if record is not None and record['status'] == 'waiting_gpu' and _batch_training_active(record):
+        return {'completed': False, 'success': None, 'status': 'waiting_gpu'}
+    if record is not None and record['status'] == 'failed':
+        return {
             'completed': True,
             'success': False,
-            'error': '没有运行中的批量训练任务'
-        })
+            'error': f"启动失败: {record.get('launch_error') or ''}"
+        }
+    
+    if record is None or record['status'] != 'running':
+        return {'completed': True, 'success': False, 'error': '没有运行中的批量训练任务'}
+    
+    if record['result'] is not None:
+        # 训练已结束，结果已记录
+        return {'completed': True, 'success': record['result']}
+    
+    log = _batch_training_log(record)
+    if log is None or log.closed:
+        result = log is not None and log.returncode == 0
+        _update_batch_training(record, result=result)
+        return {'completed': True, 'success': result}
     
+    return {'completed': False, 'success': None}
+
+@app.route('/get_batch_training_output', methods=['GET'])
+def get_batch_training_output():
+    """获取批量训练脚本的输出，offset 为上次返回的字节偏移，只返回其后的新输出"""
     try:
-        # 读取新的输出并累积到缓冲区
-        new_output = ""
-        
-        # 检查进程是否还在运行
-        if batch_training_process.poll() is not None:
-            # 进程已结束，读取剩余输出
-            try:
-                remaining_output = batch_training_process.stdout.read()
-                if remaining_output:
-                    new_output = remaining_output
-                    batch_training_output_buffer += new_output
-            except Exception as e:
-                print(f"读取剩余输出失败: {e}")
-            
-            success = (batch_training_process.returncode == 0)
-            batch_training_process = None  # 清除进程引用
-            
-            return jsonify({
-                'output': batch_training_output_buffer,
-                'completed': True,
-                'success': success
-            })
-        else:
-            # 进程仍在运行，读取新的输出
-            try:
-                # 使用非阻塞方式读取输出
-                import select
-                import fcntl
-                import os
-                
-                # 设置stdout为非阻塞模式
-                fd = batch_training_process.stdout.fileno()
-                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-                
-                try:
-                    # 尝试读取所有可用的输出
-                    while True:
-                        chunk = batch_training_process.stdout.read(1024)
-                        if not chunk:
-                            break
-                        new_output += chunk
-                except Exception:
-                    # 没有更多数据可读，这是正常的
-                    pass
-                
-                # 将新输出添加到缓冲区
-                if new_output:
-                    batch_training_output_buffer += new_output
-                
-                return jsonify({
-                    'output': batch_training_output_buffer,
-                    'completed': False,
-                    'success': None
-                })
-                
-            except Exception as e:
-                print(f"读取输出失败: {e}")
-                return jsonify({
-                    'output': batch_training_output_buffer,
-                    'completed': False,
-                    'success': None,
-                    'error': f'读取输出失败: {str(e)}'
-                })
+        record = _load_batch_training()
+        state = _batch_training_state(record)
+        log = record and _batch_training_log(record)
+        if log is None:
+            return jsonify({'output': '', 'offset': 0, 'size': 0, **state})
+        
+        offset, limit = _log_cursor_args()
+        data, next_offset = log.read(offset, limit)
+        if next_offset < log.size:
+            state['completed'] = False  # 剩余输出读完后再报告完成
+        return jsonify({
+            'output': data.decode('utf-8', errors='replace'),
+            'offset': next_offset,
+            'size': log.size,
+            **state
+        })
         
     except Exception as e:
         print(f"获取批量训练输出失败: {str(e)}")
         return jsonify({
-            'output': batch_training_output_buffer,
+            'output': '',
             'completed': True,
             'success': False,
             'error': f'获取输出失败: {str(e)}'
         })
 
+@app.route('/stream_batch_training_output', methods=['GET'])
+def stream_batch_training_output():
+    """以SSE方式推送批量训练的新输出行"""
+    record = _load_batch_training()
+    log = record and _batch_training_log(record)
+    if log is None:
+        return jsonify({'error': '没有批量训练任务'}), 404
+    
+    def get_success():
+        current = _load_batch_training()
+        if current is None or current['log_name'] != log.name:
+            return False  # 已开始新的训练任务
+        return _batch_training_state(current)['success']
+    
+    return _sse_response(_sse_log_stream(log, _sse_start_offset(), get_success))
+
 @app.route('/stop_batch_training', methods=['POST'])
 def stop_batch_training():
     """停止批量训练脚本"""
-    global batch_training_process, batch_training_task_id, batch_training_output_buffer
+    record = _load_batch_training()
+    
+    if record is not None and record['status'] == 'waiting_gpu' and _batch_training_active(record):
+        # 任务还在等待GPU显存，取消启动即可（由其他工作进程提交的任务在下次检查准入时放弃）
+        _update_batch_training(record, cancel_requested=True, status='cancelled')
+        if batch_training_local is not None and batch_training_local['log'].name == record['log_name']:
+            batch_training_local['cancel_requested'] = True
+        with gpu_scheduler_lock:
+            gpu_scheduler_lock.notify_all()
+        return jsonify({
+            'success': True,
+            'message': '等待中的批量训练任务已取消'
+        })
     
-    if not batch_training_process:
+    if record is None or record['status'] != 'running':
         return jsonify({
             'success': False,
             'error': '没有运行中的批量训练任务'
         })
     
+    local = batch_training_local if batch_training_local is not None and \
+        batch_training_local['log'].name == record['log_name'] else None
+    process = local['process'] if local else None
+    
     try:
+        if process is None:
+            # 由其他工作进程启动的训练：按记录中的PID终止进程组
+            log = _batch_training_log(record)
+            running = log is not None and not log.closed
+            if running:
+                print(f"正在终止批量训练任务，PID: {record['pid']}")
+                _terminate_process_group(record['pid'], 2, 5)  # SIGINT (Ctrl+C)，5秒后强制杀死
+        else:
+            running = process.poll() is None
+        
         # 检查进程是否还在运行
-        if batch_training_process.poll() is None:
-            print(f"正在终止批量训练任务，PID: {batch_training_process.pid}")
+        if process is not None and running:
+            print(f"正在终止批量训练任务，PID: {process.pid}")
             
             try:
                 # 首先尝试优雅地终止进程组
-                os.killpg(os.getpgid(batch_training_process.pid), 2)  # SIGINT (Ctrl+C)
-                print(f"发送 SIGINT 到进程组 {batch_training_process.pid}")
+                os.killpg(os.getpgid(process.pid), 2)  # SIGINT (Ctrl+C)
+                print(f"发送 SIGINT 到进程组 {process.pid}")
                 
                 # 等待进程终止，最多等待5秒
                 try:
-                    batch_training_process.wait(timeout=5)
+                    process.wait(timeout=5)
                     print(f"批量训练任务已正常终止")
                 except subprocess.TimeoutExpired:
                     # 如果进程没有在5秒内终止，强制杀死进程组
                     print(f"批量训练任务未能正常终止，强制杀死进程组")
-                    os.killpg(os.getpgid(batch_training_process.pid), 9)  # SIGKILL
-                    batch_training_process.wait()
+                    os.killpg(os.getpgid(process.pid), 9)  # SIGKILL
+                    process.wait()
                     print(f"批量训练任务已被强制终止")
                     
             except ProcessLookupError:
                 # 进程已经不存在
-                print(f"进程 {batch_training_process.pid} 已经不存在")
+                print(f"进程 {process.pid} 已经不存在")
             except OSError as e:
                 print(f"终止进程时出错: {e}")
                 # 尝试直接杀死主进程
                 try:
-                    batch_training_process.kill()
-                    batch_training_process.wait()
+                    process.kill()
+                    process.wait()
                 except:
                     pass
-            
-            batch_training_process = None
-            batch_training_task_id = None
-            
+        
+        _update_batch_training(record, status='stopped')
+        if running:
             return jsonify({
                 'success': True,
                 'message': '批量训练任务已成功停止'
             })
         else:
             # 进程已经结束
-            batch_training_process = None
-            batch_training_task_id = None
             return jsonify({
                 'success': True,
                 'message': '批量训练任务已经结束'
@@ -2152,21 +5649,30 @@ def stop_batch_training():
 @app.route('/batch_training_status', methods=['GET'])
 def batch_training_status():
     """获取批量训练任务状态"""
-    global batch_training_process, batch_training_task_id
+    record = _load_batch_training()
+    
+    if record is not None and record['status'] == 'waiting_gpu' and _batch_training_active(record):
+        return jsonify({
+            'running': True,
+            'waiting_gpu': True,
+            'task_id': record['task_id'],
+            'pid': None,
+            'message': '批量训练任务正在等待GPU显存'
+        })
     
-    if not batch_training_process:
+    if record is None or record['status'] != 'running':
         return jsonify({
             'running': False,
-            'task_id': batch_training_task_id,
+            'task_id': record['task_id'] if record is not None and record['status'] == 'failed' else None,
             'message': '没有运行中的批量训练任务'
         })
     
-    is_running = batch_training_process.poll() is None
+    is_running = _batch_training_active(record)
     
     return jsonify({
         'running': is_running,
-        'task_id': batch_training_task_id,
-        'pid': batch_training_process.pid if is_running else None,
+        'task_id': record['task_id'],
+        'pid': record['pid'] if is_running else None,
         'message': '批量训练任务正在运行' if is_running else '批量训练任务已结束'
     })
 
@@ -0,0 +1,113 @@
+"""常驻模型进程 - 启动时加载一次模型，之后通过Unix socket接收推理任务，由 backendServer.py 启动和监控
+
+处理模块（--handler 指向的 .py 文件，放在模型目录中）需要提供:
+    load_model()                                -> 模型对象，进程启动时调用一次
+    run(model, input_paths, output_dir)         -> 可选的文本输出，结果写入 output_dir
+可选提供:
+    run_batch(model, input_paths, output_dirs)  -> 一次前向处理整个批次，第 i 个输入的结果写入 output_dirs[i]
+没有 run_batch 时按输出目录分组依次调用 run。
+input_paths 是工作区中的上传文件，与其他工作区的相同内容共享 inode，处理模块只能读取，不能原地改写。
+
+协议：每个连接发送一行JSON请求，返回一行JSON响应
+    {"op": "ping"}                                              -> {"ok": true, "pid": ..., "jobs": ...}
+    {"op": "infer", "inputs": [...], "output_dirs": [...]}      -> {"ok": true, "output": "..."}
+                                                                   或 {"ok": false, "error": "...", "output": "..."}
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+
+
+def load_handler(path):
+    """加载模型目录中的处理模块"""
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location('model_worker_handler', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def release_cuda_cache():
+    """任务结束后释放PyTorch缓存的显存（与脚本中的 CUDA_EMPTY_CACHE 一致）"""
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def run_inputs(handler, model, inputs, output_dirs):
+    """处理一批输入（可能来自多个任务），返回文本输出"""
+    if hasattr(handler, 'run_batch'):
+        return handler.run_batch(model, inputs, output_dirs) or ''
+    groups = {}
+    for path, output_dir in zip(inputs, output_dirs):
+        groups.setdefault(output_dir, []).append(path)
+    return ''.join(handler.run(model, paths, output_dir) or '' for output_dir, paths in groups.items())
+
+
+def handle_request(handler, model, request, stats):
+    """执行一个请求，返回响应内容"""
+    op = request.get('op')
+    if op == 'ping':
+        return {'ok': True, 'pid': os.getpid(), 'jobs': stats['jobs'], 'uptime': time.time() - stats['started']}
+    if op != 'infer':
+        return {'ok': False, 'error': f'未知请求: {op}'}
+
+    captured = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(captured):
+            result = run_inputs(handler, model, request['inputs'], request['output_dirs'])
+        return {'ok': True, 'output': captured.getvalue() + result}
+    except Exception:
+        return {'ok': False, 'error': traceback.format_exc(), 'output': captured.getvalue()}
+    finally:
+        stats['jobs'] += 1
+        release_cuda_cache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='常驻模型进程')
+    parser.add_argument('--handler', required=True, help='模型处理模块路径')
+    parser.add_argument('--socket', required=True, help='监听的Unix socket路径')
+    args = parser.parse_args()
+
+    # 与推理脚本一样在模型目录中运行，便于使用相对路径的权重文件
+    os.chdir(os.path.dirname(os.path.abspath(args.handler)))
+    handler = load_handler(os.path.abspath(args.handler))
+    started = time.time()
+    model = handler.load_model()
+    print(f"模型加载完成，用时 {time.time() - started:.1f} 秒", flush=True)
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(args.socket)
+    os.chmod(args.socket, 0o600)
+    server.listen(8)
+
+    stats = {'jobs': 0, 'started': started}
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            try:
+                request = json.loads(conn.makefile('rb').readline())
+            except ValueError as e:
+                response = {'ok': False, 'error': f'无效的请求: {e}'}
+            else:
+                response = handle_request(handler, model, request, stats)
+            try:
+                conn.sendall((json.dumps(response) + '\n').encode('utf-8'))
+            except OSError:
+                # 调用方已断开（超时或取消），继续处理下一个请求
+                pass
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backendServer  # noqa: E402
+
+FAKE_SCRIPT = '#!/bin/bash\nmkdir -p "{output}"\nfor f in "{input}"/*; do cp "$f" "{output}/$(basename "$f")"; done\necho done\n'
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """把各模块目录、日志目录和状态存储指向临时目录，推理脚本替换为复制输入的假脚本"""
+    for name, config in backendServer.MODULE_CONFIG.items():
+        base = tmp_path / name
+        base.mkdir()
+        script = base / 'run.sh'
+        script.write_text(FAKE_SCRIPT.format(input=base / 'input', output=base / 'output'))
+        monkeypatch.setitem(config, 'input_dir', str(base / 'input'))
+        monkeypatch.setitem(config, 'output_dir', str(base / 'output'))
+        monkeypatch.setitem(config, 'workspace_dir', str(base / 'workspaces'))
+        monkeypatch.setitem(config, 'script_path', str(script))
+        monkeypatch.setitem(config, 'worker_handler', str(base / 'worker_handler.py'))
+    monkeypatch.setattr(backendServer, 'TASK_LOG_DIR', str(tmp_path / 'task_logs'))
+    monkeypatch.setattr(backendServer, 'BLOB_STORE_DIR', str(tmp_path / 'blobs'))
+    monkeypatch.setattr(backendServer, 'USER_INPUT_BASE', str(tmp_path / 'Synthetic_NSVF'))
+    monkeypatch.setattr(backendServer, 'MODEL_WORKER_SOCKET_DIR', str(tmp_path / 'sockets'))
+    monkeypatch.setattr(backendServer, 'MODEL_WORKER_LOG_DIR', str(tmp_path / 'model_worker_logs'))
+    monkeypatch.setattr(backendServer, 'state_store', backendServer._MemoryStateStore())
+    monkeypatch.setattr(backendServer, 'workspace_expire_at', float('inf'))  # 不在测试中启动过期清理线程
+    yield backendServer
+    with backendServer.model_worker_lock:
+        workers = list(backendServer.model_workers.values())
+        backendServer.model_workers.clear()
+    for worker in workers:
+        with worker.lock:
+            worker.stop()
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
@@ -0,0 +1,71 @@
+import io
+import os
+import stat
+
+
+def test_uploads_share_content_but_stay_writable(server, tmp_path):
+    first, second = str(tmp_path / 'a.png'), str(tmp_path / 'b.png')
+    digest, deduplicated = server._save_upload(io.BytesIO(b'same content'), first)
+    assert not deduplicated
+    assert server._save_upload(io.BytesIO(b'same content'), second) == (digest, True)
+    assert os.stat(first).st_ino == os.stat(second).st_ino == os.stat(server._blob_path(digest)).st_ino
+    assert os.stat(first).st_mode & stat.S_IWUSR
+
+
+def test_copy_fallback_does_not_insert_blob(server, tmp_path, monkeypatch):
+    def no_link(source, dest):
+        raise OSError('cross-device link')
+    monkeypatch.setattr(os, 'link', no_link)
+    dest = str(tmp_path / 'a.png')
+    digest, deduplicated = server._save_upload(io.BytesIO(b'content'), dest)
+    assert not deduplicated
+    assert open(dest, 'rb').read() == b'content'
+    assert not os.path.exists(server._blob_path(digest))
+    server._prune_blob_store()
+    assert os.path.exists(dest)
+
+
+def test_prune_removes_only_unreferenced_content(server, tmp_path):
+    first, second = str(tmp_path / 'a.png'), str(tmp_path / 'b.png')
+    digest, _ = server._save_upload(io.BytesIO(b'shared'), first)
+    server._save_upload(io.BytesIO(b'shared'), second)
+    other, _ = server._save_upload(io.BytesIO(b'other'), str(tmp_path / 'c.png'))
+
+    os.remove(first)
+    server._prune_blob_store([digest])
+    assert os.path.exists(server._blob_path(digest))
+
+    os.remove(second)
+    server._prune_blob_store()
+    assert not os.path.exists(server._blob_path(digest))
+    assert os.path.exists(server._blob_path(other))
+
+
+def test_copy_on_write_gives_writers_a_private_file(server, tmp_path):
+    source = str(tmp_path / 'a.png')
+    digest, _ = server._save_upload(io.BytesIO(b'original'), source)
+    staged = str(tmp_path / 'staged.png')
+    server._copy_on_write(source, staged)
+    assert os.stat(staged).st_ino != os.stat(source).st_ino
+
+    with open(staged, 'r+b') as f:
+        f.write(b'REWRITE!')
+    assert open(source, 'rb').read() == b'original'
+    assert open(server._blob_path(digest), 'rb').read() == b'original'
+
+
+def test_folder_uploads_are_not_linked_to_shared_content(server, client):
+    workspace = {'X-Workspace-Id': 'f' * 32}
+    other = server._save_upload(io.BytesIO(b'dataset image'), os.path.join(server.BLOB_STORE_DIR, '..', 'ref.png'))[0]
+    response = client.post('/upload_folder/image', headers=workspace, data={
+        'file': (io.BytesIO(b'dataset image'), 'a.png'),
+        'relative_path': 'scene/rgb/a.png',
+        'folder_name': 'scene'
+    })
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['sha256'] == other and not body['deduplicated']
+    # 训练脚本可能原地改写数据集文件，文件夹上传的文件是独立的副本
+    assert os.stat(body['save_path']).st_nlink == 1
+    assert os.stat(server._blob_path(other)).st_nlink == 2
+    assert stat.S_IMODE(os.stat(body['save_path']).st_mode) == 0o644
@@ -0,0 +1,111 @@
+import hashlib
+import os
+
+WORKSPACE = {'X-Workspace-Id': 'c' * 32}
+CONTENT = bytes(range(256)) * 40  # 10240 字节，按 4096 分为 3 片
+
+
+def _init(client, size=len(CONTENT), chunk_size=4096):
+    response = client.post('/upload_chunks/infrared', headers=WORKSPACE,
+                           json={'filename': 'big.png', 'size': size, 'chunk_size': chunk_size})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _put(client, upload_id, index, data=None, checksum=None):
+    data = CONTENT[index * 4096:(index + 1) * 4096] if data is None else data
+    headers = dict(WORKSPACE)
+    if checksum:
+        headers['X-Chunk-SHA256'] = checksum
+    return client.put(f'/upload_chunks/infrared/{upload_id}/{index}', headers=headers, data=data)
+
+
+def test_chunks_in_any_order_complete_into_one_upload(server, client):
+    session = _init(client)
+    upload_id = session['upload_id']
+    assert session['total_chunks'] == 3
+
+    assert _put(client, upload_id, 2).status_code == 200
+    assert _put(client, upload_id, 0).status_code == 200
+
+    response = client.post(f'/upload_chunks/infrared/{upload_id}/complete', headers=WORKSPACE)
+    assert response.status_code == 409
+    assert response.get_json()['missing'] == [1]
+
+    # 校验失败的分片不算收到，重传后才算
+    bad = _put(client, upload_id, 1, checksum='0' * 64)
+    assert bad.status_code == 400
+    status = client.get(f'/upload_chunks/infrared/{upload_id}', headers=WORKSPACE).get_json()
+    assert status['received'] == [0, 2]
+    assert _put(client, upload_id, 1, checksum=hashlib.sha256(CONTENT[4096:8192]).hexdigest()).status_code == 200
+
+    response = client.post(f'/upload_chunks/infrared/{upload_id}/complete', headers=WORKSPACE)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+    input_dir, _ = server._workspace_dirs('infrared', WORKSPACE['X-Workspace-Id'])
+    assert open(os.path.join(input_dir, body['filename']), 'rb').read() == CONTENT
+
+    # 会话已删除，重复完成或再传分片都找不到会话
+    assert client.post(f'/upload_chunks/infrared/{upload_id}/complete', headers=WORKSPACE).status_code == 404
+    assert _put(client, upload_id, 0).status_code == 404
+
+
+def test_failed_complete_keeps_the_data_for_a_retry(server, client, monkeypatch):
+    session = _init(client)
+    upload_id = session['upload_id']
+    for index in range(3):
+        assert _put(client, upload_id, index).status_code == 200
+
+    original = server._link_blob
+    def failing_link(digest, tmp_path, dest_path):
+        raise OSError('disk full')
+    monkeypatch.setattr(server, '_link_blob', failing_link)
+    response = client.post(f'/upload_chunks/infrared/{upload_id}/complete', headers=WORKSPACE)
+    assert response.status_code == 500
+
+    # 数据文件已放回，会话恢复为上传中，分片和完成都可以重试
+    status = client.get(f'/upload_chunks/infrared/{upload_id}', headers=WORKSPACE).get_json()
+    assert status['status'] == 'uploading'
+    assert _put(client, upload_id, 1).status_code == 200
+
+    monkeypatch.setattr(server, '_link_blob', original)
+    response = client.post(f'/upload_chunks/infrared/{upload_id}/complete', headers=WORKSPACE)
+    assert response.status_code == 200
+    assert response.get_json()['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_lost_data_file_ends_the_upload(server, client):
+    session = _init(client)
+    upload_id = session['upload_id']
+    part_path = server.state_store.get('chunked_uploads', upload_id)['part_path']
+    os.remove(part_path)
+
+    response = _put(client, upload_id, 0)
+    assert response.status_code == 404
+    assert server.state_store.get('chunked_uploads', upload_id) is None
+
+
+def test_abort_removes_data_and_is_refused_while_completing(server, client):
+    session = _init(client)
+    upload_id = session['upload_id']
+    assert _put(client, upload_id, 0).status_code == 200
+    record = server.state_store.get('chunked_uploads', upload_id)
+
+    server.state_store.put('chunked_uploads', upload_id, dict(record, status='completing'))
+    assert client.delete(f'/upload_chunks/infrared/{upload_id}', headers=WORKSPACE).status_code == 409
+    assert _put(client, upload_id, 1).status_code == 409
+
+    server.state_store.put('chunked_uploads', upload_id, record)
+    assert client.delete(f'/upload_chunks/infrared/{upload_id}', headers=WORKSPACE).status_code == 200
+    assert not os.path.exists(record['part_path'])
+    assert not os.path.exists(record['state_path'])
+    assert _put(client, upload_id, 1).status_code == 404
+
+
+def test_uploads_are_private_to_their_workspace(server, client):
+    session = _init(client)
+    other = {'X-Workspace-Id': 'd' * 32}
+    upload_id = session['upload_id']
+    assert client.get(f'/upload_chunks/infrared/{upload_id}', headers=other).status_code == 404
+    assert client.delete(f'/upload_chunks/infrared/{upload_id}', headers=other).status_code == 404
@@ -0,0 +1,88 @@
+import io
+import os
+import zipfile
+from collections import OrderedDict
+
+import pytest
+
+
+@pytest.fixture
+def dataset(server, tmp_path, monkeypatch):
+    """图像推荐数据集指向临时目录，目录索引按修改时间轮询（不依赖inotify）"""
+    root = tmp_path / 'dataset'
+    (root / 'scene' / 'rgb').mkdir(parents=True)
+    (root / 'scene' / 'rgb' / 'a.png').write_bytes(b'a' * 100)
+    (root / 'scene' / 'b.txt').write_bytes(b'b' * 50)
+    (root / 'empty.txt').write_bytes(b'')
+    monkeypatch.setitem(server.DATASET_ARCHIVES['image'], 'dataset_dir', str(root))
+    monkeypatch.setattr(server, 'DATASET_ARCHIVE_CACHE_DIR', str(tmp_path / 'archive_cache'))
+    monkeypatch.setattr(server, 'dir_index', OrderedDict())
+    monkeypatch.setattr(server, 'dir_index_generation', {})
+    monkeypatch.setattr(server, 'dir_index_watches', {})
+    monkeypatch.setattr(server, 'dir_index_watched', {})
+    monkeypatch.setattr(server, 'dir_index_inotify', False)
+    monkeypatch.setattr(server, 'DIR_INDEX_POLL_INTERVAL', 0)
+    walks = []
+    collect = server._collect_archive_files
+    monkeypatch.setattr(server, '_collect_archive_files', lambda base_dir: walks.append(base_dir) or collect(base_dir))
+    return root, walks
+
+
+def _touch_dir(path):
+    """把目录修改时间推后一秒，避免同一时间粒度内的修改时间相同"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_archive_contains_non_empty_files(server, client, dataset):
+    response = client.get('/download_dataset/image')
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert sorted(names) == ['scene/b.txt', 'scene/rgb/a.png']
+
+
+def test_conditional_and_range_requests_reuse_the_cached_manifest(server, client, dataset, monkeypatch):
+    root, walks = dataset
+    first = client.get('/download_dataset/image')
+    etag = first.headers['ETag']
+    assert walks == [str(root)]
+
+    # 之后的请求不再遍历或stat数据集中的文件
+    def no_stat(*args, **kwargs):
+        raise AssertionError('不应逐个stat数据集文件')
+    monkeypatch.setattr(server, '_dataset_directory_manifest', no_stat)
+    assert client.get('/download_dataset/image', headers={'If-None-Match': etag}).status_code == 304
+
+    partial = client.get('/download_dataset/image', headers={'Range': 'bytes=0-9'})
+    assert partial.status_code == 206
+    assert partial.data == first.data[:10]
+    assert partial.headers['Content-Range'] == f'bytes 0-9/{len(first.data)}'
+
+    resumed = client.get('/download_dataset/image', headers={'Range': 'bytes=10-', 'If-Range': etag})
+    assert resumed.status_code == 206
+    assert partial.data + resumed.data == first.data
+    assert walks == [str(root)]
+
+
+def test_changed_directory_rebuilds_the_archive(server, client, dataset):
+    root, walks = dataset
+    etag = client.get('/download_dataset/image').headers['ETag']
+
+    (root / 'scene' / 'rgb' / 'c.png').write_bytes(b'c' * 10)
+    _touch_dir(root / 'scene' / 'rgb')
+    response = client.get('/download_dataset/image', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert 'scene/rgb/c.png' in zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert len(walks) == 2
+    # 旧版本的压缩包已删除
+    assert len(os.listdir(server.DATASET_ARCHIVE_CACHE_DIR)) == 1
+
+
+def test_missing_or_empty_dataset(server, client, dataset, monkeypatch, tmp_path):
+    (tmp_path / 'empty').mkdir()
+    monkeypatch.setitem(server.DATASET_ARCHIVES['image'], 'dataset_dir', str(tmp_path / 'empty'))
+    assert client.get('/download_dataset/image').status_code == 404
+    monkeypatch.setitem(server.DATASET_ARCHIVES['image'], 'dataset_dir', str(tmp_path / 'missing'))
+    assert client.get('/download_dataset/image').status_code == 404
@@ -0,0 +1,110 @@
+import errno
+from collections import OrderedDict
+
+import pytest
+
+
+class FakeINotify:
+    """只记录监听的假inotify；full 为 True 时模拟系统监听数量达到上限"""
+
+    def __init__(self):
+        self.watches = {}
+        self.next_wd = 1
+        self.full = False
+
+    def add_watch(self, path, mask):
+        if self.full:
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        wd = self.next_wd
+        self.next_wd += 1
+        self.watches[wd] = path
+        return wd
+
+    def rm_watch(self, wd):
+        if self.watches.pop(wd, None) is None:
+            raise OSError(errno.EINVAL, 'Invalid argument')
+
+
+@pytest.fixture
+def index(server, monkeypatch):
+    """隔离目录索引状态，并用假inotify代替真实监听（不启动事件线程）"""
+    inotify = FakeINotify()
+    monkeypatch.setattr(server, 'dir_index', OrderedDict())
+    monkeypatch.setattr(server, 'dir_index_generation', {})
+    monkeypatch.setattr(server, 'dir_index_watches', {})
+    monkeypatch.setattr(server, 'dir_index_watched', {})
+    monkeypatch.setattr(server, 'dir_index_watch_full', False)
+    monkeypatch.setattr(server, 'dir_index_inotify', inotify)
+    return inotify
+
+
+def _make_dirs(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f'dir{i}'
+        path.mkdir()
+        (path / f'file{i}.png').write_bytes(b'x')
+        paths.append(str(path))
+    return paths
+
+
+def test_index_is_bounded_and_releases_evicted_watches(server, index, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'DIR_INDEX_MAX_ENTRIES', 2)
+    first, second, third = _make_dirs(tmp_path, 3)
+
+    assert server._list_directory(first) == [{'name': 'file0.png', 'is_dir': False}]
+    server._list_directory(second)
+    server._list_directory(first)  # 最近使用，不应被淘汰
+    server._list_directory(third)
+
+    assert list(server.dir_index) == [(first, False), (third, False)]
+    assert sorted(index.watches.values()) == [first, third]
+    assert set(server.dir_index_watched) == {first, third}
+
+
+def test_watch_is_kept_while_another_index_of_the_directory_remains(server, index, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'DIR_INDEX_MAX_ENTRIES', 2)
+    first, second = _make_dirs(tmp_path, 2)
+
+    server._list_directory(first)
+    server._list_directory(first, with_stat=True)
+    server._list_directory(second)
+
+    assert list(server.dir_index) == [(first, True), (second, False)]
+    assert sorted(index.watches.values()) == [first, second]
+
+
+def test_forget_drops_indexes_and_watches_under_a_tree(server, index, tmp_path):
+    root = tmp_path / 'workspace'
+    (root / 'input').mkdir(parents=True)
+    other = tmp_path / 'workspace-other'
+    other.mkdir()
+    server._list_directory(str(root))
+    server._list_directory(str(root / 'input'), with_stat=True)
+    server._list_directory(str(other))
+
+    server._dir_index_forget(str(root))
+
+    assert list(server.dir_index) == [(str(other), False)]
+    assert list(index.watches.values()) == [str(other)]
+
+
+def test_watch_limit_falls_back_to_polling(server, index, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'DIR_INDEX_POLL_INTERVAL', 0)
+    index.full = True
+    (path,) = _make_dirs(tmp_path, 1)
+
+    assert len(server._list_directory(path)) == 1
+    assert server.dir_index[(path, False)]['watched'] is False
+    assert server.dir_index_watch_full is True
+
+    (tmp_path / 'dir0' / 'new.png').write_bytes(b'x')
+    entry = server.dir_index[(path, False)]
+    entry['mtime_ns'] -= 1  # 避免同一时间粒度内的修改时间相同
+    assert len(server._list_directory(path)) == 2
+
+    index.full = False
+    server._list_directory(path)
+    assert server.dir_index_watched == {path: 1}
+    assert server.dir_index[(path, False)]['watched'] is True
+    assert server.dir_index_watch_full is False
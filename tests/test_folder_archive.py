@@ -0,0 +1,110 @@
+import io
+import os
+import tarfile
+import zipfile
+
+from werkzeug.exceptions import ClientDisconnected
+
+WORKSPACE = {'X-Workspace-Id': 'e' * 32}
+
+
+def _tar(members, mode='w:gz'):
+    """members 为 (成员路径, 内容) 列表，内容以 '->' 开头时写为符号链接"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as archive:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            if content.startswith(b'->'):
+                info.type = tarfile.SYMTYPE
+                info.linkname = content[2:].decode()
+                archive.addfile(info)
+            else:
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+def _post(client, body, mimetype, folder_name='scene'):
+    return client.post(f'/upload_folder/image?folder_name={folder_name}', headers=WORKSPACE,
+                       data=body, content_type=mimetype)
+
+
+def _registered(server, module_name='image'):
+    return server.state_store.get('uploads', f"{WORKSPACE['X-Workspace-Id']}/{module_name}", [])
+
+
+def test_tar_members_outside_the_folder_and_links_are_skipped(server, client):
+    body = _tar([
+        ('scene/rgb/a.png', b'a'),
+        ('./scene/rgb/b.png', b'b'),
+        ('../escape.png', b'x'),
+        ('scene/../../escape.png', b'x'),
+        ('/etc/escape.png', b'x'),
+        ('scene/rgb/link.png', b'->/etc/passwd'),
+    ])
+    response = _post(client, body, 'application/gzip')
+    assert response.status_code == 200
+    manifest = response.get_json()
+    assert sorted(manifest['files']) == ['rgb/a.png', 'rgb/b.png']
+    assert sorted(manifest['skipped']) == ['../escape.png', '/etc/escape.png', 'scene/../../escape.png']
+
+    folder = os.path.join(server.USER_INPUT_BASE, 'scene')
+    assert open(os.path.join(folder, 'rgb', 'a.png'), 'rb').read() == b'a'
+    assert not os.path.lexists(os.path.join(folder, 'rgb', 'link.png'))
+    assert not os.path.exists(os.path.join(os.path.dirname(server.USER_INPUT_BASE), 'escape.png'))
+    assert len(_registered(server)) == 2
+
+
+def test_zip_members_outside_the_folder_are_skipped(server, client):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as archive:
+        archive.writestr('scene/rgb/a.png', b'a')
+        archive.writestr('../../escape.png', b'x')
+        link = zipfile.ZipInfo('scene/rgb/link.png')
+        link.external_attr = 0o120777 << 16
+        archive.writestr(link, '/etc/passwd')
+    response = _post(client, buf.getvalue(), 'application/zip')
+    assert response.status_code == 200
+    manifest = response.get_json()
+    assert manifest['files'] == ['rgb/a.png']
+    assert manifest['skipped'] == ['../../escape.png']
+
+
+def test_bzip2_and_xz_tars_are_accepted(server, client):
+    assert _post(client, _tar([('rgb/a.png', b'a')], 'w:bz2'), 'application/x-bzip2', 'bz').status_code == 200
+    assert _post(client, _tar([('rgb/a.png', b'a')], 'w:xz'), 'application/x-xz', 'xz').status_code == 200
+    assert os.path.exists(os.path.join(server.USER_INPUT_BASE, 'xz', 'rgb', 'a.png'))
+
+
+def test_truncated_stream_registers_the_files_already_extracted(server, client):
+    body = _tar([('scene/a.png', os.urandom(4096)), ('scene/b.png', os.urandom(200000))])
+    response = _post(client, body[:len(body) // 2], 'application/gzip')
+    assert response.status_code == 400
+    manifest = response.get_json()
+    assert manifest['files'] == ['a.png']
+    assert [info['cleaned_relative_path'] for info in _registered(server)] == ['a.png']
+    assert not os.path.exists(os.path.join(server.USER_INPUT_BASE, 'scene', 'b.png'))
+
+
+def test_disconnect_before_any_file_releases_the_folder(server, client, monkeypatch):
+    def disconnected(archive_type, stream):
+        raise ClientDisconnected()
+        yield
+    monkeypatch.setattr(server, '_archive_members', disconnected)
+    assert _post(client, b'', 'application/x-tar').status_code == 400
+    assert not os.path.exists(os.path.join(server.USER_INPUT_BASE, 'scene'))
+    assert server.state_store.get('upload_folders', 'scene') is None
+
+
+def test_disconnect_after_some_files_keeps_them_registered(server, client, monkeypatch):
+    def partial(archive_type, stream):
+        yield 'scene/a.png', io.BytesIO(b'a')
+        raise ClientDisconnected()
+    monkeypatch.setattr(server, '_archive_members', partial)
+    assert _post(client, b'', 'application/x-tar').status_code == 400
+    assert [info['cleaned_relative_path'] for info in _registered(server)] == ['a.png']
+
+    # 登记后可由本工作区清除缓存删除
+    client.post('/clear_cache/image', headers=WORKSPACE)
+    assert not os.path.exists(os.path.join(server.USER_INPUT_BASE, 'scene'))
+    assert server.state_store.get('upload_folders', 'scene') is None
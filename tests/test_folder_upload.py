@@ -0,0 +1,26 @@
+import io
+import os
+
+
+def _upload(client, workspace_id, folder_name, content):
+    return client.post('/upload_folder/image', headers={'X-Workspace-Id': workspace_id}, data={
+        'file': (io.BytesIO(content), 'a.png'),
+        'relative_path': f'{folder_name}/rgb/a.png',
+        'folder_name': folder_name
+    })
+
+
+def test_folder_names_belong_to_one_workspace(server, client):
+    owner, other = 'a' * 32, 'b' * 32
+    assert _upload(client, owner, 'scene', b'owner').status_code == 200
+    assert _upload(client, owner, 'scene', b'owner again').status_code == 200
+    assert _upload(client, other, 'scene', b'other').status_code == 409
+    assert _upload(client, other, '../scene', b'other').status_code == 400
+    
+    folder = os.path.join(server.USER_INPUT_BASE, 'scene')
+    client.post('/clear_cache/image', headers={'X-Workspace-Id': other})
+    assert open(os.path.join(folder, 'rgb', 'a.png'), 'rb').read() == b'owner again'
+    
+    client.post('/clear_cache/image', headers={'X-Workspace-Id': owner})
+    assert not os.path.exists(folder)
+    assert _upload(client, other, 'scene', b'other').status_code == 200
@@ -0,0 +1,135 @@
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+MB = 1024 * 1024
+
+
+class FakeNVML:
+    """实现采样用到的NVML接口的假后端，devices 为 (名称, 总显存MB, 已用显存MB) 列表"""
+    NVML_TEMPERATURE_GPU = 0
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.fail = False
+        self.init_count = 0
+
+    def nvmlInit(self):
+        self.init_count += 1
+
+    def nvmlShutdown(self):
+        pass
+
+    def nvmlDeviceGetCount(self):
+        if self.fail:
+            raise RuntimeError('driver reloaded')
+        return len(self.devices)
+
+    def nvmlDeviceGetHandleByIndex(self, index):
+        return index
+
+    def nvmlDeviceGetName(self, handle):
+        return self.devices[handle][0].encode('utf-8')
+
+    def nvmlDeviceGetMemoryInfo(self, handle):
+        _, total_mb, used_mb = self.devices[handle]
+        return SimpleNamespace(total=total_mb * MB, used=used_mb * MB, free=(total_mb - used_mb) * MB)
+
+    def nvmlDeviceGetUtilizationRates(self, handle):
+        return SimpleNamespace(gpu=42)
+
+    def nvmlDeviceGetTemperature(self, handle, sensor):
+        return 60
+
+    def nvmlDeviceGetPowerUsage(self, handle):
+        return 150000
+
+    def nvmlDeviceGetComputeRunningProcesses(self, handle):
+        return [SimpleNamespace(pid=1234, usedGpuMemory=512 * MB)]
+
+
+@pytest.fixture
+def fake_gpu(server, monkeypatch):
+    """使用假NVML，并隔离采样缓冲区和调度器状态；不启动后台采样线程"""
+    nvml = FakeNVML([('Fake GPU', 16384, 4096)])
+    monkeypatch.setattr(server, 'gpu_nvml_backend', nvml)
+    monkeypatch.setattr(server, 'gpu_samples', deque(maxlen=3))
+    monkeypatch.setattr(server, 'gpu_sample_error', None)
+    monkeypatch.setattr(server, 'gpu_last_devices', None)
+    monkeypatch.setattr(server, 'gpu_reservations', {})
+    monkeypatch.setattr(server, 'gpu_footprint_learned', {})
+    monkeypatch.setattr(server, '_ensure_gpu_sampler', lambda: None)
+    return nvml
+
+
+def test_read_devices_from_fake_nvml(server, fake_gpu):
+    devices = server._read_gpu_devices(fake_gpu)
+
+    assert len(devices) == 1
+    device = devices[0]
+    assert device['name'] == 'Fake GPU'
+    assert device['memory']['total'] == 16384 * MB
+    assert device['memory']['free'] == 12288 * MB
+    assert device['memory']['usage_percent'] == 25.0
+    assert (device['utilization'], device['temperature'], device['power']) == (42, 60, 150.0)
+    assert device['processes'] == [{'pid': 1234, 'used_memory': 512 * MB}]
+
+
+def test_sampler_keeps_bounded_history_and_serves_latest(server, fake_gpu, client):
+    state = {'nvml': None, 'loaded': False}
+    for _ in range(5):
+        assert server._gpu_sample_once(state) is None
+
+    # NVML只初始化一次，环形缓冲区只保留最近的采样
+    assert fake_gpu.init_count == 1
+    assert len(server.gpu_samples) == 3
+
+    response = client.get('/api/gpu_status')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] is True
+    assert body['gpu_count'] == 1
+    assert body['gpus'][0]['memory']['used_gb'] == 4.0
+
+    history = client.get('/api/gpu_history?window=60').get_json()
+    assert history['sample_count'] == 3
+
+
+def test_admission_uses_sampled_memory(server, fake_gpu, monkeypatch):
+    state = {'nvml': None, 'loaded': False}
+    server._gpu_sample_once(state)
+
+    with server.gpu_scheduler_lock:
+        assert server._pick_gpu_device(8192) == 0
+        assert server._pick_gpu_device(12288) is None
+
+    monkeypatch.setitem(server.GPU_TASK_FOOTPRINT_MB, 'small', 8192)
+    reservation = server._gpu_admit('small')
+    assert reservation['gpu_id'] == 0
+    with server.gpu_scheduler_lock:
+        # 已预留的显存要从可用量中扣除
+        assert server._pick_gpu_device(8192) is None
+    server._gpu_release(reservation)
+    with server.gpu_scheduler_lock:
+        assert server._pick_gpu_device(8192) == 0
+
+
+def test_sampling_error_keeps_last_good_sample(server, fake_gpu, client):
+    state = {'nvml': None, 'loaded': False}
+    server._gpu_sample_once(state)
+
+    fake_gpu.fail = True
+    error = server._gpu_sample_once(state)
+    assert error is not None and 'driver reloaded' in error['error']
+
+    # 采样失败后准入仍按最近一次成功的采样判断，而不是放开所有任务
+    with server.gpu_scheduler_lock:
+        assert server._pick_gpu_device(12288) is None
+        assert server._pick_gpu_device(8192) == 0
+    assert client.get('/api/gpu_status').status_code == 500
+
+    fake_gpu.fail = False
+    assert server._gpu_sample_once(state) is None
+    assert fake_gpu.init_count == 2
+    assert client.get('/api/gpu_status').status_code == 200
@@ -0,0 +1,29 @@
+import os
+import time
+
+
+def test_hls_rejects_names_outside_the_workspace(server, client):
+    workspace_id = 'a' * 32
+    assert server._hls_video('input', '..', workspace_id) is None
+    assert server._hls_video('input', '.hidden.mp4', workspace_id) is None
+    assert server._hls_video('input', 'clip.mp4', workspace_id) is not None
+    
+    hls_dir = os.path.join(server._workspace_root('video', workspace_id), 'hls', 'input', 'clip')
+    os.makedirs(hls_dir)
+    response = client.get('/hls/input/../index.m3u8', headers={'X-Workspace-Id': workspace_id})
+    assert response.status_code == 400
+    assert os.path.isdir(hls_dir)
+
+
+def test_interrupted_playlist_is_not_ready(server, tmp_path):
+    playlist = tmp_path / 'index.m3u8'
+    playlist.write_text('#EXTM3U\n#EXTINF:4.0,\nsegment_00000.ts\n')
+    assert server._hls_playlist_ready(str(playlist))  # 刚写入，打包可能仍在进行
+    
+    stale = time.time() - server.HLS_SEGMENT_SECONDS * 10
+    os.utime(playlist, (stale, stale))
+    assert not server._hls_playlist_ready(str(playlist))
+    
+    playlist.write_text(playlist.read_text() + '#EXT-X-ENDLIST\n')
+    os.utime(playlist, (stale, stale))
+    assert server._hls_playlist_ready(str(playlist))
@@ -0,0 +1,80 @@
+import io
+import os
+import time
+
+HANDLER = '''import os, shutil, time
+def load_model():
+    return {}
+def run_batch(model, inputs, output_dirs):
+    time.sleep(0.3)
+    for path, output_dir in zip(inputs, output_dirs):
+        shutil.copy(path, os.path.join(output_dir, 'tir_' + os.path.basename(path)))
+    with open(os.path.join(os.path.dirname(__file__), 'batches.log'), 'a') as f:
+        f.write(f'{len(inputs)} {len(set(inputs))}\\n')
+    return f'batch {len(inputs)}\\n'
+'''
+
+
+def _wait_for_job(client, job, workspace_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(job['status_url'], headers={'X-Workspace-Id': workspace_id}).get_json()
+        if status['status'] in ('succeeded', 'failed', 'cancelled'):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f'推理任务未结束: {status}')
+
+
+def _install_handler(server):
+    handler_path = server.MODULE_CONFIG['infrared']['worker_handler']
+    with open(handler_path, 'w') as f:
+        f.write(HANDLER)
+    return handler_path
+
+
+def _batches(handler_path):
+    with open(os.path.join(os.path.dirname(handler_path), 'batches.log')) as f:
+        return [tuple(int(value) for value in line.split()) for line in f]
+
+
+def test_merged_batch_of_several_jobs_succeeds(server, client, monkeypatch):
+    handler_path = _install_handler(server)
+    monkeypatch.setitem(server.MODULE_CONFIG['infrared'], 'batch_window', 0.5)
+    
+    workspaces = [os.urandom(16).hex() for _ in range(3)]
+    for index, workspace_id in enumerate(workspaces):
+        response = client.post('/upload/infrared', headers={'X-Workspace-Id': workspace_id},
+                               data={'file': (io.BytesIO(f'image {index}'.encode()), f'{index}.png')})
+        assert response.status_code == 200
+    
+    # 先占用常驻模型进程，使后面的任务在排队期间合并为一个批次
+    with server._model_worker('infrared').lock:
+        jobs = [client.post('/run_inference/infrared', headers={'X-Workspace-Id': workspace_id}).get_json()
+                for workspace_id in workspaces]
+        time.sleep(0.2)
+    
+    for job, workspace_id in zip(jobs, workspaces):
+        status = _wait_for_job(client, job, workspace_id)
+        assert status['status'] == 'succeeded', status
+        assert len(status['result']['result_images']) == 1
+    assert max(inputs for inputs, _ in _batches(handler_path)) >= 2
+
+
+def test_batch_takes_at_most_one_job_per_workspace(server, client, monkeypatch):
+    handler_path = _install_handler(server)
+    monkeypatch.setitem(server.MODULE_CONFIG['infrared'], 'batch_window', 0.5)
+    
+    workspaces = ['a' * 32, 'a' * 32, 'b' * 32]
+    for index, workspace_id in enumerate(workspaces[1:]):
+        client.post('/upload/infrared', headers={'X-Workspace-Id': workspace_id},
+                    data={'file': (io.BytesIO(f'image {index}'.encode()), f'{index}.png')})
+    
+    with server._model_worker('infrared').lock:
+        jobs = [client.post('/run_inference/infrared', headers={'X-Workspace-Id': workspace_id}).get_json()
+                for workspace_id in workspaces]
+        time.sleep(0.2)
+    
+    for job, workspace_id in zip(jobs, workspaces):
+        assert _wait_for_job(client, job, workspace_id)['status'] == 'succeeded'
+    # 同一工作区的输入不会在一个批次中重复出现
+    assert all(inputs == unique for inputs, unique in _batches(handler_path))
@@ -0,0 +1,12 @@
+import io
+
+
+def test_jobs_are_only_visible_to_their_workspace(server, client):
+    owner, other = {'X-Workspace-Id': 'a' * 32}, {'X-Workspace-Id': 'b' * 32}
+    client.post('/upload/image', headers=owner, data={'file': (io.BytesIO(b'image'), 'a.png')})
+    job = client.post('/run_inference/image', headers=owner).get_json()
+    
+    assert client.get(job['status_url'], headers=other).status_code == 404
+    assert client.post(f"/jobs/{job['job_id']}/cancel", headers=other).status_code == 404
+    status = client.get(job['status_url'], headers=owner).get_json()
+    assert status['status'] != 'cancelled'
@@ -0,0 +1,141 @@
+import io
+import os
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run_in_subprocess(code):
+    """在另一个进程中导入 backendServer 执行代码，返回标准输出"""
+    result = subprocess.run([sys.executable, '-c', 'import backendServer\n' + code], cwd=REPO,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def _wait_for_job(client, job, workspace_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(job['status_url'], headers={'X-Workspace-Id': workspace_id}).get_json()
+        if status['status'] in ('succeeded', 'failed', 'cancelled'):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f'推理任务未结束: {status}')
+
+
+def test_sqlite_store_reads_and_writes(server, tmp_path):
+    store = server._SQLiteStateStore(str(tmp_path / 'state' / 'state.db'))
+    assert store.get('ns', 'a') is None
+    assert store.get('ns', 'a', []) == []
+
+    store.put('ns', 'a', {'count': 1})
+    store.put('ns', 'b', [1, 2])
+    store.put('other', 'a', 'x')
+    assert store.items('ns') == {'a': {'count': 1}, 'b': [1, 2]}
+
+    def increment(value):
+        value['count'] += 1
+        return value
+    assert store.update('ns', 'a', increment) == {'count': 2}
+    # 返回 None 时不写入也不删除
+    assert store.update('ns', 'a', lambda value: None) is None
+    assert store.get('ns', 'a') == {'count': 2}
+
+    store.delete('ns', 'b')
+    assert list(store.items('ns')) == ['a']
+    store.clear('ns')
+    assert store.items('ns') == {}
+    assert store.get('other', 'a') == 'x'
+
+
+def test_failed_update_rolls_back(server, tmp_path):
+    store = server._SQLiteStateStore(str(tmp_path / 'state.db'))
+    store.put('ns', 'a', 1)
+
+    def fail(value):
+        raise ValueError('bad')
+    try:
+        store.update('ns', 'a', fail)
+    except ValueError:
+        pass
+    assert store.update('ns', 'a', lambda value: value + 1) == 2
+
+
+def test_writes_from_another_process_are_visible(server, tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = server._SQLiteStateStore(path)
+    store.put('ns', 'a', 1)
+
+    _run_in_subprocess(f'store = backendServer._SQLiteStateStore({path!r})\n'
+                       f'store.update("ns", "a", lambda value: value + 1)\n'
+                       f'store.put("ns", "b", {{"from": "child"}})\n')
+    assert store.items('ns') == {'a': 2, 'b': {'from': 'child'}}
+
+
+def test_only_one_store_becomes_the_executor(server, tmp_path):
+    path = str(tmp_path / 'state.db')
+    first = server._SQLiteStateStore(path)
+    second = server._SQLiteStateStore(path)
+    assert first.acquire_executor() is True
+    assert first.acquire_executor() is True
+    assert second.acquire_executor() is False
+
+    # 其他进程也不能成为执行进程
+    output = _run_in_subprocess(f'print(backendServer._SQLiteStateStore({path!r}).acquire_executor())')
+    assert output.strip() == 'False'
+
+
+def test_executor_lock_is_released_when_the_process_exits(server, tmp_path):
+    path = str(tmp_path / 'state.db')
+    output = _run_in_subprocess(f'print(backendServer._SQLiteStateStore({path!r}).acquire_executor())')
+    assert output.strip() == 'True'
+    assert server._SQLiteStateStore(path).acquire_executor() is True
+
+
+def test_job_list_reads_the_workspace_index(server, client, tmp_path, monkeypatch):
+    store = server._SQLiteStateStore(str(tmp_path / 'state.db'))
+    monkeypatch.setattr(server, 'state_store', store)
+    owner, other = 'a' * 32, 'b' * 32
+    client.post('/upload/image', headers={'X-Workspace-Id': owner}, data={'file': (io.BytesIO(b'image'), 'a.png')})
+    job = client.post('/run_inference/image', headers={'X-Workspace-Id': owner}).get_json()
+    _wait_for_job(client, job, owner)
+
+    # 其他工作进程提交的任务只存在于状态存储中
+    remote = dict(dict.fromkeys(server.INFERENCE_JOB_FIELDS), job_id='f' * 32, module='image', workspace_id=owner,
+                  status='queued', created_at='2000-01-01T00:00:00')
+    store.put('inference_jobs', remote['job_id'], remote)
+    server._index_inference_job(remote)
+    store.put('inference_jobs', 'e' * 32, dict(remote, job_id='e' * 32, workspace_id=other))
+    server._index_inference_job(dict(remote, job_id='e' * 32, workspace_id=other))
+
+    scanned = []
+    items = store.items
+    monkeypatch.setattr(store, 'items', lambda namespace: scanned.append(namespace) or items(namespace))
+    listed = client.get('/jobs', headers={'X-Workspace-Id': owner}).get_json()
+    assert [item['job_id'] for item in listed['jobs']] == [job['job_id'], remote['job_id']]
+    assert 'inference_jobs' not in scanned
+    assert client.get('/jobs?module=video', headers={'X-Workspace-Id': owner}).get_json()['count'] == 0
+
+
+def test_store_writes_do_not_hold_the_job_lock(server, client, tmp_path, monkeypatch):
+    store = server._SQLiteStateStore(str(tmp_path / 'state.db'))
+    monkeypatch.setattr(server, 'state_store', store)
+    held = []
+    for name in ('put', 'delete', 'clear', 'update'):
+        def write(*args, _write=getattr(store, name), _name=name):
+            if server.inference_job_lock._is_owned():
+                held.append((_name, args[0]))
+            return _write(*args)
+        monkeypatch.setattr(store, name, write)
+
+    workspace_id = 'c' * 32
+    client.post('/upload/image', headers={'X-Workspace-Id': workspace_id},
+                data={'file': (io.BytesIO(b'image'), 'a.png')})
+    job = client.post('/run_inference/image', headers={'X-Workspace-Id': workspace_id}).get_json()
+    assert _wait_for_job(client, job, workspace_id)['status'] == 'succeeded'
+    queued = client.post('/run_inference/image?force=1', headers={'X-Workspace-Id': workspace_id}).get_json()
+    client.post(f"/jobs/{queued['job_id']}/cancel", headers={'X-Workspace-Id': workspace_id})
+    _wait_for_job(client, queued, workspace_id)
+    assert held == []
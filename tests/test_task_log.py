@@ -0,0 +1,48 @@
+def test_carriage_return_progress_is_released_before_newline(server):
+    log = server._ProcessLog('progress')
+    try:
+        log.append(b'epoch 1\n')
+        log.append(b'\r 10%|#    |')
+        log.append(b'\r 20%|##   |')
+
+        # 回车刷新的进度行不必等到换行，最后一次刷新之前的内容都可以读取
+        data, offset = log.read(0)
+        assert data == b'epoch 1\n\r 10%|#    |\r'
+
+        log.append(b'\r 30%|###  |\r')
+        data, offset = log.read(offset)
+        assert data == b' 20%|##   |\r'
+
+        # 末尾的 \r 可能是 \r\n 的前半部分，不会把 \r\n 拆开返回
+        log.append(b'\n')
+        data, offset = log.read(offset)
+        assert data == b' 30%|###  |\r\n'
+
+        log.append(b'\r 40%')
+        log.close(0)
+        data, offset = log.read(offset)
+        assert data == b'\r 40%'
+        assert offset == log.size
+    finally:
+        log.discard()
+
+
+def test_stored_log_reader_also_splits_on_carriage_return(server):
+    log = server._ProcessLog('progress-stored')
+    try:
+        log.append(b'\r 10%\r 20%')
+        stored = server._task_log('progress-stored')
+        assert stored.read(0) == (b'\r 10%\r', 6)
+    finally:
+        log.discard()
+
+
+def test_sse_stream_shows_latest_progress_refresh(server):
+    log = server._ProcessLog('progress-sse')
+    try:
+        log.append(b'start\n\r 10%\r 20%\r 30%')
+        stream = server._sse_log_stream(log, 0, lambda: True)
+        assert next(stream) == 'retry: 3000\n\n'
+        assert next(stream) == 'id: 17\ndata: start\ndata:  20%\n\n'
+    finally:
+        log.discard()
@@ -0,0 +1,31 @@
+def _long_video_job(server, tmp_path, monkeypatch, mode):
+    """时长一小时的视频，分段转码失败；记录每次ffmpeg调用的超时时间"""
+    timeouts = []
+
+    def run(cmd, timeout=server.TRANSCODE_TIMEOUT):
+        timeouts.append(timeout)
+        return '视频转换超时'
+    monkeypatch.setattr(server, '_run_ffmpeg_command', run)
+    monkeypatch.setattr(server, '_probe_video', lambda path: {'duration': 3600.0})
+    monkeypatch.setattr(server, '_transcode_codec_args', lambda meta: (['-c:v', 'libx264'], mode if meta else 'transcode'))
+    monkeypatch.setattr(server, '_segmented_transcode', lambda job, meta, tmp_path: '分段 0 编码失败')
+    job = {'job_id': 'a' * 32, 'format': 'mp4', 'source_path': str(tmp_path / 'long.mp4'),
+           'output_path': str(tmp_path / 'out' / 'long_output_converted.mp4')}
+    return job, timeouts
+
+
+def test_single_pass_fallback_timeout_scales_with_duration(server, tmp_path, monkeypatch):
+    job, timeouts = _long_video_job(server, tmp_path, monkeypatch, 'transcode')
+    assert server._transcode_video(job) == '视频转换超时'
+    assert timeouts == [3600 * server.TRANSCODE_TIMEOUT_FACTOR]
+
+
+def test_reencode_fallback_after_remux_timeout_scales_with_duration(server, tmp_path, monkeypatch):
+    job, timeouts = _long_video_job(server, tmp_path, monkeypatch, 'remux')
+    server._transcode_video(job)
+    assert timeouts == [3600 * server.TRANSCODE_TIMEOUT_FACTOR] * 2
+
+
+def test_short_or_unknown_videos_keep_the_default_timeout(server):
+    assert server._transcode_timeout(None) == server.TRANSCODE_TIMEOUT
+    assert server._transcode_timeout(10.0) == server.TRANSCODE_TIMEOUT
@@ -0,0 +1,59 @@
+import io
+import os
+import threading
+import time
+
+
+def _upload(client, workspace_id, content=b'image'):
+    return client.post('/upload/infrared', headers={'X-Workspace-Id': workspace_id},
+                       data={'file': (io.BytesIO(content), 'a.png')})
+
+
+def test_uploads_are_isolated_per_workspace(server, client):
+    first, second = 'a' * 32, 'b' * 32
+    assert _upload(client, first).status_code == 200
+
+    assert client.get('/upload_status/infrared', headers={'X-Workspace-Id': first}).get_json()['total_files'] == 1
+    assert client.get('/upload_status/infrared', headers={'X-Workspace-Id': second}).get_json()['has_files'] is False
+
+    # 清除缓存只影响自己的工作区
+    assert _upload(client, second).status_code == 200
+    client.post('/clear_cache/infrared', headers={'X-Workspace-Id': second})
+    assert client.get('/upload_status/infrared', headers={'X-Workspace-Id': first}).get_json()['total_files'] == 1
+
+
+def test_new_visitor_gets_a_workspace_cookie(server, client):
+    response = client.get('/upload_status/infrared')
+    workspace_id = response.headers['X-Workspace-Id']
+    assert server.WORKSPACE_ID_PATTERN.match(workspace_id)
+    assert client.get('/upload_status/infrared').headers.get('X-Workspace-Id') is None
+
+
+def test_expiry_runs_in_the_background_at_most_once_per_interval(server, client, monkeypatch):
+    calls = []
+    done = threading.Event()
+    def expire():
+        calls.append(threading.current_thread().name)
+        done.set()
+    monkeypatch.setattr(server, '_expire_workspaces', expire)
+    monkeypatch.setattr(server, 'workspace_expire_at', 0)
+
+    for _ in range(3):
+        client.get('/upload_status/infrared', headers={'X-Workspace-Id': ''})
+    assert done.wait(5)
+    time.sleep(0.1)
+    assert calls == ['workspace-expiry']
+
+
+def test_expired_workspace_is_removed_with_unreferenced_uploads(server, client):
+    stale, active = 'c' * 32, 'd' * 32
+    stale_digest = _upload(client, stale, b'stale').get_json()['sha256']
+    active_digest = _upload(client, active, b'active').get_json()['sha256']
+    server.state_store.put('workspaces', stale, time.time() - (server.WORKSPACE_TTL_DAYS + 1) * 24 * 3600)
+
+    server._expire_workspaces()
+
+    assert not os.path.exists(server._workspace_root('infrared', stale))
+    assert server.state_store.get('uploads', f'{stale}/infrared') is None
+    assert not os.path.exists(server._blob_path(stale_digest))
+    assert os.path.exists(server._blob_path(active_digest))